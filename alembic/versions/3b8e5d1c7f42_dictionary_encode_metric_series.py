@@ -0,0 +1,127 @@
+"""dictionary-encode metric rows through metric_series
+
+Revision ID: 3b8e5d1c7f42
+Revises: e7a3f0c95d21
+Create Date: 2025-10-09 19:47:05.118362
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b8e5d1c7f42'
+down_revision: Union[str, None] = 'e7a3f0c95d21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+CATEGORY_SQL = (
+    "CASE WHEN endpoint = 'atracker' THEN 'productivity' ELSE 'wellness' END"
+)
+
+
+def _partition_years(bind, parent: str) -> list[int]:
+    names = bind.execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :parent"
+    ), {"parent": parent}).scalars().all()
+    return sorted(int(n[len(f"{parent}_y"):]) for n in names if n.startswith(f"{parent}_y"))
+
+
+def _rename_partitioned(bind, old: str, new: str) -> None:
+    """Rename a partitioned table with its partitions, keys and indexes."""
+    for year in _partition_years(bind, old):
+        op.execute(f"ALTER TABLE {old}_y{year} RENAME TO {new}_y{year}")
+    op.execute(f"ALTER TABLE {old}_default RENAME TO {new}_default")
+    op.execute(f"ALTER TABLE {old} RENAME TO {new}")
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    op.create_table('metric_series',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('user_id', sa.String(), nullable=False),
+        sa.Column('endpoint', sa.String(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('category', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'endpoint', 'name', name='ux_metric_series')
+    )
+    op.execute(
+        "INSERT INTO metric_series (user_id, endpoint, name, category) "
+        f"SELECT DISTINCT user_id, endpoint, name, {CATEGORY_SQL} FROM metric "
+        "ORDER BY user_id, endpoint, name"
+    )
+
+    years = _partition_years(bind, "metric")
+    _rename_partitioned(bind, "metric", "metric_wide")
+    op.execute("ALTER TABLE metric_wide RENAME CONSTRAINT metric_pkey TO metric_wide_pkey")
+    op.execute("ALTER TABLE metric_wide RENAME CONSTRAINT ux_metric_dedupe TO ux_metric_wide_dedupe")
+    op.execute("ALTER INDEX ix_metric_user_date_covering RENAME TO ix_metric_wide_user_date_covering")
+
+    op.execute("""
+        CREATE TABLE metric (
+            series_id integer NOT NULL REFERENCES metric_series (id),
+            date date NOT NULL,
+            value double precision NOT NULL,
+            CONSTRAINT metric_pkey PRIMARY KEY (series_id, date) INCLUDE (value)
+        ) PARTITION BY RANGE (date)
+    """)
+    for year in years:
+        op.execute(
+            f"CREATE TABLE metric_y{year} PARTITION OF metric "
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        )
+    op.execute("CREATE TABLE metric_default PARTITION OF metric DEFAULT")
+
+    op.execute(
+        "INSERT INTO metric (series_id, date, value) "
+        "SELECT s.id, m.date, m.value FROM metric_wide m "
+        "JOIN metric_series s ON s.user_id = m.user_id AND s.endpoint = m.endpoint AND s.name = m.name"
+    )
+    op.execute("DROP TABLE metric_wide")
+    op.execute("ANALYZE metric_series")
+    op.execute("ANALYZE metric")
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    years = _partition_years(bind, "metric")
+    _rename_partitioned(bind, "metric", "metric_narrow")
+    op.execute("ALTER TABLE metric_narrow RENAME CONSTRAINT metric_pkey TO metric_narrow_pkey")
+
+    op.execute("CREATE SEQUENCE metric_id_seq")
+    op.execute("""
+        CREATE TABLE metric (
+            id integer NOT NULL DEFAULT nextval('metric_id_seq'),
+            name varchar NOT NULL,
+            user_id varchar NOT NULL,
+            date date NOT NULL,
+            endpoint varchar NOT NULL,
+            value double precision NOT NULL,
+            CONSTRAINT metric_pkey PRIMARY KEY (id, date),
+            CONSTRAINT ux_metric_dedupe UNIQUE (user_id, date, endpoint, name)
+        ) PARTITION BY RANGE (date)
+    """)
+    op.execute("ALTER SEQUENCE metric_id_seq OWNED BY metric.id")
+    for year in years:
+        op.execute(
+            f"CREATE TABLE metric_y{year} PARTITION OF metric "
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        )
+    op.execute("CREATE TABLE metric_default PARTITION OF metric DEFAULT")
+    op.execute(
+        "CREATE INDEX ix_metric_user_date_covering ON metric (user_id, date) "
+        "INCLUDE (endpoint, name, value)"
+    )
+    op.execute(
+        "INSERT INTO metric (name, user_id, date, endpoint, value) "
+        "SELECT s.name, s.user_id, m.date, s.endpoint, m.value FROM metric_narrow m "
+        "JOIN metric_series s ON s.id = m.series_id"
+    )
+    op.execute("DROP TABLE metric_narrow")
+    op.drop_table('metric_series')
@@ -0,0 +1,60 @@
+"""create metric_rolling (7/28-day rolling statistics)
+
+Revision ID: 5f1a9c3e2d78
+Revises: 8d2c4b6a0e93
+Create Date: 2025-10-12 10:41:03.118542
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5f1a9c3e2d78'
+down_revision: Union[str, None] = '8d2c4b6a0e93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+WINDOWS = (7, 28)
+
+
+def upgrade() -> None:
+    op.create_table('metric_rolling',
+        sa.Column('series_id', sa.Integer(), nullable=False),
+        sa.Column('window_days', sa.Integer(), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('n', sa.Integer(), nullable=False),
+        sa.Column('mean', sa.Float(), nullable=False),
+        sa.Column('std', sa.Float(), nullable=True),
+        sa.Column('zscore', sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(['series_id'], ['metric_series.id']),
+        sa.PrimaryKeyConstraint(
+            'series_id', 'window_days', 'date',
+            name='metric_rolling_pkey',
+            postgresql_include=['n', 'mean', 'std', 'zscore'],
+        )
+    )
+    # Backfill existing history once; new writes are maintained incrementally by rolling_stats
+    for window in WINDOWS:
+        op.execute(f"""
+            INSERT INTO metric_rolling (series_id, window_days, date, n, mean, std, zscore)
+            SELECT series_id, {window}, date, n, mean, std,
+                   CASE WHEN std > 0 THEN (value - mean) / std END
+            FROM (
+                SELECT series_id, date, value,
+                       count(*) OVER w AS n,
+                       avg(value) OVER w AS mean,
+                       stddev_samp(value) OVER w AS std
+                FROM metric
+                WINDOW w AS (
+                    PARTITION BY series_id ORDER BY date
+                    RANGE BETWEEN INTERVAL '{window - 1} days' PRECEDING AND CURRENT ROW
+                )
+            ) s
+        """)
+
+
+def downgrade() -> None:
+    op.drop_table('metric_rolling')
@@ -0,0 +1,58 @@
+"""create metric_sample (partitioned) and metric_rollup
+
+Revision ID: 8d2c4b6a0e93
+Revises: 3b8e5d1c7f42
+Create Date: 2025-10-11 16:22:48.730415
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2c4b6a0e93'
+down_revision: Union[str, None] = '3b8e5d1c7f42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE TABLE metric_sample (
+            series_id integer NOT NULL REFERENCES metric_series (id),
+            ts timestamptz NOT NULL,
+            value real NOT NULL,
+            CONSTRAINT metric_sample_pkey PRIMARY KEY (series_id, ts) INCLUDE (value)
+        ) PARTITION BY RANGE (ts)
+    """)
+    # Later years are created on demand by db.write_samples
+    this_year = date.today().year
+    for year in (this_year, this_year + 1):
+        op.execute(
+            f"CREATE TABLE metric_sample_y{year} PARTITION OF metric_sample "
+            f"FOR VALUES FROM ('{year}-01-01 00:00:00+00') TO ('{year + 1}-01-01 00:00:00+00')"
+        )
+
+    op.create_table('metric_rollup',
+        sa.Column('series_id', sa.Integer(), nullable=False),
+        sa.Column('resolution', sa.Integer(), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('sum', sa.Float(), nullable=False),
+        sa.Column('min', sa.REAL(), nullable=False),
+        sa.Column('max', sa.REAL(), nullable=False),
+        sa.ForeignKeyConstraint(['series_id'], ['metric_series.id']),
+        sa.PrimaryKeyConstraint(
+            'series_id', 'resolution', 'bucket_start',
+            name='metric_rollup_pkey',
+            postgresql_include=['count', 'sum', 'min', 'max'],
+        )
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('metric_rollup')
+    op.execute("DROP TABLE metric_sample")
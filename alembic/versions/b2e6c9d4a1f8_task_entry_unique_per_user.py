@@ -0,0 +1,31 @@
+"""make task_entry.global_identifier unique per user
+
+Revision ID: b2e6c9d4a1f8
+Revises: 5f1a9c3e2d78
+Create Date: 2025-10-13 09:12:44.270391
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2e6c9d4a1f8'
+down_revision: Union[str, None] = '5f1a9c3e2d78'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 96eace903e4f created the constraint twice (once unnamed)
+    op.execute("ALTER TABLE task_entry DROP CONSTRAINT IF EXISTS task_entry_global_identifier_key")
+    op.drop_constraint('ux_task_entry_global_identifier', 'task_entry', type_='unique')
+    op.create_unique_constraint(
+        'ux_task_entry_user_global_identifier', 'task_entry', ['user_id', 'global_identifier']
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('ux_task_entry_user_global_identifier', 'task_entry', type_='unique')
+    op.create_unique_constraint('ux_task_entry_global_identifier', 'task_entry', ['global_identifier'])
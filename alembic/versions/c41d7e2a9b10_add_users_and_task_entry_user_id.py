@@ -0,0 +1,51 @@
+"""add users registry and task_entry.user_id
+
+Revision ID: c41d7e2a9b10
+Revises: 96eace903e4f
+Create Date: 2025-10-02 20:14:37.402118
+
+"""
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41d7e2a9b10'
+down_revision: Union[str, None] = '96eace903e4f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Existing task entries predate multi-tenancy and belong to the original single user.
+LEGACY_USER_ID = os.environ.get("LEGACY_USER_ID", "brucegarro")
+
+
+def upgrade() -> None:
+    op.create_table('users',
+        sa.Column('user_id', sa.String(), nullable=False),
+        sa.Column('display_name', sa.String(), nullable=True),
+        sa.Column('active', sa.Boolean(), server_default=sa.text('true'), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('user_id')
+    )
+    # Register everyone who already has data
+    op.execute(
+        "INSERT INTO users (user_id) "
+        "SELECT user_id FROM metric UNION SELECT user_id FROM seen_events "
+        "ON CONFLICT DO NOTHING"
+    )
+
+    op.add_column('task_entry', sa.Column('user_id', sa.String(), nullable=True))
+    op.execute(
+        sa.text("UPDATE task_entry SET user_id = :user_id").bindparams(user_id=LEGACY_USER_ID)
+    )
+    op.alter_column('task_entry', 'user_id', nullable=False)
+    op.create_index('ix_task_entry_user_start', 'task_entry', ['user_id', 'start_time'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_task_entry_user_start', table_name='task_entry')
+    op.drop_column('task_entry', 'user_id')
+    op.drop_table('users')
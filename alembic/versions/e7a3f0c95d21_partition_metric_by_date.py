@@ -0,0 +1,100 @@
+"""range-partition metric by date with a covering read index
+
+task_entry is deliberately left unpartitioned. Its natural partition key,
+start_time, would have to join every unique constraint, so one entry could
+no longer be deduplicated by its Atracker global identifier; and start_time
+changes when an entry is edited, moving rows between partitions on update.
+Its reads are already bounded by ix_task_entry_user_start.
+
+Revision ID: e7a3f0c95d21
+Revises: c41d7e2a9b10
+Create Date: 2025-10-06 21:03:12.551940
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7a3f0c95d21'
+down_revision: Union[str, None] = 'c41d7e2a9b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _create_year_partition(year: int) -> None:
+    op.execute(
+        f"CREATE TABLE IF NOT EXISTS metric_y{year} PARTITION OF metric "
+        f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+    )
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    op.execute("ALTER TABLE metric RENAME TO metric_unpartitioned")
+    # Index names are schema-wide, so move the old ones out of the way
+    op.execute("ALTER TABLE metric_unpartitioned RENAME CONSTRAINT ux_metric_dedupe TO ux_metric_dedupe_old")
+    op.execute("ALTER TABLE metric_unpartitioned RENAME CONSTRAINT metric_pkey TO metric_unpartitioned_pkey")
+
+    # Unique constraints on a partitioned table must include the partition key,
+    # hence (id, date) as the primary key; ux_metric_dedupe already contains date.
+    op.execute("""
+        CREATE TABLE metric (
+            id integer NOT NULL DEFAULT nextval('metric_id_seq'),
+            name varchar NOT NULL,
+            user_id varchar NOT NULL,
+            date date NOT NULL,
+            endpoint varchar NOT NULL,
+            value double precision NOT NULL,
+            CONSTRAINT metric_pkey PRIMARY KEY (id, date),
+            CONSTRAINT ux_metric_dedupe UNIQUE (user_id, date, endpoint, name)
+        ) PARTITION BY RANGE (date)
+    """)
+    op.execute("ALTER SEQUENCE metric_id_seq OWNED BY metric.id")
+
+    first, last = bind.execute(sa.text("SELECT min(date), max(date) FROM metric_unpartitioned")).one()
+    this_year = date.today().year
+    for year in range(min(first.year if first else this_year, this_year),
+                      max(last.year if last else this_year, this_year + 1) + 1):
+        _create_year_partition(year)
+    op.execute("CREATE TABLE metric_default PARTITION OF metric DEFAULT")
+
+    # Range reads for a user become index-only scans
+    op.execute(
+        "CREATE INDEX ix_metric_user_date_covering ON metric (user_id, date) "
+        "INCLUDE (endpoint, name, value)"
+    )
+
+    op.execute(
+        "INSERT INTO metric (id, name, user_id, date, endpoint, value) "
+        "SELECT id, name, user_id, date, endpoint, value FROM metric_unpartitioned"
+    )
+    op.execute("DROP TABLE metric_unpartitioned")
+    op.execute("ANALYZE metric")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE metric RENAME TO metric_partitioned")
+    op.execute("ALTER TABLE metric_partitioned RENAME CONSTRAINT ux_metric_dedupe TO ux_metric_dedupe_part")
+    op.execute("ALTER TABLE metric_partitioned RENAME CONSTRAINT metric_pkey TO metric_partitioned_pkey")
+    op.execute("""
+        CREATE TABLE metric (
+            id integer NOT NULL DEFAULT nextval('metric_id_seq'),
+            name varchar NOT NULL,
+            user_id varchar NOT NULL,
+            date date NOT NULL,
+            endpoint varchar NOT NULL,
+            value double precision NOT NULL,
+            CONSTRAINT metric_pkey PRIMARY KEY (id),
+            CONSTRAINT ux_metric_dedupe UNIQUE (user_id, date, endpoint, name)
+        )
+    """)
+    op.execute("ALTER SEQUENCE metric_id_seq OWNED BY metric.id")
+    op.execute(
+        "INSERT INTO metric (id, name, user_id, date, endpoint, value) "
+        "SELECT id, name, user_id, date, endpoint, value FROM metric_partitioned"
+    )
+    op.execute("DROP TABLE metric_partitioned CASCADE")
@@ -0,0 +1,171 @@
+"""Lagged correlations between a user's daily metrics (e.g. sleep vs next-day task hours).
+
+Results are cached in Redis under the user's data version, so repeat requests
+are a single GET until new metrics land.
+"""
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from array import array
+from datetime import date
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from db import aiter_metrics, aload_user_series, series_cache
+from data_version import aget_data_version
+from singleflight import SingleFlight
+
+# Keys embed the data version, so the TTL only bounds how long unused results linger
+ANALYTICS_CACHE_TTL_SECONDS = int(os.getenv("ANALYTICS_CACHE_TTL_SECONDS", str(30 * 24 * 60 * 60)))
+ANALYTICS_MIN_PERIODS = int(os.getenv("ANALYTICS_MIN_PERIODS", "14"))
+# Request bounds: the days x series matrix has to fit in the web container
+ANALYTICS_MAX_DAYS = int(os.getenv("ANALYTICS_MAX_DAYS", str(3 * 366)))
+ANALYTICS_MAX_LAGS = int(os.getenv("ANALYTICS_MAX_LAGS", "8"))
+ANALYTICS_MAX_ABS_LAG = int(os.getenv("ANALYTICS_MAX_ABS_LAG", "30"))
+
+_flight = SingleFlight()
+
+
+class MetricColumns:
+    """(series_id, date, value) rows appended into three typed arrays.
+
+    About 20 bytes a row instead of a tuple of Python objects, and numpy
+    reads the arrays in place.
+    """
+
+    def __init__(self, start_date: date):
+        self.start_date = start_date
+        self.series_ids = array("q")
+        self.day_offsets = array("i")
+        self.values = array("d")
+
+    def append(self, series_id: int, day: date, value: float) -> None:
+        self.series_ids.append(series_id)
+        self.day_offsets.append((day - self.start_date).days)
+        self.values.append(value)
+
+
+def day_matrix(rows, start_date: date, end_date: date) -> tuple[np.ndarray, List[int]]:
+    """Pivot (series_id, date, value) rows into a days x series float matrix (NaN = missing)."""
+    if not isinstance(rows, MetricColumns):
+        columns = MetricColumns(start_date)
+        for series_id, day, value in rows:
+            columns.append(series_id, day, value)
+        rows = columns
+    series_ids, col = np.unique(np.asarray(rows.series_ids), return_inverse=True)
+    matrix = np.full(((end_date - start_date).days + 1, len(series_ids)), np.nan)
+    matrix[np.asarray(rows.day_offsets), col] = np.asarray(rows.values)
+    return matrix, series_ids.tolist()
+
+
+def lagged_corr(x: np.ndarray, y: np.ndarray, lag: int, min_periods: int = ANALYTICS_MIN_PERIODS):
+    """Pearson r between x[t] and y[t + lag] for every column pair, pairwise-complete.
+
+    Everything is a handful of matrix products, so hundreds of series over
+    years of days is milliseconds. Returns (r, n); r is NaN where n < min_periods.
+    """
+    if lag > 0:
+        x, y = x[:-lag], y[lag:]
+    elif lag < 0:
+        x, y = x[-lag:], y[:lag]
+    mx, my = ~np.isnan(x), ~np.isnan(y)
+    fx, fy = mx.astype(float), my.astype(float)
+    xz, yz = np.where(mx, x, 0.0), np.where(my, y, 0.0)
+
+    n = fx.T @ fy
+    sx, sy = xz.T @ fy, fx.T @ yz
+    sxx, syy = (xz * xz).T @ fy, fx.T @ (yz * yz)
+    sxy = xz.T @ yz
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = sxy - sx * sy / n
+        var = (sxx - sx * sx / n) * (syy - sy * sy / n)
+        r = cov / np.sqrt(var)
+    r[(n < min_periods) | ~(var > 0)] = np.nan
+    return r, n.astype(int)
+
+
+def _label(series_id: int) -> str:
+    info = series_cache.get(series_id)
+    return f"{info.endpoint}.{info.name}"
+
+
+def compute_correlations(
+    rows,
+    start_date: date,
+    end_date: date,
+    lags: Sequence[int],
+    x_category: str,
+    y_category: str,
+    min_periods: int,
+) -> Dict:
+    matrix, series_ids = day_matrix(rows, start_date, end_date)
+    x_cols = [i for i, s in enumerate(series_ids) if series_cache.get(s).category == x_category]
+    y_cols = [i for i, s in enumerate(series_ids) if series_cache.get(s).category == y_category]
+    result = {
+        "x": [_label(series_ids[i]) for i in x_cols],
+        "y": [_label(series_ids[i]) for i in y_cols],
+        "lags": {},
+    }
+    for lag in lags:
+        r, n = lagged_corr(matrix[:, x_cols], matrix[:, y_cols], lag, min_periods)
+        result["lags"][str(lag)] = {
+            # NaN isn't JSON; None marks "not enough overlapping days"
+            "r": [[None if np.isnan(v) else round(float(v), 4) for v in row] for row in r],
+            "n": n.tolist(),
+        }
+    return result
+
+
+async def _load_and_compute(user_id, start_date, end_date, lags, x_category, y_category, min_periods) -> Dict:
+    rows = MetricColumns(start_date)
+    unknown = False
+    async for series_id, day, value in aiter_metrics(user_id, start_date, end_date):
+        rows.append(series_id, day, value)
+        unknown = unknown or series_cache.get(series_id) is None
+    if unknown:
+        await aload_user_series(user_id)
+    # numpy releases the GIL in the matmuls; keep the loop free regardless
+    return await asyncio.to_thread(
+        compute_correlations, rows, start_date, end_date, lags, x_category, y_category, min_periods,
+    )
+
+
+async def get_correlations(
+    user_id: str,
+    start_date: date,
+    end_date: date,
+    lags: Sequence[int] = (0, 1),
+    x_category: str = "wellness",
+    y_category: str = "productivity",
+    min_periods: int = ANALYTICS_MIN_PERIODS,
+    redis_client=None,
+) -> Dict:
+    """Correlate x-category metrics on day N with y-category metrics on day N + lag."""
+    logger = logging.getLogger("analytics")
+    if redis_client is None:
+        from auth.cache import get_async_redis  # lazy import
+        redis_client = get_async_redis()
+    version = await aget_data_version(user_id, redis_client)
+    params = json.dumps(
+        [str(start_date), str(end_date), sorted(set(lags)), x_category, y_category, min_periods]
+    )
+    digest = hashlib.sha1(params.encode()).hexdigest()[:16]
+    key = f"analytics:corr:{user_id}:{version}:{digest}"
+
+    cached: Optional[str] = await redis_client.get(key)
+    if cached:
+        return json.loads(cached)
+
+    async def compute():
+        result = await _load_and_compute(
+            user_id, start_date, end_date, sorted(set(lags)), x_category, y_category, min_periods,
+        )
+        result["version"] = version
+        await redis_client.set(key, json.dumps(result), ex=ANALYTICS_CACHE_TTL_SECONDS)
+        logger.info(f"Computed correlations for user {user_id} (version {version}, lags {sorted(set(lags))})")
+        return result
+
+    return await _flight.do(key, compute)
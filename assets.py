@@ -0,0 +1,142 @@
+"""Fingerprint and precompress the dashboard's static assets.
+
+Run at image build time (the prod container filesystem is read-only):
+    python -m assets
+
+Writes static/dist/ with content-hashed css/js (plus .gz/.br variants) and a
+dashboard.html that points at them. PrecompressedStaticFiles serves the
+variants by Accept-Encoding; hashed files get immutable cache headers, the
+HTML is revalidated on every load.
+"""
+import os
+import re
+import sys
+import gzip
+import json
+import stat
+import shutil
+import hashlib
+import logging
+import mimetypes
+from typing import Optional
+
+import anyio
+from starlette.staticfiles import StaticFiles
+
+STATIC_DIR = os.getenv("STATIC_DIR", "static")
+DIST_SUBDIR = "dist"
+FINGERPRINTED_EXTS = (".css", ".js")
+# name.<12 hex>.ext, as produced by build()
+FINGERPRINT_RE = re.compile(r"\.[0-9a-f]{12}\.(css|js)$")
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+# (Accept-Encoding token, file suffix), preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _write_compressed(path: str) -> None:
+    with open(path, "rb") as f:
+        data = f.read()
+    # mtime=0 keeps builds reproducible (same bytes -> same ETag)
+    with open(path + ".gz", "wb") as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    try:
+        import brotli  # lazy import (optional: gzip-only without it)
+    except ImportError:
+        logging.getLogger("assets").warning("brotli not installed; skipping .br variants")
+        return
+    with open(path + ".br", "wb") as f:
+        f.write(brotli.compress(data, quality=11))
+
+
+def build(static_dir: str = STATIC_DIR) -> dict[str, str]:
+    """Build static/dist; returns the manifest {original path: fingerprinted path}."""
+    logger = logging.getLogger("assets")
+    dist = os.path.join(static_dir, DIST_SUBDIR)
+    shutil.rmtree(dist, ignore_errors=True)
+    manifest: dict[str, str] = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != dist]
+        for name in sorted(files):
+            if not name.endswith(FINGERPRINTED_EXTS):
+                continue
+            src = os.path.join(root, name)
+            rel = os.path.relpath(src, static_dir).replace(os.sep, "/")
+            with open(src, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:12]
+            stem, ext = os.path.splitext(rel)
+            hashed = f"{DIST_SUBDIR}/{stem}.{digest}{ext}"
+            out = os.path.join(static_dir, hashed)
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            shutil.copyfile(src, out)
+            _write_compressed(out)
+            manifest[rel] = hashed
+
+    with open(os.path.join(static_dir, "dashboard.html"), encoding="utf-8") as f:
+        html = f.read()
+    for rel, hashed in manifest.items():
+        html = html.replace(f"/static/{rel}", f"/static/{hashed}")
+    html_out = os.path.join(dist, "dashboard.html")
+    os.makedirs(dist, exist_ok=True)
+    with open(html_out, "w", encoding="utf-8") as f:
+        f.write(html)
+    _write_compressed(html_out)
+
+    with open(os.path.join(dist, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    logger.info(f"Built {len(manifest)} fingerprinted assets into {dist}")
+    return manifest
+
+
+def _accepted_encodings(scope) -> set[str]:
+    accepted = set()
+    for name, value in scope.get("headers", []):
+        if name != b"accept-encoding":
+            continue
+        for part in value.decode("latin-1").split(","):
+            token, _, params = part.strip().partition(";")
+            key, _, q = params.strip().partition("=")
+            try:
+                if key.strip() == "q" and float(q) == 0:
+                    continue  # explicitly refused
+            except ValueError:
+                pass
+            accepted.add(token.strip().lower())
+    return accepted
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves prebuilt .br/.gz siblings and sets cache headers."""
+
+    async def get_response(self, path: str, scope):
+        response = None
+        accepted = _accepted_encodings(scope)
+        for encoding, suffix in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+            if stat_result and stat.S_ISREG(stat_result.st_mode):
+                response = self.file_response(full_path, stat_result, scope)
+                response.headers["content-encoding"] = encoding
+                media_type = mimetypes.guess_type(path)[0]
+                if media_type:
+                    response.headers["content-type"] = (
+                        f"{media_type}; charset=utf-8" if media_type.startswith("text/") else media_type
+                    )
+                break
+        if response is None:
+            response = await super().get_response(path, scope)
+        response.headers["vary"] = "Accept-Encoding"
+        response.headers["cache-control"] = IMMUTABLE_CACHE if FINGERPRINT_RE.search(path) else "no-cache"
+        return response
+
+
+def built_dashboard(static_dir: str = STATIC_DIR) -> Optional[str]:
+    """Path (relative to static_dir) of the built dashboard page, if `python -m assets` ran."""
+    rel = f"{DIST_SUBDIR}/dashboard.html"
+    return rel if os.path.isfile(os.path.join(static_dir, rel)) else None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    build()
+    sys.exit(0)
@@ -1,5 +1,12 @@
+"""Auth-related shared utilities."""
+
 import os
-from typing import Optional
+import json
+import time
+import uuid
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Tuple
 
 from redis.asyncio import Redis
 
@@ -8,6 +15,20 @@ from redis.asyncio import Redis
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 REDIS_TTL_SECONDS = int(os.getenv("REDIS_TTL_SECONDS", str(24 * 60 * 60)))
 
+# In-process tier in front of Redis. Other processes are told to drop their
+# copy through AUTH_INVALIDATE_CHANNEL whenever a token is written or deleted.
+AUTH_LOCAL_TTL_SECONDS = int(os.getenv("AUTH_LOCAL_TTL_SECONDS", "300"))
+AUTH_INVALIDATE_CHANNEL = "auth:invalidate"
+_ORIGIN = uuid.uuid4().hex
+
+# Compare-and-delete so a lock is only released by the holder that set it.
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
 _redis_client: Optional[Redis] = None
 
 
@@ -18,6 +39,163 @@ def get_async_redis() -> Redis:
     return _redis_client
 
 
+def reset_async_redis() -> None:
+    """Forget pooled connections (they belong to a closed event loop or a parent process).
+
+    Modules keep a reference to the shared client, so its pool is emptied in place.
+    """
+    if _redis_client is not None:
+        _redis_client.connection_pool.reset()
+
+
+os.register_at_fork(after_in_child=reset_async_redis)
+
+
 def auth_key(provider: str, user_id: str) -> str:
     return f"auth:{provider}:token:{user_id}"
 
+
+class LocalTokenCache:
+    """Process-local TTL cache of decoded token dicts.
+
+    An entry lives until the earlier of the local TTL and the token's own
+    `expires_at`, so an expired token is never served from memory.
+    """
+
+    def __init__(self, ttl_seconds: int = AUTH_LOCAL_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        deadline, token = entry
+        if time.time() >= deadline:
+            self._entries.pop(key, None)
+            return None
+        return dict(token)
+
+    def put(self, key: str, token: Dict[str, Any]) -> None:
+        deadline = time.time() + self.ttl_seconds
+        expires_at = token.get("expires_at")
+        if isinstance(expires_at, (int, float)):
+            deadline = min(deadline, float(expires_at))
+        if deadline <= time.time():
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = (deadline, dict(token))
+
+    def invalidate(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+local_tokens = LocalTokenCache()
+
+
+async def _publish_invalidation(redis_client, key: str) -> None:
+    try:
+        await redis_client.publish(AUTH_INVALIDATE_CHANNEL, f"{_ORIGIN} {key}")
+    except Exception:
+        # Best effort: peers still fall back to their local TTL
+        logging.getLogger("auth_cache").warning(f"Could not publish invalidation for {key}")
+
+
+async def _drop_status_section(redis_client, key: str) -> None:
+    # auth:<provider>:token:<user_id>; the cached /health status for it is now stale
+    prefix, provider, kind, user_id = (key.split(":", 3) + ["", "", ""])[:4]
+    if prefix != "auth" or kind != "token":
+        return
+    try:
+        from status_snapshot import adrop_auth_section  # lazy import
+        await adrop_auth_section(provider, user_id, redis_client)
+    except Exception:
+        logging.getLogger("auth_cache").warning(f"Could not drop status snapshot for {key}")
+
+
+def refresh_lock_key(provider: str, user_id: str) -> str:
+    return f"locks:auth:{provider}:refresh:{user_id}"
+
+
+async def acquire_lock(key: str, ttl: int, redis_client=None) -> Optional[str]:
+    """SET NX a random owner token; returns it when the lock was acquired."""
+    if redis_client is None:
+        redis_client = get_async_redis()
+    owner = uuid.uuid4().hex
+    acquired = await redis_client.set(key, owner, ex=ttl, nx=True)
+    return owner if acquired else None
+
+
+async def release_lock(key: str, owner: str, redis_client=None) -> None:
+    if redis_client is None:
+        redis_client = get_async_redis()
+    await redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, key, owner)
+
+
+async def get_token(key: str, redis_client=None, fresh: bool = False) -> Optional[Dict[str, Any]]:
+    """Read a token dict, from memory when possible, otherwise from Redis.
+
+    `fresh=True` skips the local tier, e.g. to see a refresh token another
+    process has just rotated.
+    """
+    token = None if fresh else local_tokens.get(key)
+    if token is not None:
+        return token
+    if redis_client is None:
+        redis_client = get_async_redis()
+    raw = await redis_client.get(key)
+    if not raw:
+        return None
+    token = json.loads(raw)
+    local_tokens.put(key, token)
+    return token
+
+
+async def set_token(key: str, token: Dict[str, Any], ttl: int = REDIS_TTL_SECONDS, redis_client=None) -> None:
+    if redis_client is None:
+        redis_client = get_async_redis()
+    await redis_client.set(key, json.dumps(token), ex=ttl)
+    local_tokens.put(key, token)
+    await _publish_invalidation(redis_client, key)
+    await _drop_status_section(redis_client, key)
+
+
+async def delete_token(key: str, redis_client=None) -> None:
+    if redis_client is None:
+        redis_client = get_async_redis()
+    await redis_client.delete(key)
+    local_tokens.invalidate(key)
+    await _publish_invalidation(redis_client, key)
+    await _drop_status_section(redis_client, key)
+
+
+async def listen_for_invalidations(redis_client=None, retry_seconds: float = 5.0) -> None:
+    """Evict local entries written by other processes. Runs for the app's lifetime."""
+    logger = logging.getLogger("auth_cache")
+    if redis_client is None:
+        redis_client = get_async_redis()
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(AUTH_INVALIDATE_CHANNEL)
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                origin, _, key = str(message["data"]).partition(" ")
+                if origin != _ORIGIN:
+                    local_tokens.invalidate(key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Messages may have been missed while disconnected; start cold.
+            logger.warning(f"Auth invalidation listener disconnected: {e}")
+            local_tokens.clear()
+            await asyncio.sleep(retry_seconds)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
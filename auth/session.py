@@ -0,0 +1,101 @@
+"""Who is asking: signed session cookies, one-time login links and OAuth state.
+
+With SESSION_SECRET unset the app is single-user and every request is
+DASHBOARD_USER_ID. With it set, every per-user route needs a session cookie,
+which is issued by a one-time login link:
+
+    python -m auth.session alice     # prints /login?token=...
+
+OAuth flows carry a random nonce as their state. The nonce maps to the user
+server-side, expires after OAUTH_STATE_TTL_SECONDS and is consumed by the
+callback, so a state can't be forged, replayed or minted for someone else.
+"""
+import os
+import sys
+import hmac
+import time
+import hashlib
+import secrets
+from typing import Optional
+from urllib.parse import urlencode
+
+SESSION_SECRET = os.getenv("SESSION_SECRET")
+SESSION_COOKIE = "session"
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(30 * 24 * 60 * 60)))
+LOGIN_LINK_TTL_SECONDS = int(os.getenv("LOGIN_LINK_TTL_SECONDS", "900"))
+OAUTH_STATE_TTL_SECONDS = int(os.getenv("OAUTH_STATE_TTL_SECONDS", "600"))
+
+
+def sessions_enabled() -> bool:
+    return bool(SESSION_SECRET)
+
+
+def _signature(purpose: str, user_id: str, expires_at: int) -> str:
+    message = f"{purpose}:{expires_at}:{user_id}".encode()
+    return hmac.new(SESSION_SECRET.encode(), message, hashlib.sha256).hexdigest()
+
+
+def _sign(purpose: str, user_id: str, ttl: int) -> str:
+    if not sessions_enabled():
+        raise RuntimeError("SESSION_SECRET must be set to issue sessions")
+    expires_at = int(time.time()) + ttl
+    return f"{expires_at}.{user_id}.{_signature(purpose, user_id, expires_at)}"
+
+
+def _verify(purpose: str, value: Optional[str]) -> Optional[str]:
+    if not value or not sessions_enabled():
+        return None
+    expires_at, _, rest = value.partition(".")
+    user_id, _, sig = rest.rpartition(".")
+    if not user_id or not expires_at.isdigit() or int(expires_at) <= time.time():
+        return None
+    if not hmac.compare_digest(_signature(purpose, user_id, int(expires_at)), sig):
+        return None
+    return user_id
+
+
+def sign_session(user_id: str, ttl: int = SESSION_TTL_SECONDS) -> str:
+    return _sign("session", user_id, ttl)
+
+
+def verify_session(value: Optional[str]) -> Optional[str]:
+    """The user a session cookie was issued to, or None if it is missing, forged or expired."""
+    return _verify("session", value)
+
+
+def login_token(user_id: str, ttl: int = LOGIN_LINK_TTL_SECONDS) -> str:
+    return _sign("login", user_id, ttl)
+
+
+async def consume_login_token(token: str, redis_client) -> Optional[str]:
+    """Verify a login link and burn it, so a leaked link only works once."""
+    user_id = _verify("login", token)
+    if user_id is None:
+        return None
+    used = await redis_client.set(f"session:login:used:{token.rpartition('.')[2]}", "1",
+                                  ex=LOGIN_LINK_TTL_SECONDS, nx=True)
+    return user_id if used else None
+
+
+def _state_key(provider: str, state: str) -> str:
+    return f"oauth:state:{provider}:{state}"
+
+
+async def issue_oauth_state(provider: str, user_id: str, redis_client) -> str:
+    state = secrets.token_urlsafe(24)
+    await redis_client.set(_state_key(provider, state), user_id, ex=OAUTH_STATE_TTL_SECONDS)
+    return state
+
+
+async def consume_oauth_state(provider: str, state: str, redis_client) -> Optional[str]:
+    """The user who started this flow, once; None for unknown, expired or reused states."""
+    user_id = await redis_client.getdel(_state_key(provider, state))
+    if isinstance(user_id, bytes):
+        user_id = user_id.decode()
+    return user_id or None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m auth.session <user_id>")
+    print(f"/login?{urlencode({'token': login_token(sys.argv[1])})}")
@@ -0,0 +1,276 @@
+"""Load test for the dashboard's web endpoints: throughput and p50/p95/p99 latency.
+
+In-process (default) it drives the ASGI app directly, with Redis replaced by
+an in-memory fake through the same dependency override tests/test_health.py
+uses and the metrics pivot read from DATABASE_URL (or stubbed, --stub-db).
+With --url it drives a running server instead (gunicorn/uvicorn):
+
+    python benchmarks/loadtest.py --concurrency 50 --duration 20
+    python benchmarks/loadtest.py --snapshot cold            # every /health rebuilds
+    python benchmarks/loadtest.py --url http://localhost:8000 --concurrency 100
+    python benchmarks/loadtest.py --compare benchmarks/results/<earlier>.json
+
+In-process numbers include the client's own CPU (same event loop), so they
+are a floor for one worker. Each run is saved under benchmarks/results/.
+"""
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
+import subprocess
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+sys.path.insert(0, ROOT)
+
+DEFAULT_PATHS = ["/health", "/dashboard", "assets"]
+
+
+class MemoryRedis:
+    """In-memory stand-in for the async Redis client, enough for /health."""
+
+    def __init__(self, cold: bool = False):
+        self.cold = cold
+        self.values: Dict[str, str] = {}
+        self.hashes: Dict[str, Dict[str, str]] = defaultdict(dict)
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    async def hgetall(self, key):
+        return {} if self.cold else dict(self.hashes.get(key, {}))
+
+    async def hset(self, key, mapping):
+        self.hashes[key].update(mapping)
+
+    async def hdel(self, key, *fields):
+        for field in fields:
+            self.hashes[key].pop(field, None)
+
+    async def expire(self, key, seconds):
+        return True
+
+
+def asset_paths() -> List[str]:
+    """Fingerprinted assets when `python -m assets` has run, else the source css/js."""
+    from assets import DIST_SUBDIR, STATIC_DIR
+    manifest = os.path.join(ROOT, STATIC_DIR, DIST_SUBDIR, "manifest.json")
+    if os.path.isfile(manifest):
+        with open(manifest) as f:
+            return [f"/static/{p}" for p in sorted(json.load(f).values())]
+    paths = []
+    for root, _dirs, files in os.walk(os.path.join(ROOT, STATIC_DIR)):
+        for name in sorted(files):
+            if name.endswith((".css", ".js")):
+                paths.append("/static/" + os.path.relpath(os.path.join(root, name), os.path.join(ROOT, STATIC_DIR)))
+    return paths
+
+
+def in_process_app(cold: bool = False, stub_db: bool = False):
+    """main.app wired for load testing: fake Redis, default user, no job enqueueing, fixed auth status."""
+    import logging
+    import main
+    # per-request INFO logging would dominate the measurement
+    logging.getLogger().setLevel(logging.WARNING)
+
+    async def version(user_id, redis_client=None):
+        return 1
+
+    async def oura_status(user_id, redis_client):
+        return {"valid": True, "auth_url": None, "expires_at": None}
+
+    async def dropbox_status(user_id):
+        return {"valid": True, "auth_url": None, "expires_at": None}
+
+    async def no_ingestion(*args, **kwargs):
+        pass
+
+    redis = MemoryRedis(cold=cold)
+    main.app.dependency_overrides[main.get_redis_client] = lambda: redis
+    # measure the single-user path whether or not SESSION_SECRET is set here
+    main.app.dependency_overrides[main.get_user_id] = lambda: main.DEFAULT_USER_ID
+    main.aget_data_version = version
+    main._oura_status = oura_status
+    main._dropbox_status = dropbox_status
+    main._start_ingestion = no_ingestion
+    if stub_db:
+        async def metrics_status(user_id, data_version, start, end):
+            from status_snapshot import metrics_section
+            return metrics_section(data_version, start, end, [])
+        main._metrics_status = metrics_status
+    return main.app
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list (q in 0..100)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+    }
+
+
+async def run_load(
+    client,
+    paths: List[str],
+    concurrency: int,
+    duration: Optional[float] = None,
+    total_requests: Optional[int] = None,
+) -> dict:
+    """Each of `concurrency` workers requests paths round-robin until time or count runs out."""
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    issued = 0
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def worker(offset: int):
+        nonlocal issued
+        i = offset
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            if total_requests is not None:
+                if issued >= total_requests:
+                    return
+                issued += 1
+            path = paths[i % len(paths)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                response = await client.get(path, headers={"Accept-Encoding": "br, gzip"})
+                ok = response.status_code < 400
+            except Exception:
+                ok = False
+            latencies[path].append(time.perf_counter() - start)
+            if not ok:
+                errors[path] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    everything = [v for values in latencies.values() for v in values]
+    return {
+        "elapsed_seconds": round(elapsed, 2),
+        "overall": summarize(everything, sum(errors.values()), elapsed),
+        "paths": {p: summarize(latencies[p], errors[p], elapsed) for p in sorted(latencies)},
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def save(result: dict, results_dir: str = RESULTS_DIR) -> str:
+    os.makedirs(results_dir, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(results_dir, f"loadtest-{stamp}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    return path
+
+
+def report(result: dict, baseline: Optional[dict] = None) -> None:
+    def line(name: str, s: dict, base: Optional[dict]) -> str:
+        text = (f"{name:<44} {s['requests']:>7} req {s['rps']:>8} req/s  "
+                f"p50 {s['p50_ms']:>7}ms  p95 {s['p95_ms']:>7}ms  p99 {s['p99_ms']:>7}ms  errors {s['errors']}")
+        if base:
+            text += f"  (rps {s['rps'] - base['rps']:+.1f}, p95 {s['p95_ms'] - base['p95_ms']:+.2f}ms)"
+        return text
+
+    base_paths = (baseline or {}).get("paths", {})
+    print(line("overall", result["overall"], (baseline or {}).get("overall")))
+    for path, stats in result["paths"].items():
+        print(line(path, stats, base_paths.get(path)))
+
+
+async def _run(args) -> dict:
+    import httpx  # lazy import
+    paths = []
+    for p in args.paths.split(","):
+        paths.extend(asset_paths() if p == "assets" else [p])
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=30, limits=httpx.Limits(max_connections=args.concurrency))
+    else:
+        app = in_process_app(cold=args.snapshot == "cold", stub_db=args.stub_db)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest")
+    async with client:
+        if args.warmup:
+            await run_load(client, paths, 1, total_requests=args.warmup)
+        result = await run_load(
+            client, paths, args.concurrency,
+            duration=None if args.requests else args.duration,
+            total_requests=args.requests or None,
+        )
+    result["params"] = {
+        "target": args.url or "in-process",
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "requests": args.requests,
+        "snapshot": args.snapshot,
+        "stub_db": args.stub_db,
+        "paths": paths,
+    }
+    result["commit"] = _git_commit()
+    result["finished_at"] = datetime.now(timezone.utc).isoformat()
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=None, help="drive a running server instead of the in-process app")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds (ignored with --requests)")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests")
+    parser.add_argument("--warmup", type=int, default=20, help="sequential requests before measuring")
+    parser.add_argument("--paths", default=",".join(DEFAULT_PATHS), help="comma-separated; 'assets' = static css/js")
+    parser.add_argument("--snapshot", choices=("warm", "cold"), default="warm",
+                        help="cold: /health never finds a status snapshot (in-process only)")
+    parser.add_argument("--stub-db", action="store_true", help="skip Postgres; /health serves an empty pivot")
+    parser.add_argument("--compare", default=None, help="earlier results JSON to diff against")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args(argv)
+
+    if not args.url and not args.stub_db and not os.getenv("DATABASE_URL"):
+        parser.error("in-process runs read metrics from DATABASE_URL; set it or pass --stub-db")
+
+    result = asyncio.run(_run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(result, baseline)
+    if not args.no_save:
+        print(f"saved {save(result)}")
+    return 1 if result["overall"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
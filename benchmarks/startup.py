@@ -0,0 +1,83 @@
+"""Cold-start cost of the web process: import time and RSS of `import main`.
+
+Each run is a fresh interpreter with no DATABASE_URL/Oura settings, so it also
+proves the app imports without them. Exits non-zero over the given budgets:
+    python benchmarks/startup.py --runs 5 --max-rss-mb 60 --max-import-seconds 1.5
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must stay out of a freshly imported web process
+HEAVY_MODULES = [
+    "sqlalchemy", "rq", "oura", "requests", "boto3", "polars",
+    "numpy", "pyarrow", "dropbox", "db", "jobs",
+]
+
+_PROBE = f"""
+import json, resource, sys, time
+t = time.perf_counter()
+import main
+imported = time.perf_counter() - t
+
+import asyncio
+async def status():
+    sent = []
+    async def receive():
+        return {{"type": "http.request", "body": b""}}
+    async def send(message):
+        sent.append(message)
+    scope = {{"type": "http", "method": "GET", "path": "/status", "headers": [],
+             "query_string": b"", "root_path": "", "scheme": "http", "server": ("x", 80)}}
+    await main.app(scope, receive, send)
+    return sent[0]["status"]
+code = asyncio.run(status())
+
+print(json.dumps({{
+    "import_seconds": imported,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "status": code,
+    "heavy_loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+
+def probe() -> dict:
+    env = {k: v for k, v in os.environ.items() if k in ("PATH", "HOME", "PYTHONPATH", "VIRTUAL_ENV")}
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE], cwd=ROOT, env=env, check=True, capture_output=True, text=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-rss-mb", type=float, default=None)
+    parser.add_argument("--max-import-seconds", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    results = [probe() for _ in range(args.runs)]
+    import_s = statistics.median(r["import_seconds"] for r in results)
+    rss = max(r["max_rss_mb"] for r in results)
+    heavy = sorted({m for r in results for m in r["heavy_loaded"]})
+    print(f"import main: median {import_s:.3f}s over {args.runs} runs, max RSS {rss:.1f} MB")
+    print(f"/status: {results[-1]['status']}; heavy modules loaded: {heavy or 'none'}")
+
+    failed = bool(heavy)
+    if args.max_rss_mb is not None and rss > args.max_rss_mb:
+        print(f"FAIL: RSS {rss:.1f} MB > {args.max_rss_mb} MB")
+        failed = True
+    if args.max_import_seconds is not None and import_s > args.max_import_seconds:
+        print(f"FAIL: import {import_s:.3f}s > {args.max_import_seconds}s")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
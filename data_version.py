@@ -0,0 +1,119 @@
+"""Per-user data version: a Redis counter bumped whenever a user's metrics change.
+
+Derived results (analytics, cached views) are keyed by it, so they never need
+explicit invalidation; a new write simply makes the old keys unreachable.
+Each bump is also published on DATA_VERSION_CHANNEL. The web process follows
+it (listen_for_data_changes), answers version lookups from memory and tells
+registered in-process caches to drop a user's entries.
+"""
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
+
+DATA_VERSION_CHANNEL = "metrics:version"
+
+
+def version_key(user_id: str) -> str:
+    return f"metrics:version:{user_id}"
+
+
+class VersionTracker:
+    """Latest known version per user, kept current by the pub/sub listener.
+
+    Only trusted while `live` (subscribed); otherwise lookups go to Redis.
+    Callbacks get the user id whose data changed, or None for "anything may
+    have changed" (after a disconnect, when messages may have been missed).
+    """
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._callbacks: List[Callable[[Optional[str]], None]] = []
+        self.live = False
+
+    def on_change(self, callback: Callable[[Optional[str]], None]) -> None:
+        self._callbacks.append(callback)
+
+    def get(self, user_id: str) -> Optional[int]:
+        return self._versions.get(user_id) if self.live else None
+
+    def update(self, user_id: str, version: int, notify: bool = True) -> None:
+        if version <= self._versions.get(user_id, -1):
+            return
+        self._versions[user_id] = version
+        if notify:
+            self._notify(user_id)
+
+    def reset(self) -> None:
+        self.live = False
+        self._versions.clear()
+        self._notify(None)
+
+    def _notify(self, user_id: Optional[str]) -> None:
+        for callback in self._callbacks:
+            try:
+                callback(user_id)
+            except Exception as e:
+                logging.getLogger("data_version").warning(f"Cache invalidation callback failed: {e}")
+
+
+versions = VersionTracker()
+
+
+def bump_data_version(user_id: str, redis_client=None) -> Optional[int]:
+    """Increment and announce after a committed write (sync; called from workers)."""
+    logger = logging.getLogger("data_version")
+    if redis_client is None:
+        from queueing import get_redis  # lazy import
+        redis_client = get_redis()
+    try:
+        version = int(redis_client.incr(version_key(user_id)))
+        redis_client.publish(DATA_VERSION_CHANNEL, f"{user_id} {version}")
+        return version
+    except Exception as e:
+        # cached results still expire on their own TTL
+        logger.warning(f"Failed to bump data version for user {user_id}: {e}")
+        return None
+
+
+async def aget_data_version(user_id: str, redis_client=None) -> int:
+    version = versions.get(user_id)
+    if version is not None:
+        return version
+    if redis_client is None:
+        from auth.cache import get_async_redis  # lazy import
+        redis_client = get_async_redis()
+    version = int(await redis_client.get(version_key(user_id)) or 0)
+    if versions.live:
+        # seed; later bumps arrive over pub/sub
+        versions.update(user_id, version, notify=False)
+    return version
+
+
+async def listen_for_data_changes(redis_client=None, retry_seconds: float = 5.0) -> None:
+    """Follow DATA_VERSION_CHANNEL for the app's lifetime."""
+    logger = logging.getLogger("data_version")
+    if redis_client is None:
+        from auth.cache import get_async_redis  # lazy import
+        redis_client = get_async_redis()
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(DATA_VERSION_CHANNEL)
+            versions.live = True
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                user_id, _, version = str(message["data"]).rpartition(" ")
+                versions.update(user_id, int(version))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Data version listener disconnected: {e}")
+            versions.reset()
+            await asyncio.sleep(retry_seconds)
+        finally:
+            versions.live = False
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
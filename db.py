@@ -1,23 +1,240 @@
+import io
 import os
 import re
 import logging
 import unicodedata
 from contextlib import contextmanager
-from datetime import date as Date
+from datetime import date as Date, datetime, time, timedelta, timezone
 from zoneinfo import ZoneInfo
-from typing import Sequence, Set, List, Tuple
+from typing import Iterable, NamedTuple, Optional, Sequence, Set, List, Tuple
 from collections import defaultdict
 from sqlalchemy import create_engine, text, select, Date as SQLDate
+from sqlalchemy.engine import make_url
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import sessionmaker
 
-from models import Metric, SeenEvent, TaskEntry
+from data_version import bump_data_version
+from models import Metric, MetricCategory, MetricRollingStat, MetricRollup, MetricSample, MetricSeries, SeenEvent, TaskEntry, User
 
-ENGINE = create_engine(os.environ["DATABASE_URL"], pool_pre_ping=True, future=True)
-SessionLocal = sessionmaker(bind=ENGINE, autoflush=False, expire_on_commit=False, future=True)
+# Created on first use so importing db needs neither DATABASE_URL nor a connection pool.
+_engine = None
+_sessionmaker = None
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = create_engine(os.environ["DATABASE_URL"], pool_pre_ping=True, future=True)
+    return _engine
+
+
+def SessionLocal():
+    """New ORM session on the lazily created engine (drop-in for the old sessionmaker)."""
+    global _sessionmaker
+    if _sessionmaker is None:
+        _sessionmaker = sessionmaker(bind=get_engine(), autoflush=False, expire_on_commit=False, future=True)
+    return _sessionmaker()
+
+
+def _after_fork_in_child() -> None:
+    """Never share pooled connections with the parent; the child opens its own on demand."""
+    global _async_engine, _async_sessionmaker
+    if _engine is not None:
+        _engine.dispose(close=False)
+    # asyncpg connections are bound to the parent's event loop
+    _async_engine = None
+    _async_sessionmaker = None
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def __getattr__(name):
+    # keep `from db import ENGINE` working for scripts
+    if name == "ENGINE":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Async engine for read endpoints; created lazily so workers never load asyncpg.
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "5"))
+METRICS_STREAM_BATCH = int(os.getenv("METRICS_STREAM_BATCH", "500"))
+_async_engine = None
+_async_sessionmaker = None
 
 EST = ZoneInfo("America/New_York")
 
+METRIC_WRITE_CHUNK = 5000
+
+# Rollup resolutions in seconds, finest first; each is built from the previous one
+SAMPLE_RESOLUTIONS = (300, 3600, 86400)
+_ROLLUP_ORIGIN = "TIMESTAMPTZ '2000-01-01 00:00:00+00'"
+
+
+class SeriesInfo(NamedTuple):
+    id: int
+    user_id: str
+    endpoint: str
+    name: str
+    category: str
+
+
+class SeriesCache:
+    """Process-local map between metric_series ids and (user, endpoint, name).
+
+    Series rows are never rewritten, so entries can't go stale; callers reload a
+    user's series when they meet an id or key that isn't cached yet.
+    """
+
+    def __init__(self):
+        self._by_key: dict[tuple[str, str, str], SeriesInfo] = {}
+        self._by_id: dict[int, SeriesInfo] = {}
+
+    def add(self, rows) -> None:
+        for row in rows:
+            info = SeriesInfo(*row)
+            self._by_key[(info.user_id, info.endpoint, info.name)] = info
+            self._by_id[info.id] = info
+
+    def get(self, series_id: int) -> Optional[SeriesInfo]:
+        return self._by_id.get(series_id)
+
+    def get_id(self, user_id: str, endpoint: str, name: str) -> Optional[int]:
+        info = self._by_key.get((user_id, endpoint, name))
+        return info.id if info else None
+
+    def clear(self) -> None:
+        self._by_key.clear()
+        self._by_id.clear()
+
+
+series_cache = SeriesCache()
+
+
+def _series_stmt(user_id: str):
+    return select(
+        MetricSeries.id,
+        MetricSeries.user_id,
+        MetricSeries.endpoint,
+        MetricSeries.name,
+        MetricSeries.category,
+    ).where(MetricSeries.user_id == user_id)
+
+
+def load_user_series(user_id: str) -> None:
+    with SessionLocal() as s:
+        series_cache.add(s.execute(_series_stmt(user_id)))
+
+
+async def aload_user_series(user_id: str) -> None:
+    async with get_async_sessionmaker()() as s:
+        result = await s.execute(_series_stmt(user_id))
+        series_cache.add(result.all())
+
+
+def resolve_series_ids(user_id: str, endpoint: str, names: Iterable[str]) -> dict[str, int]:
+    """Map metric names to series ids for (user, endpoint), creating missing series."""
+    names = set(names)
+    missing = sorted(n for n in names if series_cache.get_id(user_id, endpoint, n) is None)
+    if missing:
+        category = MetricCategory.from_endpoint(endpoint).value
+        stmt = (
+            insert(MetricSeries)
+            .values([
+                {"user_id": user_id, "endpoint": endpoint, "name": n, "category": category}
+                for n in missing
+            ])
+            .on_conflict_do_nothing(index_elements=["user_id", "endpoint", "name"])
+        )
+        with SessionLocal() as s:
+            s.execute(stmt)
+            s.commit()
+            series_cache.add(s.execute(
+                _series_stmt(user_id).where(
+                    MetricSeries.endpoint == endpoint,
+                    MetricSeries.name.in_(missing),
+                )
+            ))
+    return {n: series_cache.get_id(user_id, endpoint, n) for n in names}
+
+
+def write_metrics(
+    user_id: str,
+    endpoint: str,
+    rows: Iterable[tuple[str, Date, float]],
+    overwrite: bool = False,
+) -> tuple[int, int]:
+    """Write (name, date, value) rows for one user and endpoint.
+
+    overwrite=False keeps existing values (first write wins); overwrite=True
+    upserts. Returns (created, updated).
+    """
+    rows = list(rows)
+    if not rows:
+        return 0, 0
+    ids = resolve_series_ids(user_id, endpoint, {name for name, _d, _v in rows})
+    payload = [
+        {"series_id": ids[name], "date": d, "value": float(v)}
+        for name, d, v in rows
+    ]
+    # backfills of older years get their own partition rather than piling up in metric_default
+    ensure_metric_partitions(sorted({r["date"].year for r in payload}))
+    created, updated = 0, 0
+    with SessionLocal() as s:
+        for start in range(0, len(payload), METRIC_WRITE_CHUNK):
+            chunk = payload[start:start + METRIC_WRITE_CHUNK]
+            stmt = insert(Metric).values(chunk)
+            if overwrite:
+                existing = s.execute(
+                    select(Metric.series_id, Metric.date).where(
+                        Metric.series_id.in_({r["series_id"] for r in chunk}),
+                        Metric.date.in_({r["date"] for r in chunk}),
+                    )
+                ).all()
+                keys = {(r["series_id"], r["date"]) for r in chunk}
+                n_existing = len(keys & {tuple(r) for r in existing})
+                s.execute(stmt.on_conflict_do_update(
+                    index_elements=["series_id", "date"],
+                    set_={"value": stmt.excluded.value},
+                ))
+                created += len(keys) - n_existing
+                updated += n_existing
+            else:
+                res = s.execute(stmt.on_conflict_do_nothing(index_elements=["series_id", "date"]))
+                created += res.rowcount or 0
+        s.commit()
+    if created or updated:
+        from rolling_stats import refresh_rolling_stats  # lazy import (polars)
+        refresh_rolling_stats(ids.values(), {r["date"] for r in payload})
+        bump_data_version(user_id)
+    return created, updated
+
+
+def read_metric_values(series_ids: Sequence[int], start_date: Date, end_date: Date) -> list:
+    """(series_id, date, value) for the given series over [start_date, end_date]."""
+    with SessionLocal() as s:
+        return s.execute(
+            select(Metric.series_id, Metric.date, Metric.value).where(
+                Metric.series_id.in_(series_ids),
+                Metric.date >= start_date,
+                Metric.date <= end_date,
+            )
+        ).all()
+
+
+def write_rolling_stats(rows: Iterable[tuple]) -> int:
+    """Upsert (series_id, window_days, date, n, mean, std, zscore) rows into metric_rolling."""
+    cols = ("series_id", "window_days", "date", "n", "mean", "std", "zscore")
+    payload = [dict(zip(cols, r)) for r in rows]
+    with SessionLocal() as s:
+        for start in range(0, len(payload), METRIC_WRITE_CHUNK):
+            stmt = insert(MetricRollingStat).values(payload[start:start + METRIC_WRITE_CHUNK])
+            s.execute(stmt.on_conflict_do_update(
+                index_elements=["series_id", "window_days", "date"],
+                set_={c: stmt.excluded[c] for c in ("n", "mean", "std", "zscore")},
+            ))
+        s.commit()
+    return len(payload)
+
 def aggregate_task_entries_to_metrics(dates: set[Date], user_id: str) -> tuple[int, int]:
     """
     Aggregate TaskEntry rows into daily Metric rows.
@@ -28,10 +245,21 @@ def aggregate_task_entries_to_metrics(dates: set[Date], user_id: str) -> tuple[i
     created, updated = 0, 0
     task_hours: dict[tuple[str, Date], float] = defaultdict(float)
 
+    if not dates:
+        return created, updated
+    # Bound start_time so ix_task_entry_user_start can be used; the cast keeps exact day semantics
+    range_start = datetime.combine(min(dates), time.min, tzinfo=EST) - timedelta(days=1)
+    range_end = datetime.combine(max(dates), time.min, tzinfo=EST) + timedelta(days=2)
+
     with SessionLocal() as s:
         query = (
             s.query(TaskEntry)
-            .filter(TaskEntry.start_time.cast(SQLDate).in_(dates))
+            .filter(
+                TaskEntry.user_id == user_id,
+                TaskEntry.start_time >= range_start,
+                TaskEntry.start_time < range_end,
+                TaskEntry.start_time.cast(SQLDate).in_(dates),
+            )
         )
         # Stream rows to avoid loading the entire result set into memory
         for entry in query.yield_per(100):
@@ -42,54 +270,139 @@ def aggregate_task_entries_to_metrics(dates: set[Date], user_id: str) -> tuple[i
             hours = (entry.end_time - entry.start_time).total_seconds() / 3600.0
             task_hours[(entry.task_id, local_date)] += hours
 
-        for (task_id, date), total_hours in task_hours.items():
-            metric = (
-                s.query(Metric)
-                .filter_by(
-                    user_id=user_id,
-                    date=date,
-                    endpoint="atracker",
-                    name=task_id,
-                )
-                .one_or_none()
+    created, updated = write_metrics(
+        user_id,
+        "atracker",
+        ((task_id, date, total_hours) for (task_id, date), total_hours in task_hours.items()),
+        overwrite=True,
+    )
+    return created, updated
+
+def write_samples(
+    user_id: str,
+    endpoint: str,
+    samples: Iterable[tuple[str, datetime, float]],
+) -> int:
+    """Bulk-load (name, ts, value) samples and refresh the rollups they touch.
+
+    Rows are COPYed into a temp table and merged with ON CONFLICT DO NOTHING, so
+    re-ingesting a day is idempotent. Timestamps must be timezone-aware.
+    Returns the number of new samples.
+    """
+    samples = list(samples)
+    if not samples:
+        return 0
+    ids = resolve_series_ids(user_id, endpoint, {name for name, _ts, _v in samples})
+    ensure_year_partitions("metric_sample", sorted({ts.astimezone(timezone.utc).year for _n, ts, _v in samples}), key="ts")
+
+    buf = io.StringIO()
+    for name, ts, value in samples:
+        buf.write(f"{ids[name]}\t{ts.isoformat()}\t{float(value)!r}\n")
+    buf.seek(0)
+
+    raw = get_engine().raw_connection()
+    try:
+        with raw.cursor() as cur:
+            cur.execute(
+                "CREATE TEMP TABLE metric_sample_stage "
+                "(series_id integer, ts timestamptz, value real) ON COMMIT DROP"
             )
-            if metric:
-                metric.value = total_hours
-                updated += 1
-            else:
-                metric = Metric(
-                    name=task_id,
-                    user_id=user_id,
-                    date=date,
-                    endpoint="atracker",
-                    value=total_hours,
-                )
-                s.add(metric)
-                created += 1
+            cur.copy_expert("COPY metric_sample_stage (series_id, ts, value) FROM STDIN", buf)
+            cur.execute(
+                "INSERT INTO metric_sample (series_id, ts, value) "
+                "SELECT DISTINCT ON (series_id, ts) series_id, ts, value FROM metric_sample_stage "
+                "ON CONFLICT DO NOTHING"
+            )
+            inserted = cur.rowcount
+        raw.commit()
+    finally:
+        raw.close()
+
+    refresh_rollups(
+        set(ids.values()),
+        min(ts for _n, ts, _v in samples),
+        max(ts for _n, ts, _v in samples),
+    )
+    if inserted:
+        bump_data_version(user_id)
+    return inserted
 
-        s.commit()
 
-    return created, updated
+_ROLLUP_UPSERT = """
+    ON CONFLICT (series_id, resolution, bucket_start) DO UPDATE SET
+        count = EXCLUDED.count, sum = EXCLUDED.sum, min = EXCLUDED.min, max = EXCLUDED.max
+"""
+
+
+def refresh_rollups(series_ids: Set[int], start: datetime, end: datetime) -> None:
+    """Recompute every rollup bucket for the UTC days covering [start, end].
+
+    Each resolution is built from the one below it (raw -> 5 min -> 1 h -> 1 d);
+    the range is day-aligned so no bucket is ever computed from partial input.
+    """
+    if not series_ids:
+        return
+    lo = datetime.combine(start.astimezone(timezone.utc).date(), time.min, tzinfo=timezone.utc)
+    hi = datetime.combine(end.astimezone(timezone.utc).date(), time.min, tzinfo=timezone.utc) + timedelta(days=1)
+    params = {"ids": sorted(series_ids), "lo": lo, "hi": hi}
+    with get_engine().begin() as conn:
+        finest, *coarser = SAMPLE_RESOLUTIONS
+        conn.execute(text(f"""
+            INSERT INTO metric_rollup (series_id, resolution, bucket_start, count, sum, min, max)
+            SELECT series_id, :res, date_bin(make_interval(secs => :res), ts, {_ROLLUP_ORIGIN}),
+                   count(*), sum(value), min(value), max(value)
+            FROM metric_sample
+            WHERE series_id = ANY(:ids) AND ts >= :lo AND ts < :hi
+            GROUP BY 1, 3
+        """ + _ROLLUP_UPSERT), {**params, "res": finest})
+        prev = finest
+        for res in coarser:
+            conn.execute(text(f"""
+                INSERT INTO metric_rollup (series_id, resolution, bucket_start, count, sum, min, max)
+                SELECT series_id, :res, date_bin(make_interval(secs => :res), bucket_start, {_ROLLUP_ORIGIN}),
+                       sum(count), sum(sum), min(min), max(max)
+                FROM metric_rollup
+                WHERE series_id = ANY(:ids) AND resolution = :prev
+                  AND bucket_start >= :lo AND bucket_start < :hi
+                GROUP BY 1, 3
+            """ + _ROLLUP_UPSERT), {**params, "res": res, "prev": prev})
+            prev = res
+
 
 @contextmanager
 def _conn():
-    with ENGINE.begin() as conn:
+    with get_engine().begin() as conn:
         yield conn
 
 
 
+def _metrics_stmt(user_id: str, start_date: Date, end_date: Date):
+    """(series_id, date, value) rows for a user; names come from series_cache."""
+    user_series = select(MetricSeries.id).where(MetricSeries.user_id == user_id)
+    return (
+        select(Metric.series_id, Metric.date, Metric.value)
+        .where(
+            Metric.series_id.in_(user_series.scalar_subquery()),
+            Metric.date >= start_date,
+            Metric.date <= end_date,
+        )
+        .order_by(Metric.date, Metric.series_id)
+    )
+
+
 def get_metrics(user_id: str, start_date: Date, end_date: Date) -> list[dict]:
     logger = logging.getLogger("db")
     logger.info(f"Querying metrics for user {user_id} from {start_date} to {end_date}")
     with SessionLocal() as s:
         stmt = (
-            select(Metric.date, Metric.endpoint, Metric.name, Metric.value)
+            select(Metric.date, MetricSeries.endpoint, MetricSeries.name, Metric.value)
+            .join(MetricSeries, Metric.series_id == MetricSeries.id)
             .where(
-                Metric.user_id == user_id,
+                MetricSeries.user_id == user_id,
                 Metric.date >= start_date,
                 Metric.date <= end_date,
             )
-            .order_by(Metric.date, Metric.endpoint, Metric.name)
+            .order_by(Metric.date, MetricSeries.endpoint, MetricSeries.name)
         )
         # Return a list for compatibility, but stream the DB result to reduce peak memory
         result_iter = s.execute(stmt)
@@ -98,21 +411,197 @@ def get_metrics(user_id: str, start_date: Date, end_date: Date) -> list[dict]:
         return rows
 
 def iter_metrics(user_id: str, start_date: Date, end_date: Date):
-    """Stream metrics rows without materializing the entire result set."""
+    """Stream (series_id, date, value) rows without materializing the entire result set."""
     with SessionLocal() as s:
-        stmt = (
-            select(Metric.date, Metric.endpoint, Metric.name, Metric.value)
-            .where(
-                Metric.user_id == user_id,
-                Metric.date >= start_date,
-                Metric.date <= end_date,
-            )
-            .order_by(Metric.date, Metric.endpoint, Metric.name)
-        )
+        stmt = _metrics_stmt(user_id, start_date, end_date)
         for row in s.execute(stmt):
             yield row
 
 
+def _async_database_url(url: str) -> str:
+    """Swap the sync driver (psycopg2) for asyncpg, keeping host/credentials."""
+    return make_url(url).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+
+def get_async_sessionmaker():
+    global _async_engine, _async_sessionmaker
+    if _async_sessionmaker is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker  # lazy import
+        _async_engine = create_async_engine(
+            _async_database_url(os.environ["DATABASE_URL"]),
+            pool_pre_ping=True,
+            pool_size=ASYNC_POOL_SIZE,
+        )
+        _async_sessionmaker = async_sessionmaker(_async_engine, expire_on_commit=False)
+    return _async_sessionmaker
+
+async def dispose_async_engine() -> None:
+    global _async_engine, _async_sessionmaker
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    _async_engine = None
+    _async_sessionmaker = None
+
+async def aiter_rolling_stats(user_id: str, start_date: Date, end_date: Date):
+    """Stream (series_id, window_days, date, mean, std, zscore) for a user's series."""
+    user_series = select(MetricSeries.id).where(MetricSeries.user_id == user_id)
+    stmt = (
+        select(
+            MetricRollingStat.series_id,
+            MetricRollingStat.window_days,
+            MetricRollingStat.date,
+            MetricRollingStat.mean,
+            MetricRollingStat.std,
+            MetricRollingStat.zscore,
+        )
+        .where(
+            MetricRollingStat.series_id.in_(user_series.scalar_subquery()),
+            MetricRollingStat.date >= start_date,
+            MetricRollingStat.date <= end_date,
+        )
+        .order_by(MetricRollingStat.date, MetricRollingStat.series_id)
+        .execution_options(yield_per=METRICS_STREAM_BATCH)
+    )
+    async with get_async_sessionmaker()() as s:
+        result = await s.stream(stmt)
+        async for row in result:
+            yield row
+
+async def aiter_metrics(user_id: str, start_date: Date, end_date: Date):
+    """Async counterpart of iter_metrics.
+
+    Streams through a server-side cursor in batches of METRICS_STREAM_BATCH so
+    the event loop stays free while Postgres produces rows.
+    """
+    async with get_async_sessionmaker()() as s:
+        stmt = _metrics_stmt(user_id, start_date, end_date).execution_options(
+            yield_per=METRICS_STREAM_BATCH
+        )
+        result = await s.stream(stmt)
+        async for row in result:
+            yield row
+
+
+def _series_points_stmt(series_id: int, start: datetime, end: datetime, resolution: int):
+    """(ts, avg, min, max) for one series; resolution 0 reads raw samples."""
+    if resolution == 0:
+        return (
+            select(MetricSample.ts, MetricSample.value, MetricSample.value, MetricSample.value)
+            .where(MetricSample.series_id == series_id, MetricSample.ts >= start, MetricSample.ts < end)
+            .order_by(MetricSample.ts)
+        )
+    return (
+        select(
+            MetricRollup.bucket_start,
+            MetricRollup.sum / MetricRollup.count,
+            MetricRollup.min,
+            MetricRollup.max,
+        )
+        .where(
+            MetricRollup.series_id == series_id,
+            MetricRollup.resolution == resolution,
+            MetricRollup.bucket_start >= start,
+            MetricRollup.bucket_start < end,
+        )
+        .order_by(MetricRollup.bucket_start)
+    )
+
+async def aget_series_points(series_id: int, start: datetime, end: datetime, resolution: int) -> list:
+    async with get_async_sessionmaker()() as s:
+        result = await s.execute(_series_points_stmt(series_id, start, end, resolution))
+        return result.all()
+
+
+_ensured_partitions: set[tuple[str, int]] = set()
+
+def _create_year_partition(conn, table: str, key: str, year: int) -> None:
+    partition = f"{table}_y{year}"
+    default = f"{table}_default"
+    # Explicit UTC, so timestamptz edges don't follow the session's TimeZone
+    # (date columns ignore the time part)
+    lo, hi = f"'{year}-01-01 00:00:00+00'", f"'{year + 1}-01-01 00:00:00+00'"
+    create = f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} FOR VALUES FROM ({lo}) TO ({hi})"
+    in_year = f"{key} >= {lo} AND {key} < {hi}"
+    has_default = conn.execute(text(f"SELECT to_regclass('{default}') IS NOT NULL")).scalar()
+    if not has_default or not conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_year})")).scalar():
+        conn.execute(text(create))
+        return
+    # Postgres refuses a partition whose range still has rows in the default
+    # partition: detach it, create the partition, move the rows, reattach.
+    conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {default}"))
+    conn.execute(text(create))
+    moved = conn.execute(text(
+        f"WITH moved AS (DELETE FROM {default} WHERE {in_year} RETURNING *) "
+        f"INSERT INTO {partition} SELECT * FROM moved"
+    )).rowcount
+    conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT"))
+    logging.getLogger("db").warning(f"Moved {moved} rows from {default} into new partition {partition}")
+
+
+def ensure_year_partitions(table: str, years: Sequence[int], key: str = "date") -> None:
+    """Create yearly partitions (<table>_yYYYY) of a table RANGE-partitioned on `key`.
+
+    Rows for that year already sitting in <table>_default are moved into the
+    new partition. Remembers what it has created so hot write paths only pay
+    for DDL once per process.
+    """
+    todo = [int(y) for y in years if (table, int(y)) not in _ensured_partitions]
+    if not todo:
+        return
+    with get_engine().begin() as conn:
+        for year in todo:
+            _create_year_partition(conn, table, key, year)
+    _ensured_partitions.update((table, y) for y in todo)
+
+
+def ensure_metric_partitions(years: Sequence[int]) -> None:
+    """Create yearly metric partitions ahead of time so rows don't land in metric_default."""
+    ensure_year_partitions("metric", years)
+
+
+def drop_metric_partitions_before(year: int) -> list[str]:
+    """Retention: detach and drop whole yearly partitions older than `year`.
+
+    Dropping a partition is a metadata operation; nothing else is scanned.
+    """
+    logger = logging.getLogger("db")
+    dropped: list[str] = []
+    with get_engine().begin() as conn:
+        names = conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = 'metric'"
+        )).scalars().all()
+        for name in names:
+            m = re.fullmatch(r"metric_y(\d{4})", name)
+            if m and int(m.group(1)) < year:
+                conn.execute(text(f"ALTER TABLE metric DETACH PARTITION {name}"))
+                conn.execute(text(f"DROP TABLE {name}"))
+                _ensured_partitions.discard(("metric", int(m.group(1))))
+                dropped.append(name)
+    if dropped:
+        logger.info(f"Dropped metric partitions: {dropped}")
+    return dropped
+
+
+def upsert_user(user_id: str, display_name: Optional[str] = None) -> None:
+    """Register a user (no-op if already present)."""
+    stmt = (
+        insert(User)
+        .values(user_id=user_id, display_name=display_name)
+        .on_conflict_do_nothing(index_elements=["user_id"])
+    )
+    with SessionLocal() as s:
+        s.execute(stmt)
+        s.commit()
+
+
+def list_active_users() -> list[str]:
+    with SessionLocal() as s:
+        stmt = select(User.user_id).where(User.active.is_(True)).order_by(User.user_id)
+        return list(s.scalars(stmt))
+
+
 def get_seen_events(user_id: str, endpoint: str, start_date: Date, end_date: Date) -> list[SeenEvent]:
     with SessionLocal() as s:
         stmt = (
@@ -127,6 +616,13 @@ def get_seen_events(user_id: str, endpoint: str, start_date: Date, end_date: Dat
         return s.scalars(stmt).all()
 
 
+def list_seen_dates(user_id: str, endpoint: str) -> list[Date]:
+    """Every seen date for (user_id, endpoint); seeds the seen_dates bitmap."""
+    with SessionLocal() as s:
+        stmt = select(SeenEvent.date).where(SeenEvent.user_id == user_id, SeenEvent.endpoint == endpoint)
+        return list(s.scalars(stmt))
+
+
 def create_seen_events_bulk(
     user_id: str,
     endpoint: str,
@@ -185,11 +681,12 @@ def clean_task_id(raw_task_id: str) -> str:
     head = re.sub(r"_+", "_", head).strip("_")
     return head
 
-def task_entry_from_json(entry_dict: dict) -> TaskEntry:
-    """Parse TaskEntry JSON into a TaskEntry ORM object."""
+def task_entry_from_json(entry_dict: dict, user_id: str) -> TaskEntry:
+    """Parse TaskEntry JSON into a TaskEntry ORM object owned by user_id."""
     props = {p["propertyName"]: p.get("value") for p in entry_dict["properties"]}
 
     return TaskEntry(
+        user_id=user_id,
         task_id=clean_task_id(props["taskID"]),
         global_identifier=entry_dict["globalIdentifier"],
         finished=bool(props["finished"]),
@@ -216,7 +713,7 @@ def upsert_task_entries_row_by_row(entries: List[TaskEntry]) -> Tuple[List[TaskE
 
                 existing = (
                     s.query(TaskEntry)
-                    .filter_by(global_identifier=entry.global_identifier)
+                    .filter_by(user_id=entry.user_id, global_identifier=entry.global_identifier)
                     .one_or_none()
                 )
 
@@ -275,7 +772,7 @@ def upsert_task_entries_minimal(entries: List[TaskEntry]) -> Tuple[int, int, set
 
                 existing = (
                     s.query(TaskEntry)
-                    .filter_by(global_identifier=entry.global_identifier)
+                    .filter_by(user_id=entry.user_id, global_identifier=entry.global_identifier)
                     .one_or_none()
                 )
 
@@ -4,13 +4,9 @@ from datetime import datetime
 from collections import defaultdict
 from zoneinfo import ZoneInfo
 import polars as pl
-from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy import select
-from db import SessionLocal, ENGINE
-from models import Metric
-from s3io import _list_ndjson_gz_keys, _load_ndjson_gz_as_polars
-from metrics.atracker.ingest import sync_folder, parse_atracker_datafile
-from db import task_entry_from_json, aggregate_task_entries_to_metrics, upsert_task_entries_minimal
+from s3io import _list_ndjson_gz_keys, _load_ndjson_gz_as_polars, list_day_keys
+from metrics.atracker.ingest import sync_folder, parse_atracker_datafile, DEFAULT_LOCAL_FOLDER
+from db import task_entry_from_json, aggregate_task_entries_to_metrics, upsert_task_entries_minimal, write_metrics
 
 BUCKET = os.getenv("S3_BUCKET")
 ENV = os.getenv("S3_ENV", "dev")
@@ -40,11 +36,13 @@ def atracker_process_file(filepath: str, user_id: str) -> int:
     """
     updates = 0
     affected_dates: set = set()
+    from jobs import report_progress
     for batch in _chunked(parse_atracker_datafile(filepath), 500):
-        task_entries = [task_entry_from_json(item) for item in batch]
+        task_entries = [task_entry_from_json(item, user_id) for item in batch]
         c, u, dates = upsert_task_entries_minimal(task_entries)
         updates += c + u
         affected_dates |= dates
+        report_progress(rows=updates)
     if not affected_dates:
         return updates
     metrics_created, metrics_updated = aggregate_task_entries_to_metrics(affected_dates, user_id)
@@ -56,7 +54,10 @@ async def etl_daily_atracker_task_entries(user_id: str) -> int:
 
     Returns number of files discovered; processing happens in separate jobs.
     """
-    downloaded_files = await sync_folder(user_id=user_id)
+    downloaded_files = await sync_folder(
+        local_folder=os.path.join(DEFAULT_LOCAL_FOLDER, user_id),
+        user_id=user_id,
+    )
     # Throttle number of files if configured
     max_files_env = os.getenv("ATRACKER_MAX_FILES_PER_RUN")
     if max_files_env:
@@ -66,12 +67,11 @@ async def etl_daily_atracker_task_entries(user_id: str) -> int:
                 downloaded_files = downloaded_files[:max_files]
         except Exception:
             pass
-    # Enqueue per-file jobs using the RQ queue
-    from queueing import get_queue
-    from jobs import run_etl_job
-    q = get_queue("etl")
+    # Enqueue per-file jobs; jobs routes them to the bulk queue
+    from jobs import enqueue_etl_job, report_progress
     for fp in downloaded_files:
-        q.enqueue(run_etl_job, "atracker_file", fp, user_id)
+        enqueue_etl_job("atracker_file", fp, user_id)
+    report_progress(files=len(downloaded_files))
     return len(downloaded_files)
 
 ## OURA ETL
@@ -112,17 +112,32 @@ def _etl_daily_oura_day(
     struct_col: str = "contributors",
     vendor: str = "oura",
     api: str = "v2",
+    overwrite: bool = False,
 ) -> int:
+    """Load raw records into metrics.
+
+    A "start/end" interval (even a one-day one) reads those record days from
+    the day= layout. A bare date is a job enqueued before that layout: it
+    names the ingestion date, so it reads everything pulled that day (dt=).
+    """
     col_map = col_map or {}
     struct_map = struct_map or {}
 
-    keys = _list_ndjson_gz_keys(vendor, api, endpoint, date_str)
+    if "/" in date_str:
+        from jobs import day_range
+        start_day, end_day = day_range(date_str)
+        keys = list_day_keys(vendor, api, endpoint, start_day, end_day, user_id=user_id)
+    else:
+        keys = _list_ndjson_gz_keys(vendor, api, endpoint, date_str, user_id=user_id)
     if not keys:
         return 0
 
     df = _load_ndjson_gz_as_polars(keys)
     if df.height == 0:
         return 0
+    if "_ingested_at" in df.columns:
+        # a day pulled more than once has a record per pull; the latest wins
+        df = df.sort("_ingested_at").unique(subset=["day"], keep="last", maintain_order=True)
 
     select_list = [pl.col("day")]
     for src, dst in col_map.items():
@@ -144,23 +159,21 @@ def _etl_daily_oura_day(
           .sort(["day", "name"])
     )
 
-    payload = []
-    for r in long_df.iter_rows(named=True):
-        payload.append({
-            "name": r["name"],
-            "user_id": user_id,
-            "date": r["day"],
-            "endpoint": endpoint,
-            "value": float(r["value"]),
-        })
-    return _insert_metrics_ignore_conflicts(payload)
+    created, updated = write_metrics(
+        user_id,
+        endpoint,
+        long_df.select("name", "day", "value").iter_rows(),
+        overwrite=overwrite,
+    )
+    return created + updated if overwrite else created
 
 
-def etl_daily_sleep_day(date_str: str, user_id: str) -> int:
+def etl_daily_sleep_day(date_str: str, user_id: str, overwrite: bool = False) -> int:
     return _etl_daily_oura_day(
         endpoint="daily_sleep",
         date_str=date_str,
         user_id=user_id,
+        overwrite=overwrite,
         col_map={"score": "sleep_score"},
         struct_map={
             "deep_sleep": "deep_sleep",
@@ -173,25 +186,11 @@ def etl_daily_sleep_day(date_str: str, user_id: str) -> int:
         },
     )
 
-def etl_daily_readiness_day(date_str: str, user_id: str) -> int:
+def etl_daily_readiness_day(date_str: str, user_id: str, overwrite: bool = False) -> int:
     return _etl_daily_oura_day(
         endpoint="daily_readiness",
         date_str=date_str,
         user_id=user_id,
+        overwrite=overwrite,
         col_map={"score": "readiness_score"},
     )
-
-
-def _insert_metrics_ignore_conflicts(records: list[dict]) -> int:
-    if not records:
-        return 0
-    stmt = (
-        # pg_insert(Metric)
-        insert(Metric)
-        .values(records)
-        .on_conflict_do_nothing(index_elements=["user_id", "date", "endpoint", "name"])
-    )
-    with SessionLocal() as s:
-        res = s.execute(stmt)
-        s.commit()
-        return res.rowcount or 0
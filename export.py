@@ -0,0 +1,180 @@
+"""Stream metrics / task entries out of Postgres as Parquet or Arrow IPC.
+
+Rows come off a server-side cursor EXPORT_BATCH_ROWS at a time and are
+written as one record batch (one Parquet row group) each, so memory stays
+flat no matter how much history is exported.
+
+    python -m export metrics --user-id brucegarro --start 2024-01-01 -o metrics.parquet
+    python -m export task_entries --format arrow -o tasks.arrow
+"""
+import os
+import sys
+import logging
+import argparse
+from datetime import date, datetime, time, timedelta
+from typing import Iterator, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select
+
+from db import EST, SessionLocal
+from models import Metric, MetricSeries, TaskEntry
+
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "50000"))
+EXPORT_FORMATS = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+METRICS_SCHEMA = pa.schema([
+    ("date", pa.date32()),
+    ("endpoint", pa.string()),
+    ("name", pa.string()),
+    ("category", pa.string()),
+    ("value", pa.float64()),
+])
+
+TASK_ENTRIES_SCHEMA = pa.schema([
+    ("task_id", pa.string()),
+    ("global_identifier", pa.string()),
+    ("finished", pa.bool_()),
+    ("deleted_new", pa.bool_()),
+    ("notes", pa.string()),
+    ("create_timestamp", pa.timestamp("us", tz="UTC")),
+    ("start_time", pa.timestamp("us", tz="UTC")),
+    ("end_time", pa.timestamp("us", tz="UTC")),
+    ("last_update_timestamp", pa.timestamp("us", tz="UTC")),
+])
+
+
+def _metrics_query(user_id: str, start_date: Optional[date], end_date: Optional[date]):
+    stmt = (
+        select(Metric.date, MetricSeries.endpoint, MetricSeries.name, MetricSeries.category, Metric.value)
+        .join(MetricSeries, Metric.series_id == MetricSeries.id)
+        .where(MetricSeries.user_id == user_id)
+        .order_by(Metric.date, MetricSeries.endpoint, MetricSeries.name)
+    )
+    if start_date:
+        stmt = stmt.where(Metric.date >= start_date)
+    if end_date:
+        stmt = stmt.where(Metric.date <= end_date)
+    return stmt
+
+
+def _task_entries_query(user_id: str, start_date: Optional[date], end_date: Optional[date]):
+    stmt = (
+        select(*(getattr(TaskEntry, name) for name in TASK_ENTRIES_SCHEMA.names))
+        .where(TaskEntry.user_id == user_id)
+        .order_by(TaskEntry.start_time)
+    )
+    # dates are local (EST) days, matching how task hours are aggregated
+    if start_date:
+        stmt = stmt.where(TaskEntry.start_time >= datetime.combine(start_date, time.min, tzinfo=EST))
+    if end_date:
+        stmt = stmt.where(TaskEntry.start_time < datetime.combine(end_date + timedelta(days=1), time.min, tzinfo=EST))
+    return stmt
+
+
+EXPORTS = {
+    "metrics": (_metrics_query, METRICS_SCHEMA),
+    "task_entries": (_task_entries_query, TASK_ENTRIES_SCHEMA),
+}
+
+
+def iter_record_batches(
+    kind: str,
+    user_id: str,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    batch_rows: int = EXPORT_BATCH_ROWS,
+) -> Iterator[pa.RecordBatch]:
+    query, schema = EXPORTS[kind]
+    stmt = query(user_id, start_date, end_date).execution_options(yield_per=batch_rows)
+    with SessionLocal() as s:
+        for rows in s.execute(stmt).partitions():
+            columns = list(zip(*rows))
+            yield pa.RecordBatch.from_arrays(
+                [pa.array(col, type=field.type) for col, field in zip(columns, schema)],
+                schema=schema,
+            )
+
+
+class _ChunkSink:
+    """Write-only file object that hands back whatever was written since the last drain."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_export(kind: str, fmt: str, batches: Iterator[pa.RecordBatch]) -> Iterator[bytes]:
+    """Encode record batches as `fmt`, yielding bytes as each batch is written."""
+    schema = EXPORTS[kind][1]
+    sink = _ChunkSink()
+    out = pa.PythonFile(sink, mode="w")
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(out, schema, compression="zstd")
+    elif fmt == "arrow":
+        writer = pa.ipc.new_stream(out, schema)
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+    for batch in batches:
+        if fmt == "parquet":
+            writer.write_batch(batch, row_group_size=batch.num_rows)
+        else:
+            writer.write_batch(batch)
+        chunk = sink.drain()
+        if chunk:
+            yield chunk
+    writer.close()
+    yield sink.drain()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s %(message)s",
+        stream=sys.stderr,
+    )
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("kind", choices=sorted(EXPORTS))
+    parser.add_argument("--user-id", default=os.getenv("DASHBOARD_USER_ID", "brucegarro"))
+    parser.add_argument("--start", type=date.fromisoformat, default=None)
+    parser.add_argument("--end", type=date.fromisoformat, default=None)
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="parquet")
+    parser.add_argument("-o", "--output", default="-", help="file path, or - for stdout")
+    args = parser.parse_args(argv)
+
+    logger = logging.getLogger("export")
+    batches = iter_record_batches(args.kind, args.user_id, args.start, args.end)
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        size = 0
+        for chunk in stream_export(args.kind, args.format, batches):
+            out.write(chunk)
+            size += len(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    logger.info(f"Exported {args.kind} for user {args.user_id}: {size} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
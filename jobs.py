@@ -1,17 +1,178 @@
-from datetime import date
+import os
+import time
+import uuid
 import asyncio
-from queueing import get_queue
-from typing import Literal, TypedDict
+import logging
+from contextlib import contextmanager
+from datetime import date, timedelta
+from queueing import get_queue, get_redis, QUEUE_HIGH, QUEUE_BULK
+from typing import Iterator, Literal, TypedDict
 
 Endpoint = Literal["daily_sleep", "daily_readiness", "atracker", "atracker_file"]
 
+# Data for days at most this old is considered interactive and routed to QUEUE_HIGH.
+ETL_HIGH_PRIORITY_DAYS = int(os.getenv("ETL_HIGH_PRIORITY_DAYS", "1"))
+
+# Per-user concurrency: at most this many of one user's jobs run at once across
+# the whole worker pool, so one tenant's backfill can't take every worker.
+ETL_PER_USER_CONCURRENCY = int(os.getenv("ETL_PER_USER_CONCURRENCY", "2"))
+# A slot held by a killed worker is reclaimed after this long.
+ETL_USER_SLOT_TTL_SECONDS = int(os.getenv("ETL_USER_SLOT_TTL_SECONDS", "900"))
+# A job that found no free slot is scheduled to run again this much later.
+ETL_USER_DEFER_SECONDS = float(os.getenv("ETL_USER_DEFER_SECONDS", "5"))
+# How long a user's enqueued jobs stay visible to the progress stream.
+ETL_JOB_TRACK_SECONDS = int(os.getenv("ETL_JOB_TRACK_SECONDS", "3600"))
+ACTIVE_JOB_STATUSES = {"queued", "started", "deferred", "scheduled"}
+
+_ACQUIRE_SLOT_SCRIPT = """
+redis.call('zremrangebyscore', KEYS[1], '-inf', tonumber(ARGV[1]) - tonumber(ARGV[3]))
+if redis.call('zcard', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('zadd', KEYS[1], ARGV[1], ARGV[4])
+    redis.call('expire', KEYS[1], ARGV[3])
+    return 1
+end
+return 0
+"""
+
 class EtlResult(TypedDict):
     endpoint: str
     date: str
     user_id: str
     inserted: int
 
+class UserBusy(Exception):
+    """All of a user's ETL slots are taken."""
+
+
+def _slot_key(user_id: str) -> str:
+    return f"etl:slots:{user_id}"
+
+
+def _acquire_user_slot(user_id: str) -> str | None:
+    member = uuid.uuid4().hex
+    acquired = get_redis().eval(
+        _ACQUIRE_SLOT_SCRIPT, 1, _slot_key(user_id),
+        time.time(), ETL_PER_USER_CONCURRENCY, ETL_USER_SLOT_TTL_SECONDS, member,
+    )
+    return member if acquired else None
+
+
+def _release_user_slot(user_id: str, member: str) -> None:
+    get_redis().zrem(_slot_key(user_id), member)
+
+
+@contextmanager
+def user_slot(user_id: str) -> Iterator[None]:
+    """Hold one of the user's ETL_PER_USER_CONCURRENCY slots, or raise UserBusy."""
+    member = _acquire_user_slot(user_id)
+    if member is None:
+        raise UserBusy(user_id)
+    try:
+        yield
+    finally:
+        _release_user_slot(user_id, member)
+
+
+def _jobs_key(user_id: str) -> str:
+    return f"etl:jobs:{user_id}"
+
+
+def track_job(user_id: str, job) -> None:
+    """Remember an enqueued job so the user's progress stream can follow it."""
+    key = _jobs_key(user_id)
+    pipe = get_redis().pipeline()
+    pipe.zadd(key, {job.id: time.time()})
+    pipe.expire(key, ETL_JOB_TRACK_SECONDS)
+    pipe.execute()
+
+
+def report_progress(**fields) -> None:
+    """Merge counters into the running job's meta["progress"]; no-op outside RQ."""
+    from rq import get_current_job
+    job = get_current_job()
+    if job is None:
+        return
+    job.meta.setdefault("progress", {}).update(fields)
+    job.save_meta()
+
+
+def job_statuses(user_id: str) -> list[dict]:
+    """Status and progress of the user's recently enqueued jobs, oldest first."""
+    from rq.job import Job
+    r = get_redis()
+    key = _jobs_key(user_id)
+    r.zremrangebyscore(key, "-inf", time.time() - ETL_JOB_TRACK_SECONDS)
+    ids = [i.decode() if isinstance(i, bytes) else i for i in r.zrange(key, 0, -1)]
+    statuses = []
+    for job in Job.fetch_many(ids, connection=r):
+        if job is None:
+            continue  # result expired
+        statuses.append({
+            "id": job.id,
+            "endpoint": job.meta.get("endpoint", job.func_name.rsplit(".", 1)[-1]),
+            "status": job.get_status(refresh=False),
+            "progress": job.meta.get("progress", {}),
+        })
+    return statuses
+
+
+def _defer_current_job(user_id: str) -> bool:
+    """Schedule the running RQ job again in ETL_USER_DEFER_SECONDS. False outside RQ.
+
+    The worker is free at once; the pool's scheduler moves the copy back onto
+    its queue when it is due.
+    """
+    from rq import get_current_job
+    job = get_current_job()
+    if job is None:
+        return False
+    deferred = get_queue(job.origin).enqueue_in(
+        timedelta(seconds=ETL_USER_DEFER_SECONDS),
+        job.func, *job.args, job_timeout=job.timeout, meta=job.meta, **job.kwargs,
+    )
+    track_job(user_id, deferred)
+    return True
+
+
+@contextmanager
+def user_slot_or_defer(user_id: str) -> Iterator[bool]:
+    """Yield True while holding a user slot; if none is free, defer the job and yield False.
+
+    Outside an RQ job there is nothing to defer, so UserBusy is raised instead.
+    """
+    member = _acquire_user_slot(user_id)
+    if member is None:
+        if not _defer_current_job(user_id):
+            raise UserBusy(user_id)
+        logging.getLogger("jobs").info(f"User {user_id} at concurrency limit; job deferred.")
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        _release_user_slot(user_id, member)
+
+
 def run_etl_job(endpoint: Endpoint, date_str: str, user_id: str) -> EtlResult:
+    with user_slot_or_defer(user_id) as acquired:
+        n = _run_etl(endpoint, date_str, user_id) if acquired else 0
+    if acquired:
+        report_progress(rows=n)
+        # the orchestrator only fans out; its per-file jobs write the metrics
+        if endpoint != "atracker":
+            refresh_status(user_id, endpoint)
+    return {"endpoint": endpoint, "date": date_str, "user_id": user_id, "inserted": n}
+
+def refresh_status(user_id: str, endpoint: str) -> None:
+    """Best-effort update of the user's /health snapshot after an ingest."""
+    from status_snapshot import refresh_after_ingest  # lazy import
+    try:
+        refresh_after_ingest(user_id, endpoint)
+    except Exception as e:
+        # /health rebuilds a stale snapshot itself
+        logging.getLogger("jobs").warning(f"Status snapshot refresh failed for user {user_id}: {e}")
+
+def _run_etl(endpoint: Endpoint, date_str: str, user_id: str) -> int:
     # Lazy-import to keep app process memory light; heavy deps loaded only in worker.
     if endpoint == "daily_sleep":
         from etl_metrics import etl_daily_sleep_day
@@ -29,9 +190,79 @@ def run_etl_job(endpoint: Endpoint, date_str: str, user_id: str) -> EtlResult:
         n = atracker_process_file(date_str, user_id)
     else:
         raise ValueError(f"Unsupported endpoint: {endpoint}")
-    return {"endpoint": endpoint, "date": date_str, "user_id": user_id, "inserted": n}
+    return n
+
+def _is_recent(day: date) -> bool:
+    return day >= date.today() - timedelta(days=ETL_HIGH_PRIORITY_DAYS)
 
-def enqueue_atracker_job(enqueued_jobs, user_id):
-    q = get_queue("etl")
-    job = q.enqueue(run_etl_job, "atracker", date.today().isoformat(), user_id)
+def queue_for_range(start_date: date, end_date: date) -> str:
+    """Route a pull covering [start_date, end_date]: high if it reaches recent days."""
+    return QUEUE_HIGH if _is_recent(end_date) else QUEUE_BULK
+
+def day_range(date_str: str) -> tuple[date, date]:
+    """Parse a job's date_str: one day ("2024-05-01") or an interval ("2024-05-01/2024-05-31")."""
+    start, _, end = date_str.partition("/")
+    return date.fromisoformat(start), date.fromisoformat(end or start)
+
+def queue_for(endpoint: str, date_str: str) -> str:
+    """Pick the priority queue for a run_etl_job call.
+
+    Per-file fan-out is always bulk; day-based jobs are high only if they reach recent days.
+    """
+    if endpoint == "atracker_file":
+        return QUEUE_BULK
+    try:
+        _start, end = day_range(date_str)
+    except ValueError:
+        return QUEUE_BULK
+    return QUEUE_HIGH if _is_recent(end) else QUEUE_BULK
+
+def enqueue_etl_job(endpoint: Endpoint, date_str: str, user_id: str, queue_name: str | None = None, **enqueue_kwargs):
+    q = get_queue(queue_name or queue_for(endpoint, date_str))
+    job = q.enqueue(run_etl_job, endpoint, date_str, user_id, meta={"endpoint": endpoint}, **enqueue_kwargs)
+    track_job(user_id, job)
+    return job
+
+def enqueue_atracker_job(enqueued_jobs, user_id, queue_name: str | None = None):
+    job = enqueue_etl_job("atracker", date.today().isoformat(), user_id, queue_name=queue_name)
     enqueued_jobs["atracker"] = job.id
+
+def run_user_ingestion(user_id: str, days: int = 90) -> dict:
+    """Scheduled per-user fan-out: Oura pull (when authorized) and Atracker sync.
+
+    Runs on the bulk tier so scheduled tenants never delay interactive work.
+    Dense Oura series are only pulled from here, never from /health.
+    """
+    logger = logging.getLogger("jobs")
+    from metrics.oura.ingest import get_valid_access_token, pull_data
+    from metrics.oura.timeseries import enqueue_timeseries
+    from auth.cache import REDIS_URL
+    from redis.asyncio import Redis as AsyncRedis
+
+    async def _token():
+        # Fresh client: the shared async client is bound to another event loop
+        client = AsyncRedis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
+        try:
+            return await get_valid_access_token(user_id, redis_client=client)
+        finally:
+            await client.aclose()
+
+    enqueued: dict = {}
+    token = asyncio.run(_token())
+    if token:
+        end_date = date.today()
+        start_date = end_date - timedelta(days=days)
+        enqueued["oura"] = pull_data(
+            token["access_token"],
+            start_date=start_date,
+            end_date=end_date,
+            user_id=user_id,
+            queue_name=QUEUE_BULK,
+        )
+        ts_job = enqueue_timeseries(token["access_token"], start_date, end_date, user_id)
+        if ts_job:
+            enqueued["oura_timeseries"] = ts_job
+    else:
+        logger.info(f"No valid Oura token for {user_id}; skipping Oura pull.")
+    enqueue_atracker_job(enqueued, user_id, queue_name=QUEUE_BULK)
+    return enqueued
@@ -1,6 +1,9 @@
+import os
+import sys
 import time
+import json
+import asyncio
 import logging
-import sys
 
 # Ensure logs are visible in Docker log feed
 logging.basicConfig(
@@ -9,166 +12,430 @@ logging.basicConfig(
     stream=sys.stdout
 )
 from typing import Optional
-from datetime import date, timedelta
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta, timezone
 
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request
 from fastapi.responses import FileResponse
+from fastapi.responses import PlainTextResponse
 from fastapi.responses import RedirectResponse
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
-from metrics.oura.ingest import (
-    get_oura_auth_url,
-    get_and_cache_access_token,
-    get_valid_access_token,
-    pull_data,
-)
-from metrics.view import get_metrics_pivot
-from metrics.atracker.dropbox import DropboxAuthManager, get_dropbox_token
-import os
-from queueing import get_queue
-from jobs import run_etl_job, enqueue_atracker_job
+from assets import PrecompressedStaticFiles, STATIC_DIR, built_dashboard
+
+# Everything below the web layer (db/SQLAlchemy, rq, oura, boto3, polars,
+# numpy, pyarrow) is imported inside the handlers that need it, so a cold
+# worker only pays for what its traffic actually touches and /status stays
+# cheap. benchmarks/startup.py keeps an eye on this.
 
-USERID = "brucegarro"
+# The only user when sessions are off (SESSION_SECRET unset: the original single-user deployment)
+DEFAULT_USER_ID = os.getenv("DASHBOARD_USER_ID", "brucegarro")
 DROPBOX_REDIRECT_URI = os.getenv("DROPBOX_REDIRECT_URI")
 DOMAIN = os.getenv("DOMAIN")
+JOB_EVENTS_POLL_SECONDS = float(os.getenv("JOB_EVENTS_POLL_SECONDS", "1"))
+JOB_EVENTS_MAX_SECONDS = float(os.getenv("JOB_EVENTS_MAX_SECONDS", "600"))
 
+router = APIRouter()
+static_files = PrecompressedStaticFiles(directory=STATIC_DIR)
 
 
-from fastapi import Depends
-
 def get_redis_client():
-    from metrics.oura.ingest import _redis
-    return _redis
+    from auth.cache import get_async_redis  # lazy import
+    return get_async_redis()
+
+def get_user_id(request: Request) -> str:
+    """The signed-in user, from the session cookie; 401 without one (see auth.session)."""
+    from auth.session import SESSION_COOKIE, sessions_enabled, verify_session  # lazy import
+    if not sessions_enabled():
+        return DEFAULT_USER_ID
+    user_id = verify_session(request.cookies.get(SESSION_COOKIE))
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Not signed in")
+    return user_id
+
+def _external_url(path: str) -> str:
+    return f"https://{DOMAIN}{path}" if DOMAIN else path
+
+def enqueue_atracker_job(enqueued_jobs, user_id):
+    from jobs import enqueue_atracker_job as _enqueue_atracker_job  # lazy import (rq)
+    return _enqueue_atracker_job(enqueued_jobs, user_id)
+
+async def _upsert_user(user_id: str) -> None:
+    from db import upsert_user  # lazy import
+    await run_in_threadpool(upsert_user, user_id)
+
+async def aget_data_version(user_id: str, redis_client=None) -> int:
+    from data_version import aget_data_version as _aget_data_version  # lazy import
+    return await _aget_data_version(user_id, redis_client=redis_client)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from auth.cache import listen_for_invalidations
+    from data_version import listen_for_data_changes
+    auth_listener = asyncio.create_task(listen_for_invalidations())
+    data_listener = asyncio.create_task(listen_for_data_changes())
+    yield
+    auth_listener.cancel()
+    data_listener.cancel()
+    if "db" in sys.modules:
+        # only if a request ever touched the database
+        from db import dispose_async_engine
+        await dispose_async_engine()
+
 
+def create_app() -> FastAPI:
+    app = FastAPI(title="Personal Metrics Dashboard", lifespan=lifespan)
+    app.mount("/static", static_files, name="static")
+    app.include_router(router)
+    return app
 
-app = FastAPI(title="Personal Metrics Dashboard")
-app.mount("/static", StaticFiles(directory="static"), name="static")
 
-@app.get("/dashboard")
-def serve_dashboard():
-    return FileResponse("static/dashboard.html")
+@router.get("/dashboard")
+async def serve_dashboard(request: Request):
+    built = built_dashboard()
+    if built:
+        # fingerprinted, precompressed page; revalidated via ETag on every load
+        return await static_files.get_response(built, request.scope)
+    return FileResponse(os.path.join(STATIC_DIR, "dashboard.html"), headers={"Cache-Control": "no-cache"})
 
 
-@app.get("/")
+@router.get("/")
 def read_root():
     return {"message": "Welcome to the Personal Metrics Dashboard"}
 
-@app.get("/status")
+@router.get("/status")
 async def status_check():
     return {"status": "ok"}
 
 
-@app.get("/health")
-async def health_check(redis_client=Depends(get_redis_client)):
+async def _oura_status(user_id: str, redis_client) -> dict:
+    from metrics.oura.ingest import get_valid_access_token  # lazy import
+    from status_snapshot import invalid_auth_section
     logger = logging.getLogger("health_check")
-    access_token = await get_valid_access_token(USERID, redis_client=redis_client)
-    logger.info(f"Fetched Oura access token for user {USERID} (valid or refreshed): {bool(access_token)}")
-
-    oura_auth_url = None
-    dropbox_auth_url = None
-    oura_auth_valid = False
-    dropbox_auth_valid = False
-
+    access_token = await get_valid_access_token(user_id, redis_client=redis_client)
+    logger.info(f"Fetched Oura access token for user {user_id} (valid or refreshed): {bool(access_token)}")
     if access_token is None:
-        logger.info("Oura access token missing and cannot be refreshed; generating auth URL.")
-        oura_auth_url = get_oura_auth_url()
-    else:
-        oura_auth_valid = True
+        logger.info("Oura access token missing and cannot be refreshed; sending to /oura_start.")
+        # the authorize URL carries a one-time state, so it is minted per click, not cached here
+        return invalid_auth_section(_external_url("/oura_start"))
+    return {"valid": True, "auth_url": None, "expires_at": access_token.get("expires_at")}
 
-    dbx_mgr = DropboxAuthManager()
-    dbx_token = await get_dropbox_token(USERID)
-    logger.info(f"Fetched Dropbox token for user {USERID}: {bool(dbx_token)}")
+async def _dropbox_status(user_id: str) -> dict:
+    from metrics.atracker.dropbox import DropboxAuthManager, get_dropbox_token  # lazy import
+    from status_snapshot import invalid_auth_section
+    logger = logging.getLogger("health_check")
+    dbx_token = await get_dropbox_token(user_id)
+    logger.info(f"Fetched Dropbox token for user {user_id}: {bool(dbx_token)}")
     dbx_token_expired = False
     if dbx_token and "expires_at" in dbx_token:
         dbx_token_expired = int(time.time()) > dbx_token["expires_at"]
-    if not dbx_token or dbx_token_expired:
-        logger.info("Dropbox token missing or expired, generating auth URL.")
-        if DROPBOX_REDIRECT_URI:
-            next_url = "/dropbox_start"
-            if DOMAIN:
-                host = DOMAIN
-                if host.startswith("http://"):
-                    host = host[len("http://"):]
-                if host.startswith("https://"):
-                    host = host[len("https://"):]
-                host = host.strip("/")
-                next_url = f"https://{DOMAIN}/dropbox_start"
-            dropbox_auth_url = next_url
-        else:
-            dropbox_auth_url = dbx_mgr.get_authorize_url()
-        dropbox_auth_valid = False
+    if dbx_token and not dbx_token_expired:
+        return {"valid": True, "auth_url": None, "expires_at": dbx_token.get("expires_at")}
+
+    logger.info("Dropbox token missing or expired, generating auth URL.")
+    if DROPBOX_REDIRECT_URI:
+        dropbox_auth_url = _external_url("/dropbox_start")
     else:
-        dropbox_auth_valid = True
+        dropbox_auth_url = DropboxAuthManager().get_authorize_url()
+    return invalid_auth_section(dropbox_auth_url)
 
-    # Get data from Oura
-    default_start_date = date.today() - timedelta(days=90)
-    default_end_date = date.today()
+async def _metrics_status(user_id: str, data_version: int, start: date, end: date) -> dict:
+    from metrics.view import aget_metrics_pivot_cached  # lazy import
+    from status_snapshot import metrics_section
+    return metrics_section(data_version, start, end, await aget_metrics_pivot_cached(user_id, start, end, data_version))
 
-    if oura_auth_valid:
-        job_id = pull_data(
-            access_token["access_token"],
-            start_date=default_start_date,
-            end_date=default_end_date,
-        )
-        logger.info(f"Oura ETL job enqueued: {job_id}")
+async def _start_ingestion(user_id: str, redis_client, oura_valid: bool, start: date, end: date) -> None:
+    """Enqueue (and track) the Oura pull and rate-limited Atracker sync for /jobs/events to follow."""
+    logger = logging.getLogger("health_check")
+    if oura_valid:
+        from metrics.oura.ingest import get_valid_access_token, pull_data  # lazy import
+        access_token = await get_valid_access_token(user_id, redis_client=redis_client)
+        if access_token:
+            job_id = await run_in_threadpool(
+                pull_data, access_token["access_token"], start_date=start, end_date=end, user_id=user_id,
+            )
+            logger.info(f"Oura ETL job enqueued: {job_id}")
 
-    # Enqueue Atracker ETL job at most once every 2 minutes using a Redis lock
+    # Enqueue Atracker ETL job at most once a minute using a Redis lock
     enqueued_jobs = {}
     try:
-        lock_key = "locks:atracker:enqueue"
+        lock_key = f"locks:atracker:enqueue:{user_id}"
         can_enqueue = await redis_client.set(lock_key, "1", ex=60, nx=True)
     except Exception:
         # If redis doesn't support SET NX in this context (e.g., tests), allow enqueue
         can_enqueue = True
     if can_enqueue:
-        enqueue_atracker_job(enqueued_jobs, USERID)
+        await run_in_threadpool(enqueue_atracker_job, enqueued_jobs, user_id)
         logger.info(f"Atracker ETL job enqueued: {enqueued_jobs.get('atracker')}")
     else:
-        logger.info("Atracker ETL enqueue skipped due to lock (within 2 minutes).")
+        logger.info("Atracker ETL enqueue skipped due to lock.")
+
 
-     # Always return metrics_view, even if Oura/Dropbox auth is not valid
-    metrics_view = get_metrics_pivot(
-        USERID,
-        default_start_date,
-        default_end_date,
+@router.get("/health")
+async def health_check(
+    redis_client=Depends(get_redis_client),
+    user_id: str = Depends(get_user_id),
+):
+    """Auth status and the 90-day metrics view, served from the status snapshot.
+
+    Normally one HGETALL; sections that are missing or no longer current are
+    rebuilt concurrently and written back. Ingestion jobs are enqueued and
+    tracked before responding, so the dashboard's /jobs/events sees them.
+    """
+    from status_snapshot import aget_snapshot, asave_sections, auth_current, metrics_current, status_window  # lazy import
+    start, end = status_window()
+    # Read the version first: if a job lands mid-read the client sees a newer one and refetches
+    snapshot, data_version = await asyncio.gather(
+        aget_snapshot(user_id, redis_client),
+        aget_data_version(user_id, redis_client),
     )
+    now = time.time()
+    rebuild = {}
+    if not auth_current(snapshot.get("oura"), now):
+        rebuild["oura"] = _oura_status(user_id, redis_client)
+    if not auth_current(snapshot.get("dropbox"), now):
+        rebuild["dropbox"] = _dropbox_status(user_id)
+    if not metrics_current(snapshot.get("metrics"), data_version, start, end):
+        rebuild["metrics"] = _metrics_status(user_id, data_version, start, end)
+    if rebuild:
+        fresh = dict(zip(rebuild, await asyncio.gather(*rebuild.values())))
+        await asave_sections(user_id, fresh, redis_client)
+        snapshot.update(fresh)
 
+    oura, dropbox = snapshot["oura"], snapshot["dropbox"]
+    try:
+        await _start_ingestion(user_id, redis_client, oura["valid"], start, end)
+    except Exception as e:
+        # the status is still worth serving; the scheduler retries ingestion
+        logging.getLogger("health_check").warning(f"Could not enqueue ingestion for user {user_id}: {e}")
     return {
-        "metrics_view": metrics_view,
-        "oura_auth_url": oura_auth_url,
-        "oura_auth_valid": oura_auth_valid,
-        "dropbox_auth_url": dropbox_auth_url,
-        "dropbox_auth_valid": dropbox_auth_valid,
+        "metrics_view": snapshot["metrics"]["metrics_view"],
+        "data_version": data_version,
+        "oura_auth_url": oura["auth_url"],
+        "oura_auth_valid": oura["valid"],
+        "dropbox_auth_url": dropbox["auth_url"],
+        "dropbox_auth_valid": dropbox["valid"],
+        "last_ingest": snapshot["last_ingest"],
         "status": "healthy"
     }
 
-@app.get("/dropbox_finish")
-async def dropbox_finish(code: str):
+@router.get("/metrics/view")
+async def metrics_view(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    user_id: str = Depends(get_user_id),
+    redis_client=Depends(get_redis_client),
+):
+    """The /health metrics pivot without any auth checks or job enqueueing (for refetches)."""
+    from metrics.view import aget_metrics_pivot_cached  # lazy import
+    end = end or date.today()
+    start = start or end - timedelta(days=90)
+    data_version = await aget_data_version(user_id, redis_client)
+    return {
+        "metrics_view": await aget_metrics_pivot_cached(user_id, start, end, data_version),
+        "data_version": data_version,
+    }
+
+@router.get("/jobs/events")
+async def job_events(
+    request: Request,
+    user_id: str = Depends(get_user_id),
+    redis_client=Depends(get_redis_client),
+):
+    """SSE: `progress` events for the user's ETL jobs, then one `done` once none are in flight.
+
+    `done` carries the data version so the client refetches only if data changed.
+    """
+    from jobs import ACTIVE_JOB_STATUSES, job_statuses  # lazy import (rq)
+
+    def sse(event: str, data) -> str:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    async def stream():
+        deadline = time.monotonic() + JOB_EVENTS_MAX_SECONDS
+        while not await request.is_disconnected():
+            jobs = await run_in_threadpool(job_statuses, user_id)
+            active = [j for j in jobs if j["status"] in ACTIVE_JOB_STATUSES]
+            yield sse("progress", {"active": len(active), "jobs": jobs})
+            if not active or time.monotonic() > deadline:
+                yield sse("done", {"data_version": await aget_data_version(user_id, redis_client)})
+                return
+            await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/ratelimit")
+async def rate_limit_view(
+    redis_client=Depends(get_redis_client),
+    _user_id: str = Depends(get_user_id),
+):
+    """Outbound call counts, throttled calls and total wait per provider, across workers (signed-in only)."""
+    from ratelimit import arate_limit_stats  # lazy import
+    return await arate_limit_stats(redis_client)
+
+@router.get("/analytics/correlations")
+async def correlations_view(
+    lags: str = "0,1",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    x: str = "wellness",
+    y: str = "productivity",
+    min_periods: Optional[int] = None,
+    user_id: str = Depends(get_user_id),
+    redis_client=Depends(get_redis_client),
+):
+    """Correlation of x metrics on day N with y metrics on day N+lag, for each lag in `lags`."""
+    from analytics import (  # lazy import (numpy)
+        get_correlations, ANALYTICS_MIN_PERIODS, ANALYTICS_MAX_DAYS, ANALYTICS_MAX_LAGS, ANALYTICS_MAX_ABS_LAG,
+    )
+    end = end or date.today()
+    start = start or end - timedelta(days=730)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    days = (end - start).days + 1
+    if days > ANALYTICS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"range is limited to {ANALYTICS_MAX_DAYS} days")
+    if min_periods is not None and not 2 <= min_periods <= days:
+        raise HTTPException(status_code=400, detail=f"min_periods must be between 2 and the {days} days requested")
+    try:
+        lag_list = [int(v) for v in lags.split(",") if v.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="lags must be comma-separated integers")
+    if len(lag_list) > ANALYTICS_MAX_LAGS or any(abs(lag) > ANALYTICS_MAX_ABS_LAG for lag in lag_list):
+        raise HTTPException(
+            status_code=400,
+            detail=f"at most {ANALYTICS_MAX_LAGS} lags, each within ±{ANALYTICS_MAX_ABS_LAG} days",
+        )
+    return await get_correlations(
+        user_id,
+        start,
+        end,
+        lags=lag_list or [0],
+        x_category=x,
+        y_category=y,
+        min_periods=min_periods or ANALYTICS_MIN_PERIODS,
+        redis_client=redis_client,
+    )
+
+@router.get("/export/{kind}")
+def export_data(
+    kind: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    format: str = "parquet",
+    user_id: str = Depends(get_user_id),
+):
+    """Stream metrics or task_entries as Parquet/Arrow IPC (sync: runs on the threadpool)."""
+    from export import EXPORTS, EXPORT_FORMATS, iter_record_batches, stream_export  # lazy import (pyarrow)
+    if kind not in EXPORTS or format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=404, detail=f"Unknown export {kind}.{format}")
+    ext = "parquet" if format == "parquet" else "arrows"
+    return StreamingResponse(
+        stream_export(kind, format, iter_record_batches(kind, user_id, start, end)),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{kind}.{ext}"'},
+    )
+
+@router.get("/rolling")
+async def rolling_view(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    user_id: str = Depends(get_user_id),
+):
+    """Precomputed 7/28-day mean, std and z-score per metric; defaults to the last 90 days."""
+    from metrics.view import aget_rolling_pivot  # lazy import
+    end = end or date.today()
+    start = start or end - timedelta(days=90)
+    return {"rolling_view": await aget_rolling_pivot(user_id, start, end)}
+
+@router.get("/series")
+async def series_view(
+    endpoint: str,
+    name: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user_id: str = Depends(get_user_id),
+):
+    """Dense series (e.g. heartrate/bpm) for charting; defaults to the last 24 hours."""
+    from metrics.view import aget_series_view  # lazy import
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(days=1)
+    # treat naive query params as UTC
+    start, end = (t if t.tzinfo else t.replace(tzinfo=timezone.utc) for t in (start, end))
+    return await aget_series_view(user_id, endpoint, name, start, end)
+
+@router.get("/login")
+async def login(token: str, redis_client=Depends(get_redis_client)):
+    """Trade a one-time login link (python -m auth.session <user>) for a session cookie."""
+    from auth.session import SESSION_COOKIE, SESSION_TTL_SECONDS, consume_login_token, sign_session  # lazy import
+    user_id = await consume_login_token(token, redis_client)
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Login link is invalid, expired or already used")
+    await _upsert_user(user_id)
+    response = RedirectResponse(url="/dashboard", status_code=303)
+    response.set_cookie(
+        SESSION_COOKIE, sign_session(user_id), max_age=SESSION_TTL_SECONDS,
+        httponly=True, samesite="lax", secure=bool(DOMAIN),
+    )
+    return response
+
+@router.get("/logout")
+async def logout():
+    from auth.session import SESSION_COOKIE  # lazy import
+    response = PlainTextResponse("Signed out")
+    response.delete_cookie(SESSION_COOKIE)
+    return response
+
+@router.get("/dropbox_finish")
+async def dropbox_finish(code: str, user_id: str = Depends(get_user_id)):
+    from metrics.atracker.dropbox import DropboxAuthManager  # lazy import
     mgr = DropboxAuthManager()
-    await mgr.finish_no_redirect(USERID, code)
+    await mgr.finish_no_redirect(user_id, code)
+    await _upsert_user(user_id)
     return RedirectResponse(url="/health")
 
-@app.get("/dropbox_start")
-async def dropbox_start():
+@router.get("/dropbox_start")
+async def dropbox_start(user_id: str = Depends(get_user_id)):
     if not DROPBOX_REDIRECT_URI:
         return {"error": "DROPBOX_REDIRECT_URI is not configured"}
+    from metrics.atracker.dropbox import DropboxAuthManager  # lazy import
     mgr = DropboxAuthManager()
-    url = await mgr.get_authorize_url_redirect(USERID, DROPBOX_REDIRECT_URI)
+    url = await mgr.get_authorize_url_redirect(user_id, DROPBOX_REDIRECT_URI)
     return RedirectResponse(url=url)
 
-@app.get("/dropbox_callback")
-async def dropbox_callback(code: str, state: str):
+@router.get("/dropbox_callback")
+async def dropbox_callback(code: str, state: str, user_id: str = Depends(get_user_id)):
     if not DROPBOX_REDIRECT_URI:
         return {"error": "DROPBOX_REDIRECT_URI is not configured"}
+    # Dropbox state is "<csrf>|<url_state>"; url_state names the user who started the flow
+    if state.partition("|")[2] != user_id:
+        raise HTTPException(status_code=403, detail="OAuth state belongs to another user")
+    from metrics.atracker.dropbox import DropboxAuthManager  # lazy import
     mgr = DropboxAuthManager()
-    await mgr.finish_redirect(USERID, code, state, DROPBOX_REDIRECT_URI)
+    # finish_redirect checks the CSRF token against the one stored for this user, then deletes it
+    await mgr.finish_redirect(user_id, code, state, DROPBOX_REDIRECT_URI)
+    await _upsert_user(user_id)
     return RedirectResponse(url="/dashboard")
 
-@app.get("/oura_callback")
+@router.get("/oura_start")
+async def oura_start(user_id: str = Depends(get_user_id), redis_client=Depends(get_redis_client)):
+    from auth.session import issue_oauth_state  # lazy import
+    from metrics.oura.ingest import get_oura_auth_url
+    state = await issue_oauth_state("oura", user_id, redis_client)
+    return RedirectResponse(url=get_oura_auth_url(state))
+
+@router.get("/oura_callback")
 async def handle_callback(
     code: str,
     state: str,
     error: Optional[str] = None,
+    user_id: str = Depends(get_user_id),
     redis_client=Depends(get_redis_client)
 ):
     """
@@ -178,6 +445,15 @@ async def handle_callback(
     if error:
         return {"message": f"Error during callback: {error}"}
 
-    access_token = await get_and_cache_access_token(code, redis_client=redis_client)
+    from auth.session import consume_oauth_state  # lazy import
+    from metrics.oura.ingest import get_and_cache_access_token
+    # single use: a replayed or forged state finds nothing
+    if await consume_oauth_state("oura", state, redis_client) != user_id:
+        return {"message": "Error during callback: invalid state"}
+
+    access_token = await get_and_cache_access_token(code, user_id, redis_client=redis_client)
+    await _upsert_user(user_id)
 
     return RedirectResponse(url="/dashboard")
+
+app = create_app()
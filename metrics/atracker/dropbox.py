@@ -1,10 +1,10 @@
 import os
 import time
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 import asyncio
 
 from json import dumps as json_dumps, loads as json_loads
-from auth.cache import get_async_redis, REDIS_TTL_SECONDS, auth_key
+from auth.cache import get_async_redis, REDIS_TTL_SECONDS, auth_key, get_token, set_token, delete_token
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     import dropbox  # type: ignore
@@ -15,24 +15,54 @@ DROPBOX_APP_KEY = os.environ.get("DROPBOX_APP_KEY")
 DROPBOX_APP_SECRET = os.environ.get("DROPBOX_APP_SECRET")
 _redis = get_async_redis()
 
+# One SDK client per user, reused while that user's credentials are unchanged.
+_sdk_clients: Dict[str, Tuple[tuple, "dropbox.Dropbox"]] = {}
+
 
 def _dropbox_key(user_id: str) -> str:
     return auth_key("dropbox", user_id)
 
 
+def _sdk_client(
+    user_id: str,
+    refresh_token: Optional[str] = None,
+    access_token: Optional[str] = None,
+    app_key: Optional[str] = None,
+    app_secret: Optional[str] = None,
+) -> "dropbox.Dropbox":
+    creds = (refresh_token, access_token, app_key, app_secret)
+    cached = _sdk_clients.get(user_id)
+    if cached and cached[0] == creds:
+        return cached[1]
+    import dropbox as _dropbox  # lazy import
+    # 429s are raised rather than slept on inside the SDK, so the shared
+    # limiter can hold every worker for this user (see atracker.ingest)
+    if refresh_token:
+        client = _dropbox.Dropbox(
+            oauth2_refresh_token=refresh_token,
+            app_key=app_key,
+            app_secret=app_secret,
+            max_retries_on_rate_limit=0,
+        )
+    else:
+        client = _dropbox.Dropbox(access_token, max_retries_on_rate_limit=0)
+    _sdk_clients[user_id] = (creds, client)
+    return client
+
+
 async def cache_dropbox_token(user_id: str, token: Dict[str, Any], ttl: int = REDIS_TTL_SECONDS) -> None:
     if "expires_at" not in token:
         token["expires_at"] = int(time.time()) + token.get("expires_in", REDIS_TTL_SECONDS)
-    await _redis.set(_dropbox_key(user_id), json_dumps(token), ex=ttl)
+    await set_token(_dropbox_key(user_id), token, ttl=ttl, redis_client=_redis)
 
 
 async def get_dropbox_token(user_id: str) -> Optional[Dict[str, Any]]:
-    raw = await _redis.get(_dropbox_key(user_id))
-    return json_loads(raw) if raw else None
+    return await get_token(_dropbox_key(user_id), redis_client=_redis)
 
 
 async def delete_dropbox_token(user_id: str) -> None:
-    await _redis.delete(_dropbox_key(user_id))
+    _sdk_clients.pop(user_id, None)
+    await delete_token(_dropbox_key(user_id), redis_client=_redis)
 
 
 async def get_dropbox_client(access_token: Optional[str] = None, user_id: Optional[str] = None):
@@ -48,9 +78,9 @@ async def get_dropbox_client(access_token: Optional[str] = None, user_id: Option
     try:
         cached = await get_dropbox_token(user_id)
         if cached and cached.get("refresh_token"):
-            import dropbox as _dropbox  # lazy import
-            return _dropbox.Dropbox(
-                oauth2_refresh_token=cached["refresh_token"],
+            return _sdk_client(
+                user_id,
+                refresh_token=cached["refresh_token"],
                 app_key=DROPBOX_APP_KEY,
                 app_secret=DROPBOX_APP_SECRET,
             )
@@ -102,18 +132,17 @@ class DropboxAuthManager:
         token = await get_dropbox_token(user_id)
         # Prefer refresh-token based client which auto-refreshes
         if token and token.get("refresh_token"):
-            import dropbox as _dropbox  # lazy import
-            return _dropbox.Dropbox(
-                oauth2_refresh_token=token["refresh_token"],
+            return _sdk_client(
+                user_id,
+                refresh_token=token["refresh_token"],
                 app_key=self.app_key,
                 app_secret=self.app_secret,
             )
         # Fallback to access token if available
         if token and token.get("access_token"):
-            import dropbox as _dropbox  # lazy import
-            return _dropbox.Dropbox(token["access_token"])
+            return _sdk_client(user_id, access_token=token["access_token"])
         # Finally, use env-based fallback
-        return get_dropbox_client()
+        return await get_dropbox_client(user_id=user_id)
 
     # -------- Redirect-based OAuth2 (smoother UX) --------
     def _redirect_flow(self, redirect_uri: str, session: dict):
@@ -132,7 +161,8 @@ class DropboxAuthManager:
         # Create a fresh session dict and persist it for callback
         sess: dict = {}
         flow = self._redirect_flow(redirect_uri, sess)
-        url = flow.start()
+        # url_state comes back in the callback's state so it can find this user's CSRF session
+        url = flow.start(url_state=user_id)
         await _redis.set(auth_key("dropbox", f"csrf:{user_id}"), json_dumps(sess), ex=600)
         return url
 
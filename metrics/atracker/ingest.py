@@ -1,5 +1,6 @@
 import os
 import json
+import asyncio
 from typing import Iterator
 from datetime import datetime
 from typing import Optional
@@ -7,6 +8,10 @@ from typing import Optional
 import dropbox
 
 from .dropbox import get_dropbox_client
+from ratelimit import aacquire, penalize
+
+# 429s retried per call (each waits out Dropbox's backoff)
+DROPBOX_MAX_RETRIES = int(os.getenv("DROPBOX_MAX_RETRIES", "3"))
 
 
 def parse_atracker_datafile(filepath: str) -> Iterator[dict]:
@@ -45,13 +50,35 @@ def _find_existing_version(local_dir: str, filename: str) -> bool:
     return False
 
 
+async def _dropbox_call(user_id: Optional[str], fn, *args, **kwargs):
+    """One Dropbox API call: wait for a token on the loop, run the blocking SDK call off it.
+
+    A 429 puts the user's budget on hold for the backoff (all workers) and is retried.
+    """
+    import logging
+    retries = 0
+    while True:
+        await aacquire("dropbox", user_id)
+        try:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        except dropbox.exceptions.RateLimitError as e:
+            if retries >= DROPBOX_MAX_RETRIES:
+                raise
+            retries += 1
+            retry_after = float(e.backoff or 60)
+            logging.getLogger("atracker_etl").warning(
+                f"Dropbox rate limited; holding user {user_id} for {retry_after}s"
+            )
+            await asyncio.to_thread(penalize, "dropbox", user_id, retry_after)
+
+
 def _download_file(
     dbx: dropbox.Dropbox,
     dbx_path: str,
     local_path: str,
     dated: bool = True,
 ) -> str:
-    """Download a file from Dropbox and return the local path used."""
+    """Download a file from Dropbox and return the local path used (blocking; callers rate-limit)."""
     os.makedirs(os.path.dirname(local_path), exist_ok=True)
     _md, res = dbx.files_download(dbx_path)
 
@@ -83,9 +110,9 @@ async def sync_folder(
 
     downloaded_files: list[str] = []
     logger.info(f"Listing Dropbox folder: {dropbox_path}")
-    result = dbx.files_list_folder(dropbox_path, recursive=True)
+    result = await _dropbox_call(user_id, dbx.files_list_folder, dropbox_path, recursive=True)
 
-    def handle_entries(entries):
+    async def handle_entries(entries):
         nonlocal downloaded_files
         for entry in entries:
             if isinstance(entry, dropbox.files.FileMetadata):
@@ -101,16 +128,16 @@ async def sync_folder(
                     continue
 
                 logger.info(f"Downloading file {entry.path_display} to {local_path}")
-                saved_path = _download_file(dbx, entry.path_display, local_path, dated=True)
+                saved_path = await _dropbox_call(user_id, _download_file, dbx, entry.path_display, local_path, dated=True)
                 downloaded_files.append(saved_path)
 
     # First page
-    handle_entries(result.entries)
+    await handle_entries(result.entries)
 
     # Paginate if more results
     while result.has_more:
-        result = dbx.files_list_folder_continue(result.cursor)
-        handle_entries(result.entries)
+        result = await _dropbox_call(user_id, dbx.files_list_folder_continue, result.cursor)
+        await handle_entries(result.entries)
 
     logger.info(f"Downloaded {len(downloaded_files)} files from Dropbox to {local_folder}")
     return downloaded_files
@@ -1,25 +1,43 @@
 import os
-import json
 import time
-import requests
+import asyncio
 import logging
-from datetime import date, datetime, timedelta
-from typing import Any, Dict, Tuple, Optional
+from datetime import date, datetime
+from typing import Any, Dict, List, Tuple, Optional
 
-from oura import OuraOAuth2Client
-from s3io import write_jsonl_gz
+from s3io import write_jsonl_gz_by_day
 
-from db import get_seen_events, create_seen_events_bulk, get_metrics
+from db import get_metrics
 from queueing import get_queue
-from jobs import run_etl_job
-from auth.cache import get_async_redis, REDIS_TTL_SECONDS, auth_key
+from jobs import enqueue_etl_job, queue_for_range, report_progress, track_job, user_slot_or_defer
+from auth.cache import (
+    get_async_redis,
+    REDIS_TTL_SECONDS,
+    auth_key,
+    get_token,
+    set_token,
+    delete_token,
+    refresh_lock_key,
+    acquire_lock,
+    release_lock,
+)
+from singleflight import SingleFlight
+from seen_dates import mark_seen, missing_days
+from ratelimit import aacquire
+from metrics.oura.timeseries import get_paginated_data
+from metrics.oura.planner import iter_range_batches, plan_ranges
 
 OURA_CLIENT_ID = os.environ["OURA_CLIENT_ID"]
 OURA_CLIENT_SECRET = os.environ["OURA_CLIENT_SECRET"]
 OURA_REDIRECT_URI=os.environ["OURA_REDIRECT_URI"]
 OURA_TOKEN_URL = "https://api.ouraring.com/oauth/token"
+OURA_REFRESH_TIMEOUT_SECONDS = 15
+OURA_REFRESH_LOCK_TTL_SECONDS = int(os.getenv("OURA_REFRESH_LOCK_TTL_SECONDS", "30"))
+# Refresh this long before expires_at so requests never see an expired token
+OURA_REFRESH_LEEWAY_SECONDS = int(os.getenv("OURA_REFRESH_LEEWAY_SECONDS", "300"))
 
 _redis = get_async_redis()
+_refresh_flight = SingleFlight()
 
 def _key(user_id: str) -> str:
     return auth_key("oura", user_id)
@@ -32,27 +50,29 @@ async def cache_access_token_from_cache(user_id: str, token: Dict[str, Any], ttl
         redis_client = _redis
     if "expires_at" not in token:
         token["expires_at"] = int(time.time()) + token.get("expires_in", REDIS_TTL_SECONDS)
-    await redis_client.set(_key(user_id), json.dumps(token), ex=ttl)
+    await set_token(_key(user_id), token, ttl=ttl, redis_client=redis_client)
 
 async def get_access_token_from_cache(user_id: str, redis_client=None) -> Optional[Dict[str, Any]]:
     if redis_client is None:
         redis_client = _redis
-    raw = await redis_client.get(_key(user_id))
-    return json.loads(raw) if raw else None
+    return await get_token(_key(user_id), redis_client=redis_client)
 
 async def delete_access_token(user_id: str, redis_client=None) -> None:
     if redis_client is None:
         redis_client = _redis
-    await redis_client.delete(_key(user_id))
+    await delete_token(_key(user_id), redis_client=redis_client)
 
-def get_oura_auth_url():
+def get_oura_auth_url(state: str):
+    """Oura's authorize URL; `state` is a nonce from auth.session.issue_oauth_state."""
+    from oura import OuraOAuth2Client  # lazy import (pulls in pandas)
     client = OuraOAuth2Client(client_id=OURA_CLIENT_ID, client_secret=OURA_CLIENT_SECRET)
     client.session.scope = "All scopes"
     client.session.redirect_uri = OURA_REDIRECT_URI
-    url, state = client.authorize_endpoint()
+    url, _state = client.authorize_endpoint(state=state)
     return url
 
-async def get_and_cache_access_token(code: str, user_key: str = "brucegarro", redis_client=None):
+async def get_and_cache_access_token(code: str, user_key: str, redis_client=None):
+    from oura import OuraOAuth2Client  # lazy import (pulls in pandas)
     client = OuraOAuth2Client(client_id=OURA_CLIENT_ID, client_secret=OURA_CLIENT_SECRET)
     client.session.scope = "All scopes"
     client.session.redirect_uri = OURA_REDIRECT_URI
@@ -61,55 +81,120 @@ async def get_and_cache_access_token(code: str, user_key: str = "brucegarro", re
     await cache_access_token_from_cache(user_key, token_dict, redis_client=redis_client)
     return access_token
 
-async def refresh_access_token(user_id: str, redis_client=None) -> Optional[Dict[str, Any]]:
-    """Refresh the Oura access token using the stored refresh token.
+async def _post_refresh(token: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """POST the refresh grant without blocking the event loop."""
+    logger = logging.getLogger("oura_auth")
+    import httpx  # lazy import
+    payload = {
+        "grant_type": "refresh_token",
+        "refresh_token": token["refresh_token"],
+        "client_id": OURA_CLIENT_ID,
+        "client_secret": OURA_CLIENT_SECRET,
+    }
+    async with httpx.AsyncClient(timeout=OURA_REFRESH_TIMEOUT_SECONDS) as client:
+        resp = await client.post(OURA_TOKEN_URL, data=payload)
+    if resp.status_code != 200:
+        logger.error(f"Failed to refresh Oura token: {resp.status_code} {resp.text}")
+        return None
+    refreshed = resp.json()
+    # Merge to preserve fields that may not be returned (e.g., refresh_token)
+    merged: Dict[str, Any] = {**token, **refreshed}
+    # Always compute a fresh expires_at from the best available expires_in
+    expires_in = (
+        (refreshed.get("expires_in") if isinstance(refreshed, dict) else None)
+        or merged.get("expires_in")
+        or REDIS_TTL_SECONDS
+    )
+    try:
+        expires_in = int(expires_in)
+    except Exception:
+        expires_in = REDIS_TTL_SECONDS
+    merged["expires_at"] = int(time.time()) + expires_in
+    return merged
 
-    Returns the updated token dict on success, or None if refresh failed or
-    no refresh token is available.
-    """
+async def _await_peer_refresh(user_id: str, stale: Dict[str, Any], redis_client) -> Optional[Dict[str, Any]]:
+    """Another process holds the refresh lock; wait for it to store the new token."""
+    deadline = time.monotonic() + OURA_REFRESH_LOCK_TTL_SECONDS
+    lock_key = refresh_lock_key("oura", user_id)
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.2)
+        current = await get_token(_key(user_id), redis_client=redis_client, fresh=True)
+        if current and current.get("expires_at", 0) != stale.get("expires_at", 0):
+            return current
+        if not await redis_client.exists(lock_key):
+            # Holder finished without writing a new token: its refresh failed
+            break
+    current = await get_token(_key(user_id), redis_client=redis_client, fresh=True)
+    if current and int(time.time()) < current.get("expires_at", 0):
+        return current
+    return None
+
+async def _refresh_access_token(user_id: str, redis_client) -> Optional[Dict[str, Any]]:
     logger = logging.getLogger("oura_auth")
-    if redis_client is None:
-        redis_client = _redis
-    token = await get_access_token_from_cache(user_id, redis_client=redis_client)
+    # Read past the local tier: a peer may already have rotated the refresh token
+    token = await get_token(_key(user_id), redis_client=redis_client, fresh=True)
     if not token or not token.get("refresh_token"):
         logger.warning("No Oura refresh token available; cannot refresh.")
         return None
 
+    lock_key = refresh_lock_key("oura", user_id)
     try:
-        payload = {
-            "grant_type": "refresh_token",
-            "refresh_token": token["refresh_token"],
-            "client_id": OURA_CLIENT_ID,
-            "client_secret": OURA_CLIENT_SECRET,
-        }
-        resp = requests.post(OURA_TOKEN_URL, data=payload, timeout=15)
-        if resp.status_code != 200:
-            logger.error(f"Failed to refresh Oura token: {resp.status_code} {resp.text}")
+        owner = await acquire_lock(lock_key, OURA_REFRESH_LOCK_TTL_SECONDS, redis_client=redis_client)
+    except Exception:
+        # Redis without SET NX support (e.g., tests): refresh unlocked
+        owner = ""
+    if owner is None:
+        logger.info(f"Oura token refresh for {user_id} already in progress elsewhere; waiting.")
+        return await _await_peer_refresh(user_id, token, redis_client)
+
+    try:
+        # A peer may have finished its refresh between our read and the lock;
+        # posting the refresh token it already rotated would log the user out.
+        current = await get_token(_key(user_id), redis_client=redis_client, fresh=True)
+        if current and (
+            current.get("refresh_token") != token["refresh_token"]
+            or int(time.time()) < current.get("expires_at", 0) - OURA_REFRESH_LEEWAY_SECONDS
+        ):
+            logger.info(f"Oura token for {user_id} was refreshed by a peer; reusing it.")
+            return current
+        token = current or token
+        await aacquire("oura", user_id, redis_client=redis_client)
+        merged = await _post_refresh(token)
+        if merged is None:
             return None
-        refreshed = resp.json()
-        # Merge to preserve fields that may not be returned (e.g., refresh_token)
-        merged: Dict[str, Any] = {**token, **refreshed}
-        # Always compute a fresh expires_at from the best available expires_in
-        expires_in = (
-            (refreshed.get("expires_in") if isinstance(refreshed, dict) else None)
-            or merged.get("expires_in")
-            or REDIS_TTL_SECONDS
-        )
-        try:
-            expires_in = int(expires_in)
-        except Exception:
-            expires_in = REDIS_TTL_SECONDS
-        merged["expires_at"] = int(time.time()) + expires_in
         await cache_access_token_from_cache(user_id, merged, redis_client=redis_client)
         logger.info("Oura access token refreshed successfully.")
         return merged
     except Exception as e:
         logger.exception(f"Exception refreshing Oura token: {e}")
         return None
+    finally:
+        if owner:
+            try:
+                await release_lock(lock_key, owner, redis_client=redis_client)
+            except Exception:
+                logger.warning(f"Could not release Oura refresh lock for {user_id}")
+
+async def refresh_access_token(user_id: str, redis_client=None) -> Optional[Dict[str, Any]]:
+    """Refresh the Oura access token using the stored refresh token.
+
+    Exactly one refresh runs per user: callers in this process share one task,
+    and processes coordinate through a Redis lock so rotated refresh tokens are
+    never overwritten by a racing refresh.
+
+    Returns the updated token dict on success, or None if refresh failed or
+    no refresh token is available.
+    """
+    if redis_client is None:
+        redis_client = _redis
+    return await _refresh_flight.do(user_id, lambda: _refresh_access_token(user_id, redis_client))
 
 async def get_valid_access_token(user_id: str, redis_client=None) -> Optional[Dict[str, Any]]:
     """Get a valid Oura access token, refreshing if expired.
 
+    Tokens within OURA_REFRESH_LEEWAY_SECONDS of `expires_at` are still
+    returned, with a refresh started in the background.
+
     Returns the token dict with keys like access_token, expires_at, and possibly
     refresh_token. Returns None if no valid token can be obtained.
     """
@@ -119,25 +204,34 @@ async def get_valid_access_token(user_id: str, redis_client=None) -> Optional[Di
     if not token:
         return None
     now = int(time.time())
-    if now > token.get("expires_at", 0):
+    expires_at = token.get("expires_at", 0)
+    if now > expires_at:
         refreshed = await refresh_access_token(user_id, redis_client=redis_client)
         return refreshed
+    if now > expires_at - OURA_REFRESH_LEEWAY_SECONDS and token.get("refresh_token"):
+        _refresh_flight.start(user_id, lambda: _refresh_access_token(user_id, redis_client))
     return token
 
-def get_data_from_api(access_token: str, endpoint: str, start_date: date, end_date: date) -> Dict[str, Any]:
+def get_data_from_api(
+    access_token: str,
+    endpoint: str,
+    start_date: date,
+    end_date: date,
+    user_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
     logger = logging.getLogger("oura_etl")
-    url = f'https://api.ouraring.com/v2/usercollection/{endpoint}'
-    headers = { 'Authorization': f'Bearer {access_token}' }
-    params = {
+    logger.info(f"Requesting Oura API endpoint {endpoint} for {start_date} to {end_date}")
+    return get_paginated_data(access_token, endpoint, {
         'start_date': start_date.isoformat(),
         'end_date': end_date.isoformat(),
-    }
-    logger.info(f"Requesting Oura API endpoint {endpoint} for {start_date} to {end_date}")
-    response = requests.request('GET', url, headers=headers, params=params)
-    logger.info(f"Oura API response status: {response.status_code}")
-    return response.json()["data"]
+    }, user_id=user_id)
 
-def _oura_etl_job(access_token: str, start_date: date, end_date: date, user_id="brucegarro"):
+def _oura_etl_job(access_token: str, start_date: date, end_date: date, user_id: str):
+    with user_slot_or_defer(user_id) as acquired:
+        if acquired:
+            _run_oura_etl(access_token, start_date, end_date, user_id)
+
+def _run_oura_etl(access_token: str, start_date: date, end_date: date, user_id: str):
     logger = logging.getLogger("oura_etl")
     endpoints = [
         'daily_sleep',
@@ -146,59 +240,56 @@ def _oura_etl_job(access_token: str, start_date: date, end_date: date, user_id="
     logger.info(f"Starting Oura ETL for endpoints: {endpoints}")
     for endpoint in endpoints:
         logger.info(f"Checking seen events for endpoint {endpoint}")
-        seen_events = { event.date for event in get_seen_events(
-            user_id=user_id,
-            endpoint=endpoint,
-            start_date=start_date,
-            end_date=end_date,
-        ) }
-        unseen_dates = {
-            start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)
-        } - seen_events
+        unseen_dates = set(missing_days(user_id, endpoint, start_date, end_date))
 
         logger.info(f"Unseen dates for {endpoint}: {len(unseen_dates)}")
         if unseen_dates:
-            logger.info(f"Fetching API data for {endpoint} from Oura API.")
-            api_data = [
-                r for r in
-                    get_data_from_api(
-                        access_token,
-                        endpoint,
-                        min(unseen_dates),
-                        max(unseen_dates)
-                    ) if datetime.fromisoformat(r["timestamp"]).date() in unseen_dates
-            ]
-
-            if api_data:
-                logger.info(f"Persisting {len(api_data)} records for {endpoint} to S3.")
-                write_jsonl_gz(
-                    records=api_data,
-                    vendor="oura",
-                    api="v2",
-                    endpoint=endpoint,
-                    schema="v1"
-                )
+            ranges = plan_ranges(unseen_dates)
+            logger.info(f"Fetching {endpoint} from Oura API in {len(ranges)} request ranges.")
+            pulled_days: set[date] = set()
 
-                logger.info(f"Creating seen events bulk for {endpoint}.")
-                create_seen_events_bulk(
-                    user_id=user_id,
-                    endpoint=endpoint,
-                    dates={
-                        datetime.fromisoformat(item["timestamp"]).date()
-                        for item in api_data
-                    }
+            def unseen_records():
+                # ranges arrive in day order, so the raw zone writes one day part at a time
+                batches = iter_range_batches(
+                    lambda start, end: get_data_from_api(access_token, endpoint, start, end, user_id),
+                    ranges,
                 )
+                for _span, batch in batches:
+                    for r in batch:
+                        day = datetime.fromisoformat(r["timestamp"]).date()
+                        if day in unseen_dates:
+                            pulled_days.add(day)
+                            yield r
+
+            logger.info(f"Streaming {endpoint} records to S3.")
+            written = write_jsonl_gz_by_day(
+                records=unseen_records(),
+                vendor="oura",
+                api="v2",
+                endpoint=endpoint,
+                day_of=lambda r: r["day"],
+                schema="v1",
+                user_id=user_id,
+            )
+
+            if written["record_count"]:
+                report_progress(**{f"{endpoint}_records": written["record_count"]})
+                logger.info(f"Persisted {written['record_count']} records for {endpoint}; marking seen dates.")
+                mark_seen(user_id, endpoint, pulled_days)
 
-                logger.info(f"Enqueuing ETL job for {endpoint}.")
-                q = get_queue("etl")
-                q.enqueue(run_etl_job, endpoint, date.today().isoformat(), user_id, job_timeout=300)
+                # one job over exactly the day partitions just written; always an
+                # interval, since a bare date means the legacy ingestion-date layout
+                days = sorted(written["days"])
+                logger.info(f"Enqueuing ETL job for {endpoint} days {days[0]}..{days[-1]}.")
+                enqueue_etl_job(endpoint, f"{days[0]}/{days[-1]}", user_id, job_timeout=300)
 
     logger.info(f"Oura ETL complete for user {user_id}.")
 
-def pull_data(access_token: str, start_date: date, end_date: date, user_id="brucegarro"):
+def pull_data(access_token: str, start_date: date, end_date: date, user_id: str, queue_name: Optional[str] = None):
     logger = logging.getLogger("oura_etl")
     logger.info(f"Enqueuing Oura ETL job for user {user_id}")
-    q = get_queue("etl")
-    job = q.enqueue(_oura_etl_job, access_token, start_date, end_date, user_id, job_timeout=600)
+    q = get_queue(queue_name or queue_for_range(start_date, end_date))
+    job = q.enqueue(_oura_etl_job, access_token, start_date, end_date, user_id, job_timeout=600, meta={"endpoint": "oura"})
+    track_job(user_id, job)
     logger.info(f"Oura ETL job enqueued: {job.id}")
     return job.id
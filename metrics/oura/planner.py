@@ -0,0 +1,59 @@
+"""Turn unseen days into the fewest Oura API requests that cover exactly them.
+
+One missing day from three months ago and one from today become two one-day
+requests rather than a 90-day download; a first-time backfill becomes a
+series of OURA_FETCH_MAX_DAYS windows fetched a few at a time.
+"""
+import os
+from collections import deque
+from itertools import islice
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+# Longest span requested in one call (Oura caps heartrate at 30 days)
+OURA_FETCH_MAX_DAYS = int(os.getenv("OURA_FETCH_MAX_DAYS", "30"))
+# Requests in flight at once per job
+OURA_FETCH_CONCURRENCY = int(os.getenv("OURA_FETCH_CONCURRENCY", "4"))
+
+DayRange = Tuple[date, date]
+
+
+def plan_ranges(days: Iterable[date], max_days: int = OURA_FETCH_MAX_DAYS) -> List[DayRange]:
+    """Minimal contiguous [start, end] runs covering days, none longer than max_days."""
+    ranges: List[DayRange] = []
+    for day in sorted(set(days)):
+        if ranges:
+            start, end = ranges[-1]
+            if day == end + timedelta(days=1) and (day - start).days < max_days:
+                ranges[-1] = (start, day)
+                continue
+        ranges.append((day, day))
+    return ranges
+
+
+def iter_range_batches(
+    fetch: Callable[[date, date], List[Dict[str, Any]]],
+    ranges: List[DayRange],
+    concurrency: int = OURA_FETCH_CONCURRENCY,
+) -> Iterator[Tuple[DayRange, List[Dict[str, Any]]]]:
+    """Yield (range, fetch(start, end)) in range order, up to `concurrency` fetches in flight.
+
+    A new fetch starts only as a finished one is handed out, so a multi-year
+    backfill holds at most `concurrency` ranges of records at a time.
+    """
+    if len(ranges) <= 1 or concurrency <= 1:
+        for span in ranges:
+            yield span, fetch(*span)
+        return
+    spans = iter(ranges)
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(ranges))) as pool:
+        pending = deque((span, pool.submit(fetch, *span)) for span in islice(spans, concurrency))
+        while pending:
+            span, future = pending.popleft()
+            batch = future.result()
+            following = next(spans, None)
+            if following is not None:
+                pending.append((following, pool.submit(fetch, *following)))
+            yield span, batch
+
@@ -0,0 +1,158 @@
+import os
+import logging
+import requests
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from s3io import write_jsonl_gz_by_day
+from db import write_samples
+from queueing import get_queue, QUEUE_BULK
+from jobs import refresh_status, report_progress, track_job, user_slot_or_defer
+from seen_dates import mark_seen, missing_days
+from metrics.oura.planner import iter_range_batches, plan_ranges
+from ratelimit import acquire, penalize
+
+OURA_API_BASE = "https://api.ouraring.com/v2/usercollection"
+# Dense endpoints stored in metric_sample (daily ones go through etl_metrics)
+SERIES_ENDPOINTS = ["heartrate", "sleep"]
+# 429s retried per request (each waits out the provider's Retry-After)
+OURA_MAX_RETRIES = int(os.getenv("OURA_MAX_RETRIES", "3"))
+# A day this far back with no samples is done, not waiting on a ring sync
+OURA_SERIES_SETTLE_DAYS = int(os.getenv("OURA_SERIES_SETTLE_DAYS", "2"))
+
+Sample = Tuple[str, datetime, float]
+
+
+def get_paginated_data(
+    access_token: str,
+    endpoint: str,
+    params: Dict[str, str],
+    user_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """GET an Oura collection, following next_token until exhausted.
+
+    Every request goes through the shared Oura rate limiter; a 429 puts the
+    user's budget on hold for Retry-After (all workers) and is retried.
+    """
+    logger = logging.getLogger("oura_etl")
+    url = f"{OURA_API_BASE}/{endpoint}"
+    headers = {"Authorization": f"Bearer {access_token}"}
+    data: List[Dict[str, Any]] = []
+    params = dict(params)
+    retries = 0
+    while True:
+        acquire("oura", user_id)
+        response = requests.get(url, headers=headers, params=params, timeout=30)
+        logger.info(f"Oura API {endpoint} response status: {response.status_code}")
+        if response.status_code == 429 and retries < OURA_MAX_RETRIES:
+            retries += 1
+            retry_after = float(response.headers.get("Retry-After") or 60)
+            logger.warning(f"Oura API {endpoint} rate limited; holding user {user_id} for {retry_after}s")
+            penalize("oura", user_id, retry_after)
+            continue
+        response.raise_for_status()
+        body = response.json()
+        data.extend(body.get("data", []))
+        if not body.get("next_token"):
+            return data
+        params["next_token"] = body["next_token"]
+
+
+def _params(endpoint: str, start_date: date, end_date: date) -> Dict[str, str]:
+    if endpoint == "heartrate":
+        # heartrate is addressed by datetime; end is exclusive
+        return {
+            "start_datetime": datetime.combine(start_date, time.min, tzinfo=timezone.utc).isoformat(),
+            "end_datetime": datetime.combine(end_date + timedelta(days=1), time.min, tzinfo=timezone.utc).isoformat(),
+        }
+    return {"start_date": start_date.isoformat(), "end_date": end_date.isoformat()}
+
+
+def _record_day(endpoint: str, record: Dict[str, Any]) -> date:
+    if endpoint == "sleep":
+        return date.fromisoformat(record["day"])
+    return datetime.fromisoformat(record["timestamp"]).astimezone(timezone.utc).date()
+
+
+def heartrate_samples(records: List[Dict[str, Any]]) -> Iterator[Sample]:
+    for r in records:
+        yield "bpm", datetime.fromisoformat(r["timestamp"]), float(r["bpm"])
+
+
+def sleep_samples(records: List[Dict[str, Any]]) -> Iterator[Sample]:
+    """Expand each sleep period's fixed-interval hrv/heart_rate arrays into points."""
+    for r in records:
+        for name in ("hrv", "heart_rate"):
+            block = r.get(name)
+            if not block or not block.get("items"):
+                continue
+            start = datetime.fromisoformat(block["timestamp"])
+            step = timedelta(seconds=float(block["interval"]))
+            for i, value in enumerate(block["items"]):
+                if value is not None:
+                    yield name, start + i * step, float(value)
+
+
+_SAMPLE_PARSERS = {
+    "heartrate": heartrate_samples,
+    "sleep": sleep_samples,
+}
+
+
+def enqueue_timeseries(access_token: str, start_date: date, end_date: date, user_id: str) -> Optional[str]:
+    """Enqueue the dense-series pull on the bulk queue, only if some day is still unseen."""
+    if not any(missing_days(user_id, endpoint, start_date, end_date) for endpoint in SERIES_ENDPOINTS):
+        return None
+    job = get_queue(QUEUE_BULK).enqueue(
+        _oura_timeseries_job, access_token, start_date, end_date, user_id,
+        job_timeout=1800, meta={"endpoint": "oura_timeseries"},
+    )
+    track_job(user_id, job)
+    return job.id
+
+
+def _oura_timeseries_job(access_token: str, start_date: date, end_date: date, user_id: str):
+    with user_slot_or_defer(user_id) as acquired:
+        if acquired:
+            _run_oura_timeseries(access_token, start_date, end_date, user_id)
+
+
+def _run_oura_timeseries(access_token: str, start_date: date, end_date: date, user_id: str):
+    logger = logging.getLogger("oura_etl")
+    today = date.today()
+    for endpoint in SERIES_ENDPOINTS:
+        unseen = set(missing_days(user_id, endpoint, start_date, end_date))
+        logger.info(f"Unseen dates for {endpoint}: {len(unseen)}")
+        if not unseen:
+            continue
+
+        # one range at a time: a multi-year backfill never holds more than a few ranges of samples
+        batches = iter_range_batches(
+            lambda start, end: get_paginated_data(access_token, endpoint, _params(endpoint, start, end), user_id),
+            plan_ranges(unseen),
+        )
+        inserted, pulled_days = 0, set()
+        for _span, batch in batches:
+            records = [r for r in batch if _record_day(endpoint, r) in unseen]
+            if not records:
+                continue
+            write_jsonl_gz_by_day(
+                records=records,
+                vendor="oura",
+                api="v2",
+                endpoint=endpoint,
+                day_of=lambda r: _record_day(endpoint, r),
+                schema="v1",
+                user_id=user_id,
+            )
+            inserted += write_samples(user_id, endpoint, _SAMPLE_PARSERS[endpoint](records))
+            pulled_days |= {_record_day(endpoint, r) for r in records}
+            report_progress(**{f"{endpoint}_samples": inserted})
+        if pulled_days:
+            logger.info(f"Stored {inserted} new {endpoint} samples for user {user_id}")
+            refresh_status(user_id, endpoint)
+
+        # today is still filling in; leave it unseen so the next run picks up the rest.
+        # Settled days with no samples are done too, or every run would fetch them again.
+        settled = {d for d in unseen if d < today - timedelta(days=OURA_SERIES_SETTLE_DAYS)}
+        mark_seen(user_id, endpoint, (pulled_days - {today}) | settled)
@@ -1,40 +1,213 @@
+import os
+import sys
 import logging
-from enum import Enum
+from collections import OrderedDict
 from datetime import datetime
-from db import iter_metrics
-
-class MetricCategory(Enum):
-    WELLNESS = "wellness"
-    PRODUCTIVITY = "productivity"
-
-    @staticmethod
-    def from_endpoint(endpoint: str):
-        if endpoint in ["daily_sleep", "daily_readiness"]:
-            return MetricCategory.WELLNESS
-        elif endpoint == "atracker":
-            return MetricCategory.PRODUCTIVITY
+from typing import Awaitable, Callable, Hashable, Optional
+from db import (
+    iter_metrics,
+    aiter_metrics,
+    aiter_rolling_stats,
+    series_cache,
+    load_user_series,
+    aload_user_series,
+    aget_series_points,
+    SAMPLE_RESOLUTIONS,
+)
+from models import MetricCategory
+from data_version import versions
+from singleflight import SingleFlight
+
+# Ranges up to this long read raw samples; longer ones use the coarsest-needed rollup
+SERIES_RAW_MAX_SECONDS = int(os.getenv("SERIES_RAW_MAX_SECONDS", "86400"))
+SERIES_MAX_POINTS = int(os.getenv("SERIES_MAX_POINTS", "2000"))
+# In-process pivot cache budget; the web container has 120 MB in total
+PIVOT_CACHE_MAX_BYTES = int(os.getenv("PIVOT_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+
+def _approx_size(obj) -> int:
+    """Rough deep size of a pivot (dicts, lists, strings, numbers)."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_approx_size(k) + _approx_size(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(_approx_size(v) for v in obj)
+    return size
+
+
+class PivotCache:
+    """LRU of pivot results keyed by (user_id, ..., data_version), bounded by estimated bytes.
+
+    Concurrent misses for one key share a single computation. A user's
+    entries are dropped when their data version moves (entries under an old
+    version could never be hit again anyway), and a fill that was already
+    running then is not stored. Results are shared between requests and
+    must not be mutated.
+    """
+
+    def __init__(self, max_bytes: int = PIVOT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[tuple, tuple[int, list]]" = OrderedDict()
+        self._flight = SingleFlight()
+        # bumped by drop_user; a fill only stores its result if neither moved meanwhile
+        self._generation = 0
+        self._user_generations: dict[str, int] = {}
+
+    def get(self, key: tuple) -> Optional[list]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: tuple, value: list) -> None:
+        size = _approx_size(value)
+        if size > self.max_bytes:
+            return
+        self._pop(key)
+        self._entries[key] = (size, value)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+
+    def _pop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[0]
+
+    def drop_user(self, user_id: Optional[str]) -> None:
+        """Version-change callback: forget user_id's entries (None = everyone's)."""
+        if user_id is None:
+            self._generation += 1
         else:
-            raise ValueError(f"Unknown endpoint: {endpoint}")
+            self._user_generations[user_id] = self._user_generations.get(user_id, 0) + 1
+        for key in [k for k in self._entries if user_id is None or k[0] == user_id]:
+            self._pop(key)
+
+    def _generation_of(self, user_id: str) -> tuple[int, int]:
+        return self._generation, self._user_generations.get(user_id, 0)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+    async def get_or_compute(self, key: tuple, compute: Callable[[], Awaitable[list]]) -> list:
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        async def fill():
+            generation = self._generation_of(key[0])
+            result = await compute()
+            if self._generation_of(key[0]) == generation:
+                self.put(key, result)
+            return result
+
+        return await self._flight.do(key, fill)
+
+
+pivot_cache = PivotCache()
+versions.on_change(pivot_cache.drop_user)
+
+
+def _pivot_row(pivoted: dict, series, day, value) -> None:
+    day_str = day.isoformat()
+    if not day_str in pivoted:
+        pivoted[day_str] = {
+            category.value: {} for category in MetricCategory
+        }
+        pivoted[day_str]["date"] = day_str
+    pivoted[day_str].setdefault(series.category, {})[series.name] = value
+
+def _finish_pivot(pivoted: dict, count: int, logger) -> list[dict]:
+    pivoted_list = list(pivoted.values())
+    logger.info(f"Fetched {count} metric rows and pivoted into {len(pivoted_list)} days.")
+    pivoted_list.sort(key=lambda x: datetime.strptime(x["date"], "%Y-%m-%d"))
+    return pivoted_list
 
 def get_metrics_pivot(user_id: str, start_date, end_date) -> list[dict]:
     logger = logging.getLogger("metrics_view")
     logger.info(f"Fetching metrics for user {user_id} from {start_date} to {end_date}")
     count = 0
     pivoted = {}
-    for metric in iter_metrics(user_id, start_date, end_date):
+    for series_id, day, value in iter_metrics(user_id, start_date, end_date):
         count += 1
-        day_str = metric.date.isoformat()
-        if not day_str in pivoted:
-            pivoted[day_str] = {
-                category.value: {} for category in MetricCategory
-            }
+        series = series_cache.get(series_id)
+        if series is None:
+            # Series created since this process last looked
+            load_user_series(user_id)
+            series = series_cache.get(series_id)
+        _pivot_row(pivoted, series, day, value)
+    return _finish_pivot(pivoted, count, logger)
+
+async def aget_metrics_pivot(user_id: str, start_date, end_date) -> list[dict]:
+    """Non-blocking get_metrics_pivot for async endpoints (asyncpg, streamed)."""
+    logger = logging.getLogger("metrics_view")
+    logger.info(f"Fetching metrics (async) for user {user_id} from {start_date} to {end_date}")
+    count = 0
+    pivoted = {}
+    async for series_id, day, value in aiter_metrics(user_id, start_date, end_date):
+        count += 1
+        series = series_cache.get(series_id)
+        if series is None:
+            await aload_user_series(user_id)
+            series = series_cache.get(series_id)
+        _pivot_row(pivoted, series, day, value)
+    return _finish_pivot(pivoted, count, logger)
+
+async def aget_metrics_pivot_cached(user_id: str, start_date, end_date, data_version: int) -> list[dict]:
+    """aget_metrics_pivot through pivot_cache; data_version is the one read before the query."""
+    return await pivot_cache.get_or_compute(
+        (user_id, start_date, end_date, data_version),
+        lambda: aget_metrics_pivot(user_id, start_date, end_date),
+    )
+
+async def aget_rolling_pivot(user_id: str, start_date, end_date) -> list[dict]:
+    """Stored rolling stats shaped like the metrics pivot: day -> category -> name -> window."""
+    logger = logging.getLogger("metrics_view")
+    count = 0
+    pivoted = {}
+    async for series_id, window, day, mean, std, zscore in aiter_rolling_stats(user_id, start_date, end_date):
+        count += 1
+        series = series_cache.get(series_id)
+        if series is None:
+            await aload_user_series(user_id)
+            series = series_cache.get(series_id)
+        day_str = day.isoformat()
+        if day_str not in pivoted:
+            pivoted[day_str] = {category.value: {} for category in MetricCategory}
             pivoted[day_str]["date"] = day_str
-        category = MetricCategory.from_endpoint(
-            metric.endpoint
-        ).value
-        pivoted[day_str][category][metric.name] = metric.value
-    pivoted_list = list(pivoted.values())
-    logger.info(f"Fetched {count} metric rows and pivoted into {len(pivoted_list)} days.")
-    pivoted_list.sort(key=lambda x: datetime.strptime(x["date"], "%Y-%m-%d"))
+        by_name = pivoted[day_str].setdefault(series.category, {})
+        by_name.setdefault(series.name, {})[f"{window}d"] = {"mean": mean, "std": std, "zscore": zscore}
+    return _finish_pivot(pivoted, count, logger)
 
-    return pivoted_list
+def choose_resolution(start: datetime, end: datetime) -> int:
+    """Pick the finest resolution (0 = raw) that keeps a series under SERIES_MAX_POINTS."""
+    span = (end - start).total_seconds()
+    if span <= SERIES_RAW_MAX_SECONDS:
+        return 0
+    for resolution in SAMPLE_RESOLUTIONS:
+        if span / resolution <= SERIES_MAX_POINTS:
+            return resolution
+    return SAMPLE_RESOLUTIONS[-1]
+
+async def aget_series_view(user_id: str, endpoint: str, name: str, start: datetime, end: datetime) -> dict:
+    """Points for one dense series over [start, end), at a resolution chosen from the span."""
+    logger = logging.getLogger("metrics_view")
+    series_id = series_cache.get_id(user_id, endpoint, name)
+    if series_id is None:
+        await aload_user_series(user_id)
+        series_id = series_cache.get_id(user_id, endpoint, name)
+    resolution = choose_resolution(start, end)
+    rows = [] if series_id is None else await aget_series_points(series_id, start, end, resolution)
+    logger.info(f"Fetched {len(rows)} {endpoint}/{name} points at resolution {resolution}s for user {user_id}")
+    return {
+        "endpoint": endpoint,
+        "name": name,
+        "resolution": resolution,
+        "points": [
+            {"ts": ts.isoformat(), "avg": avg, "min": lo, "max": hi}
+            for ts, avg, lo, hi in rows
+        ],
+    }
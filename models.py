@@ -1,13 +1,31 @@
+from enum import Enum
 from datetime import datetime, timezone
 
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import String, Integer, Float, Date, DateTime, Boolean, PrimaryKeyConstraint, UniqueConstraint, func
+from sqlalchemy import String, Integer, Float, REAL, Date, DateTime, Boolean, ForeignKey, Index, PrimaryKeyConstraint, UniqueConstraint, func
 
 
 class Base(DeclarativeBase):
     pass
 
 
+class User(Base):
+    """Registry of dashboard users; credentials themselves live in Redis under auth_key()."""
+    __tablename__ = "users"
+
+    user_id: Mapped[str] = mapped_column(String, primary_key=True)
+    display_name: Mapped[str] = mapped_column(String, nullable=True)
+    active: Mapped[bool] = mapped_column(Boolean, nullable=False, default=True, server_default="true")
+    created_at: Mapped[object] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
+
+    def __repr__(self) -> str:
+        return f"<User(user_id='{self.user_id}', active={self.active})>"
+
+
 class SeenEvent(Base):
     __tablename__ = "seen_events"
 
@@ -25,30 +43,123 @@ class SeenEvent(Base):
     )
 
 
-class Metric(Base):
-    __tablename__ = "metric"
+class MetricCategory(Enum):
+    WELLNESS = "wellness"
+    PRODUCTIVITY = "productivity"
+
+    @staticmethod
+    def from_endpoint(endpoint: str):
+        if endpoint in ["daily_sleep", "daily_readiness", "heartrate", "sleep"]:
+            return MetricCategory.WELLNESS
+        elif endpoint == "atracker":
+            return MetricCategory.PRODUCTIVITY
+        else:
+            raise ValueError(f"Unknown endpoint: {endpoint}")
+
+
+class MetricSeries(Base):
+    """Dimension table: one row per (user, endpoint, name). Metric rows reference it by id."""
+    __tablename__ = "metric_series"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    name: Mapped[str] = mapped_column(String, nullable=False)
     user_id: Mapped[str] = mapped_column(String, nullable=False)
-    date: Mapped[object] = mapped_column(Date, nullable=False)
     endpoint: Mapped[str] = mapped_column(String, nullable=False)
-    value: Mapped[float] = mapped_column(Float, nullable=False)
+    name: Mapped[str] = mapped_column(String, nullable=False)
+    category: Mapped[str] = mapped_column(String, nullable=False)
 
     __table_args__ = (
-        # prevents duplicates on re-runs; lets us UPSERT cleanly
-        UniqueConstraint("user_id", "date", "endpoint", "name", name="ux_metric_dedupe"),
+        # also serves "all series for a user" lookups
+        UniqueConstraint("user_id", "endpoint", "name", name="ux_metric_series"),
     )
 
     def __repr__(self):
-        return (f"<Metric(id={self.id}, "
+        return (f"<MetricSeries(id={self.id}, "
                 f"user_id='{self.user_id}', "
-                f"date={self.date}, "
                 f"endpoint='{self.endpoint}', "
                 f"name='{self.name}', "
+                f"category='{self.category}')>")
+
+
+class Metric(Base):
+    __tablename__ = "metric"
+
+    series_id: Mapped[int] = mapped_column(Integer, ForeignKey("metric_series.id"), nullable=False)
+    # part of the primary key because the table is range-partitioned on it
+    date: Mapped[object] = mapped_column(Date, nullable=False)
+    value: Mapped[float] = mapped_column(Float, nullable=False)
+
+    __table_args__ = (
+        # one value per series and day (lets us UPSERT cleanly); INCLUDE makes
+        # per-series range reads index-only scans
+        PrimaryKeyConstraint("series_id", "date", name="metric_pkey", postgresql_include=["value"]),
+        # yearly partitions (metric_yYYYY) plus metric_default; see db.ensure_metric_partitions
+        {"postgresql_partition_by": "RANGE (date)"},
+    )
+
+    def __repr__(self):
+        return (f"<Metric(series_id={self.series_id}, "
+                f"date={self.date}, "
                 f"value={self.value})>")
 
 
+class MetricRollingStat(Base):
+    """Trailing-window statistics per daily metric, maintained by rolling_stats on every write."""
+    __tablename__ = "metric_rolling"
+
+    series_id: Mapped[int] = mapped_column(Integer, ForeignKey("metric_series.id"), nullable=False)
+    window_days: Mapped[int] = mapped_column(Integer, nullable=False)
+    date: Mapped[object] = mapped_column(Date, nullable=False)
+    n: Mapped[int] = mapped_column(Integer, nullable=False)
+    mean: Mapped[float] = mapped_column(Float, nullable=False)
+    # null until the window holds two values (std) or has any spread (zscore)
+    std: Mapped[float] = mapped_column(Float, nullable=True)
+    zscore: Mapped[float] = mapped_column(Float, nullable=True)
+
+    __table_args__ = (
+        PrimaryKeyConstraint(
+            "series_id", "window_days", "date",
+            name="metric_rolling_pkey",
+            postgresql_include=["n", "mean", "std", "zscore"],
+        ),
+    )
+
+
+class MetricSample(Base):
+    """Dense time series points (e.g. heart rate), one row per series and timestamp."""
+    __tablename__ = "metric_sample"
+
+    series_id: Mapped[int] = mapped_column(Integer, ForeignKey("metric_series.id"), nullable=False)
+    ts: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    value: Mapped[float] = mapped_column(REAL, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("series_id", "ts", name="metric_sample_pkey", postgresql_include=["value"]),
+        # yearly partitions (metric_sample_yYYYY), created by the writer; no default partition
+        {"postgresql_partition_by": "RANGE (ts)"},
+    )
+
+
+class MetricRollup(Base):
+    """Per-bucket aggregates of metric_sample at fixed resolutions (seconds: 300, 3600, 86400)."""
+    __tablename__ = "metric_rollup"
+
+    series_id: Mapped[int] = mapped_column(Integer, ForeignKey("metric_series.id"), nullable=False)
+    resolution: Mapped[int] = mapped_column(Integer, nullable=False)
+    bucket_start: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    count: Mapped[int] = mapped_column(Integer, nullable=False)
+    sum: Mapped[float] = mapped_column(Float, nullable=False)
+    min: Mapped[float] = mapped_column(REAL, nullable=False)
+    max: Mapped[float] = mapped_column(REAL, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint(
+            "series_id", "resolution", "bucket_start",
+            name="metric_rollup_pkey",
+            postgresql_include=["count", "sum", "min", "max"],
+        ),
+    )
+
+
 def ms_to_datetime(ms) -> datetime:
     """Convert millisecond timestamp (int/float/Decimal) to UTC datetime.
 
@@ -67,8 +178,9 @@ class TaskEntry(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
 
+    user_id: Mapped[str] = mapped_column(String, nullable=False)
     task_id: Mapped[str] = mapped_column(String, index=True, nullable=False)
-    global_identifier: Mapped[str] = mapped_column(String, nullable=False, unique=True)
+    global_identifier: Mapped[str] = mapped_column(String, nullable=False)
 
     finished: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
     deleted_new: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
@@ -80,12 +192,15 @@ class TaskEntry(Base):
     last_update_timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
 
     __table_args__ = (
-        UniqueConstraint("global_identifier", name="ux_task_entry_global_identifier"),
+        # Atracker identifiers are only unique within one user's export
+        UniqueConstraint("user_id", "global_identifier", name="ux_task_entry_user_global_identifier"),
+        # per-user date-range reads (aggregation) stay index scans as tenants grow
+        Index("ix_task_entry_user_start", "user_id", "start_time"),
     )
 
     def __repr__(self) -> str:
         return (
-            f"<TaskEntry(id={self.id}, task_id='{self.task_id}', "
+            f"<TaskEntry(id={self.id}, user_id='{self.user_id}', task_id='{self.task_id}', "
             f"global_identifier='{self.global_identifier}', "
             f"finished={self.finished}, deleted_new={self.deleted_new}, "
             f"start_time={self.start_time}, end_time={self.end_time})>"
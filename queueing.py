@@ -4,6 +4,22 @@ from rq import Queue
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 
-def get_queue(name: str = "etl") -> Queue:
-    conn = Redis.from_url(REDIS_URL)
-    return Queue(name, connection=conn)
\ No newline at end of file
+# Priority tiers. Interactive work (today's data the dashboard is waiting on)
+# goes to QUEUE_HIGH; backfills and per-file fan-out go to QUEUE_BULK.
+# QUEUE_LEGACY is still drained by the bulk pool for jobs enqueued before the split.
+# The compose worker pools listen on the same ETL_QUEUE_* names.
+QUEUE_HIGH = os.getenv("ETL_QUEUE_HIGH", "etl-high")
+QUEUE_BULK = os.getenv("ETL_QUEUE_BULK", "etl-bulk")
+QUEUE_LEGACY = "etl"
+
+_conn = None
+
+def get_redis() -> Redis:
+    """Shared sync Redis connection (redis-py resets its pool after fork)."""
+    global _conn
+    if _conn is None:
+        _conn = Redis.from_url(REDIS_URL)
+    return _conn
+
+def get_queue(name: str = QUEUE_LEGACY) -> Queue:
+    return Queue(name, connection=get_redis())
@@ -0,0 +1,185 @@
+"""Token-bucket limits on outbound provider calls, shared by every worker through Redis.
+
+Each call takes one token from the provider's global bucket and from the
+user's bucket for that provider, atomically, in one script round trip:
+
+    acquire("oura", user_id)           # sync (workers)
+    await aacquire("oura", user_id)    # async (web, token refresh)
+
+When a bucket is empty the caller sleeps until it refills, so parallel
+workers together run at the configured rate instead of tripping 429s.
+penalize() empties a user's bucket when a provider asks us to back off.
+Calls, throttled calls and total wait per provider accumulate in
+ratelimit:stats:<provider> (see rate_limit_stats / GET /ratelimit).
+If Redis is unreachable, calls go through unthrottled.
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, NamedTuple, Optional
+
+# Longest a single call waits for a token before giving up
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "120"))
+
+
+class Limit(NamedTuple):
+    rate: float   # tokens per second
+    burst: float  # bucket size
+
+
+def _limit(name: str, rate: float, burst: float) -> Limit:
+    return Limit(
+        float(os.getenv(f"{name}_RATE_PER_SECOND", str(rate))),
+        float(os.getenv(f"{name}_BURST", str(burst))),
+    )
+
+
+# provider -> (global limit, per-user limit)
+LIMITS: Dict[str, tuple[Limit, Limit]] = {
+    # Oura allows 5000 requests per 5 minutes
+    "oura": (_limit("OURA", 15, 30), _limit("OURA_USER", 5, 10)),
+    "dropbox": (_limit("DROPBOX", 20, 40), _limit("DROPBOX_USER", 10, 20)),
+}
+
+# KEYS: bucket keys..., stats key. ARGV: cost, waited_ms, then rate, burst per bucket.
+# Returns 0 once every bucket had a token (all debited, stats recorded), else ms to wait.
+_ACQUIRE_SCRIPT = """
+local t = redis.call('time')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local cost = tonumber(ARGV[1])
+local n = #KEYS - 1
+local levels = {}
+local wait = 0
+for i = 1, n do
+    local rate, burst = tonumber(ARGV[1 + 2 * i]), tonumber(ARGV[2 + 2 * i])
+    local b = redis.call('hmget', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(b[1]) or burst
+    local ts = tonumber(b[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+    levels[i] = tokens
+    if tokens < cost then
+        wait = math.max(wait, math.ceil((cost - tokens) * 1000 / rate))
+    end
+end
+if wait > 0 then
+    return wait
+end
+for i = 1, n do
+    local rate, burst = tonumber(ARGV[1 + 2 * i]), tonumber(ARGV[2 + 2 * i])
+    redis.call('hset', KEYS[i], 'tokens', levels[i] - cost, 'ts', now)
+    redis.call('pexpire', KEYS[i], math.ceil(burst * 1000 / rate) + 60000)
+end
+local waited = tonumber(ARGV[2])
+redis.call('hincrby', KEYS[n + 1], 'calls', 1)
+if waited > 0 then
+    redis.call('hincrby', KEYS[n + 1], 'throttled', 1)
+    redis.call('hincrby', KEYS[n + 1], 'wait_ms', waited)
+end
+return 0
+"""
+
+# KEYS[1]: bucket. ARGV: rate, seconds. Leaves the bucket `seconds` of refill in debt.
+_PENALIZE_SCRIPT = """
+local t = redis.call('time')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local rate = tonumber(ARGV[1])
+redis.call('hset', KEYS[1], 'tokens', -rate * tonumber(ARGV[2]), 'ts', now)
+redis.call('pexpire', KEYS[1], math.ceil(tonumber(ARGV[2]) * 1000) + 60000)
+return 1
+"""
+
+
+class RateLimited(Exception):
+    """No token became available within RATE_LIMIT_MAX_WAIT_SECONDS."""
+
+
+def bucket_key(provider: str, user_id: Optional[str] = None) -> str:
+    return f"ratelimit:{provider}:user:{user_id}" if user_id else f"ratelimit:{provider}"
+
+
+def stats_key(provider: str) -> str:
+    return f"ratelimit:stats:{provider}"
+
+
+def _script_args(provider: str, user_id: Optional[str], cost: float, waited_ms: int):
+    global_limit, user_limit = LIMITS[provider]
+    buckets = [(bucket_key(provider), global_limit)]
+    if user_id:
+        buckets.append((bucket_key(provider, user_id), user_limit))
+    keys = [k for k, _ in buckets] + [stats_key(provider)]
+    args = [cost, waited_ms] + [v for _, limit in buckets for v in (limit.rate, limit.burst)]
+    return len(keys), keys, args
+
+
+def acquire(provider: str, user_id: Optional[str] = None, cost: float = 1, redis_client=None) -> float:
+    """Block until the call fits both budgets; returns seconds waited."""
+    if redis_client is None:
+        from queueing import get_redis  # lazy import
+        redis_client = get_redis()
+    waited_ms = 0
+    while True:
+        n, keys, args = _script_args(provider, user_id, cost, waited_ms)
+        try:
+            wait_ms = int(redis_client.eval(_ACQUIRE_SCRIPT, n, *keys, *args))
+        except Exception as e:
+            logging.getLogger("ratelimit").warning(f"Rate limiter unavailable, not throttling {provider}: {e}")
+            return waited_ms / 1000
+        if wait_ms <= 0:
+            return waited_ms / 1000
+        if waited_ms + wait_ms > RATE_LIMIT_MAX_WAIT_SECONDS * 1000:
+            raise RateLimited(f"{provider} (user {user_id}) over budget for {waited_ms / 1000:.1f}s")
+        time.sleep(wait_ms / 1000)
+        waited_ms += wait_ms
+
+
+async def aacquire(provider: str, user_id: Optional[str] = None, cost: float = 1, redis_client=None) -> float:
+    """acquire() for async code: waits on the event loop instead of blocking it."""
+    if redis_client is None:
+        from auth.cache import get_async_redis  # lazy import
+        redis_client = get_async_redis()
+    waited_ms = 0
+    while True:
+        n, keys, args = _script_args(provider, user_id, cost, waited_ms)
+        try:
+            wait_ms = int(await redis_client.eval(_ACQUIRE_SCRIPT, n, *keys, *args))
+        except Exception as e:
+            logging.getLogger("ratelimit").warning(f"Rate limiter unavailable, not throttling {provider}: {e}")
+            return waited_ms / 1000
+        if wait_ms <= 0:
+            return waited_ms / 1000
+        if waited_ms + wait_ms > RATE_LIMIT_MAX_WAIT_SECONDS * 1000:
+            raise RateLimited(f"{provider} (user {user_id}) over budget for {waited_ms / 1000:.1f}s")
+        await asyncio.sleep(wait_ms / 1000)
+        waited_ms += wait_ms
+
+
+def penalize(provider: str, user_id: Optional[str], seconds: float, redis_client=None) -> None:
+    """The provider said back off (429 Retry-After): hold every worker's calls for this user.
+
+    Without a user the whole provider is held, in debt at the global rate.
+    """
+    if redis_client is None:
+        from queueing import get_redis  # lazy import
+        redis_client = get_redis()
+    global_limit, user_limit = LIMITS[provider]
+    limit = user_limit if user_id else global_limit
+    try:
+        redis_client.eval(_PENALIZE_SCRIPT, 1, bucket_key(provider, user_id), limit.rate, seconds)
+    except Exception as e:
+        logging.getLogger("ratelimit").warning(f"Could not record {provider} back-off: {e}")
+
+
+def _decode_stats(raw: Dict) -> Dict[str, int]:
+    stats = {"calls": 0, "throttled": 0, "wait_ms": 0}
+    for field, value in (raw or {}).items():
+        stats[field.decode() if isinstance(field, bytes) else field] = int(value)
+    return stats
+
+
+async def arate_limit_stats(redis_client=None) -> Dict[str, Dict[str, int]]:
+    """Cumulative calls, throttled calls and wait per provider, across all workers."""
+    if redis_client is None:
+        from auth.cache import get_async_redis  # lazy import
+        redis_client = get_async_redis()
+    return {p: _decode_stats(await redis_client.hgetall(stats_key(p))) for p in LIMITS}
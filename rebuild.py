@@ -0,0 +1,217 @@
+"""Rebuild a user's metrics for a date range from the raw zone and task_entry.
+
+    python -m rebuild --user alice --start 2022-01-01 --end 2025-12-31
+    python -m rebuild --user alice --start 2025-01-01 --end 2025-03-31 --shard-by day --rq
+
+The range is split into month (or day) shards per source. Shards run in a
+process pool sized to the machine, or fan out to the bulk queue with --rq.
+Every finished shard is checkpointed in Redis, so rerunning the same command
+resumes an interrupted rebuild (--restart starts over). Rows are upserted,
+so rebuilding a shard twice is harmless. Oura shards read the day= raw
+layout only; one that finds nothing there while the user still has older
+dt= data fails instead of checkpointing an empty month.
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+from datetime import date, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional, Sequence
+
+from queueing import get_redis
+
+REBUILD_SOURCES = ("daily_sleep", "daily_readiness", "atracker")
+# Process pool size (0 = one per core)
+REBUILD_WORKERS = int(os.getenv("REBUILD_WORKERS", "0"))
+REBUILD_CHECKPOINT_TTL_SECONDS = int(os.getenv("REBUILD_CHECKPOINT_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+
+Shard = tuple[str, date, date]
+
+
+def shard_range(start: date, end: date, by: str = "month") -> list[tuple[date, date]]:
+    """Split [start, end] into consecutive day or calendar-month spans."""
+    spans = []
+    cur = start
+    while cur <= end:
+        if by == "day":
+            stop = cur
+        else:
+            next_month = (cur.replace(day=1) + timedelta(days=32)).replace(day=1)
+            stop = min(next_month - timedelta(days=1), end)
+        spans.append((cur, stop))
+        cur = stop + timedelta(days=1)
+    return spans
+
+
+def plan(sources: Sequence[str], start: date, end: date, by: str = "month") -> list[Shard]:
+    # newest first: the dashboard's recent numbers come back soonest
+    return [(src, a, b) for a, b in reversed(shard_range(start, end, by)) for src in sources]
+
+
+def shard_id(shard: Shard) -> str:
+    source, start, end = shard
+    return f"{source}:{start.isoformat()}/{end.isoformat()}"
+
+
+def checkpoint_key(user_id: str, start: date, end: date, by: str, sources: Sequence[str]) -> str:
+    return f"rebuild:{user_id}:{start.isoformat()}/{end.isoformat()}:{by}:{','.join(sorted(sources))}"
+
+
+def _require_day_partitions(endpoint: str, start: date, end: date, user_id: str) -> None:
+    """Oura shards read only the day= layout; an empty shard must not be checkpointed
+    as done while the user still has raw history in the older dt= layout."""
+    from s3io import has_ingestion_parts, list_day_keys  # lazy import
+    if list_day_keys("oura", "v2", endpoint, start, end, user_id=user_id):
+        return
+    if has_ingestion_parts("oura", "v2", endpoint, user_id=user_id):
+        raise RuntimeError(
+            f"No day= raw data for {endpoint} {start}..{end}, but user {user_id} has raw data in the "
+            f"older dt= layout; re-pull the range from Oura so it is stored by record day, then rerun"
+        )
+
+
+def rebuild_shard(source: str, start: date, end: date, user_id: str, checkpoint: Optional[str] = None) -> int:
+    """Rebuild one source's metrics for [start, end]; returns rows written."""
+    if source in ("daily_sleep", "daily_readiness"):
+        _require_day_partitions(source, start, end, user_id)
+    if source == "atracker":
+        from db import aggregate_task_entries_to_metrics  # lazy import
+        days = {start + timedelta(days=i) for i in range((end - start).days + 1)}
+        created, updated = aggregate_task_entries_to_metrics(days, user_id)
+        n = created + updated
+    elif source == "daily_sleep":
+        from etl_metrics import etl_daily_sleep_day  # lazy import
+        n = etl_daily_sleep_day(f"{start}/{end}", user_id, overwrite=True)
+    elif source == "daily_readiness":
+        from etl_metrics import etl_daily_readiness_day  # lazy import
+        n = etl_daily_readiness_day(f"{start}/{end}", user_id, overwrite=True)
+    else:
+        raise ValueError(f"Unsupported rebuild source: {source}")
+    if checkpoint:
+        pipe = get_redis().pipeline()
+        pipe.sadd(checkpoint, shard_id((source, start, end)))
+        pipe.expire(checkpoint, REBUILD_CHECKPOINT_TTL_SECONDS)
+        pipe.execute()
+    from jobs import report_progress  # lazy import
+    report_progress(rows=n)
+    return n
+
+
+def _refresh_rolling(user_id: str, sources: Sequence[str], start: date, end: date) -> None:
+    # Shards refresh their own windows, but one finishing alongside its
+    # neighbour can miss the neighbour's rows; a final pass settles the edges.
+    from sqlalchemy import select  # lazy import
+    from db import SessionLocal
+    from models import MetricSeries
+    from rolling_stats import refresh_rolling_stats
+    with SessionLocal() as s:
+        ids = s.execute(
+            select(MetricSeries.id).where(MetricSeries.user_id == user_id, MetricSeries.endpoint.in_(sources))
+        ).scalars().all()
+    refresh_rolling_stats(ids, [start + timedelta(days=i) for i in range((end - start).days + 1)])
+
+
+def rebuild(
+    user_id: str,
+    start: date,
+    end: date,
+    sources: Sequence[str] = REBUILD_SOURCES,
+    by: str = "month",
+    workers: int = REBUILD_WORKERS,
+    use_rq: bool = False,
+    restart: bool = False,
+) -> dict:
+    """Run (or enqueue) every shard not yet checkpointed. Returns run stats."""
+    logger = logging.getLogger("rebuild")
+    unknown = set(sources) - set(REBUILD_SOURCES)
+    if unknown:
+        raise ValueError(f"Unsupported rebuild sources: {sorted(unknown)}")
+    checkpoint = checkpoint_key(user_id, start, end, by, sources)
+    r = get_redis()
+    if restart:
+        r.delete(checkpoint)
+    done = {m.decode() if isinstance(m, bytes) else m for m in r.smembers(checkpoint)}
+    shards = plan(sources, start, end, by)
+    todo = [s for s in shards if shard_id(s) not in done]
+    stats = {"shards": len(shards), "skipped": len(shards) - len(todo), "failed": 0, "rows": 0, "seconds": 0.0}
+    logger.info(f"Rebuilding {user_id} {start}..{end}: {len(todo)} of {len(shards)} shards to run")
+
+    if use_rq:
+        from queueing import get_queue, QUEUE_BULK  # lazy import
+        from jobs import track_job
+        q = get_queue(QUEUE_BULK)
+        shard_jobs = []
+        for source, a, b in todo:
+            job = q.enqueue(
+                rebuild_shard, source, a, b, user_id, checkpoint,
+                job_timeout=3600, meta={"endpoint": f"rebuild_{source}"},
+            )
+            track_job(user_id, job)
+            shard_jobs.append(job)
+        if shard_jobs:
+            # runs once every shard has succeeded, like the pool path's final pass
+            final = q.enqueue(
+                _refresh_rolling, user_id, tuple(sources), start, end,
+                depends_on=shard_jobs, job_timeout=3600, meta={"endpoint": "rebuild_rolling"},
+            )
+            track_job(user_id, final)
+        logger.info(f"Enqueued {len(todo)} rebuild shards on {QUEUE_BULK}; rerun to pick up failures")
+        stats["enqueued"] = len(todo)
+        return stats
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = {pool.submit(rebuild_shard, *s, user_id, checkpoint): s for s in todo}
+        for finished, future in enumerate(as_completed(futures), 1):
+            shard = futures[future]
+            try:
+                stats["rows"] += future.result()
+            except Exception as e:
+                stats["failed"] += 1
+                logger.error(f"Shard {shard_id(shard)} failed: {e}")
+            elapsed = time.perf_counter() - started
+            rate = finished / elapsed
+            logger.info(
+                f"{finished}/{len(todo)} shards, {stats['rows']} rows "
+                f"({stats['rows'] / elapsed:.0f} rows/s, {rate:.2f} shards/s, "
+                f"eta {(len(todo) - finished) / rate:.0f}s)"
+            )
+    if todo and not stats["failed"]:
+        _refresh_rolling(user_id, sources, start, end)
+    stats["seconds"] = round(time.perf_counter() - started, 2)
+    logger.info(f"Rebuild finished: {stats}")
+    return stats
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s %(message)s",
+        stream=sys.stdout,
+    )
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--start", required=True, type=date.fromisoformat)
+    parser.add_argument("--end", required=True, type=date.fromisoformat)
+    parser.add_argument("--sources", default=",".join(REBUILD_SOURCES), help="comma-separated")
+    parser.add_argument("--shard-by", choices=("month", "day"), default="month")
+    parser.add_argument("--workers", type=int, default=REBUILD_WORKERS, help="process pool size (0 = cores)")
+    parser.add_argument("--rq", action="store_true", help="fan shards out to the bulk queue instead")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of a previous run")
+    args = parser.parse_args(argv)
+
+    stats = rebuild(
+        args.user, args.start, args.end,
+        sources=[s for s in args.sources.split(",") if s],
+        by=args.shard_by,
+        workers=args.workers,
+        use_rq=args.rq,
+        restart=args.restart,
+    )
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
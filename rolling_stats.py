@@ -0,0 +1,61 @@
+"""Trailing 7/28-day mean, std and z-score per daily metric, kept in metric_rolling.
+
+Stats for a day depend only on the window ending at that day, so a write to
+day d changes stats for days d .. d + window - 1 and nothing else.
+refresh_rolling_stats recomputes exactly that span for the touched series.
+"""
+import logging
+from datetime import date, timedelta
+from typing import Iterable, Sequence
+
+import polars as pl
+
+ROLLING_WINDOWS = (7, 28)
+
+
+def compute_rolling_stats(df: pl.DataFrame, windows: Sequence[int] = ROLLING_WINDOWS) -> pl.DataFrame:
+    """df has (series_id, date, value); returns one row per (series_id, window_days, date).
+
+    Windows are calendar-based (missing days shrink n rather than stretching the window).
+    """
+    df = df.sort("series_id", "date")
+    frames = []
+    for window in windows:
+        size = f"{window}d"
+        frames.append(
+            df.with_columns(
+                pl.lit(window, dtype=pl.Int32).alias("window_days"),
+                pl.col("value").is_not_null().cast(pl.Int32).rolling_sum_by("date", size).over("series_id").alias("n"),
+                pl.col("value").rolling_mean_by("date", size).over("series_id").alias("mean"),
+                pl.col("value").rolling_std_by("date", size).over("series_id").alias("std"),
+            ).with_columns(
+                pl.when(pl.col("std") > 0)
+                  .then((pl.col("value") - pl.col("mean")) / pl.col("std"))
+                  .otherwise(None)
+                  .alias("zscore"),
+            )
+        )
+    return pl.concat(frames).select("series_id", "window_days", "date", "n", "mean", "std", "zscore")
+
+
+def refresh_rolling_stats(series_ids: Iterable[int], dates: Iterable[date]) -> int:
+    """Recompute stats affected by writes to `dates` for `series_ids`. Returns rows written."""
+    from db import read_metric_values, write_rolling_stats  # lazy import (db calls us)
+    logger = logging.getLogger("rolling_stats")
+    series_ids, dates = sorted(set(series_ids)), set(dates)
+    if not series_ids or not dates:
+        return 0
+    span = max(ROLLING_WINDOWS) - 1
+    first, last = min(dates), max(dates) + timedelta(days=span)
+    rows = read_metric_values(series_ids, first - timedelta(days=span), last)
+    if not rows:
+        return 0
+    df = pl.DataFrame(
+        rows,
+        schema={"series_id": pl.Int64, "date": pl.Date, "value": pl.Float64},
+        orient="row",
+    )
+    stats = compute_rolling_stats(df).filter(pl.col("date").is_between(first, last))
+    written = write_rolling_stats(stats.iter_rows())
+    logger.info(f"Refreshed {written} rolling stats for {len(series_ids)} series, {first}..{last}")
+    return written
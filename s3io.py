@@ -1,8 +1,17 @@
-import os, io, gzip, json, hashlib
-from datetime import datetime, timezone
+import os, gzip, json, uuid, hashlib
+from datetime import date, datetime, timezone
+from itertools import groupby
 
 BUCKET = os.getenv("S3_BUCKET")
 ENV = os.getenv("ENV", "dev")
+# Owner of the raw objects written before the zone was split per user (see the
+# c41d7e2a9b10 migration); their reads also cover the unsegmented prefix
+LEGACY_USER_ID = os.getenv("LEGACY_USER_ID", "brucegarro")
+
+# Roll over to a new part file after this many gzip bytes; stream each part to
+# S3 in multipart chunks of MULTIPART_CHUNK_BYTES (S3's minimum is 5 MiB)
+RAW_PART_MAX_BYTES = int(os.getenv("RAW_PART_MAX_BYTES", str(128 * 1024 * 1024)))
+MULTIPART_CHUNK_BYTES = int(os.getenv("MULTIPART_CHUNK_BYTES", str(8 * 1024 * 1024)))
 
 # Lazy-initialized S3 client to avoid loading boto3 in processes that don't need it
 _s3 = None
@@ -22,77 +31,269 @@ def _get_s3():
     return _s3
 
 
-def write_jsonl_gz(records, vendor, api, endpoint, schema="v1"):
-    now = datetime.now(timezone.utc)
-    dt = now.strftime("%Y-%m-%d")
-    hour = now.strftime("%H")
-    batch_id = now.strftime("%Y%m%dT%H%M%SZ")
+def _reset_s3_after_fork() -> None:
+    # botocore's connection pool isn't fork-safe; children build their own client
+    global _s3
+    _s3 = None
+
+
+os.register_at_fork(after_in_child=_reset_s3_after_fork)
+
+
+def _user_segment(user_id: str | None) -> str:
+    # Per-tenant partition; legacy single-user objects were written without it
+    return f"user={user_id}/" if user_id else ""
+
+
+class _PartUpload:
+    """One raw-zone object, uploaded as it is written.
+
+    Bytes are buffered up to MULTIPART_CHUNK_BYTES; the first time that fills,
+    a multipart upload is started and each full buffer becomes a part. Small
+    objects never leave the single put_object path.
+    """
+
+    def __init__(self, key: str, metadata: dict):
+        self.key = key
+        self.metadata = metadata
+        self.md5 = hashlib.md5()
+        self.size = 0
+        self._buf = bytearray()
+        self._upload_id = None
+        self._parts: list[dict] = []
+
+    # file-like sink for GzipFile
+    def write(self, data) -> int:
+        self.md5.update(data)
+        self.size += len(data)
+        self._buf += data
+        if len(self._buf) >= MULTIPART_CHUNK_BYTES:
+            self._upload_part(bytes(self._buf))
+            self._buf.clear()
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def _upload_part(self, body: bytes) -> None:
+        if self._upload_id is None:
+            self._upload_id = _get_s3().create_multipart_upload(
+                Bucket=BUCKET,
+                Key=self.key,
+                ContentType="application/json",
+                ContentEncoding="gzip",
+                Metadata=self.metadata,
+            )["UploadId"]
+        number = len(self._parts) + 1
+        resp = _get_s3().upload_part(
+            Bucket=BUCKET, Key=self.key, UploadId=self._upload_id, PartNumber=number, Body=body,
+        )
+        self._parts.append({"PartNumber": number, "ETag": resp["ETag"]})
+
+    def complete(self) -> None:
+        if self._upload_id is None:
+            _get_s3().put_object(
+                Bucket=BUCKET,
+                Key=self.key,
+                Body=bytes(self._buf),
+                ContentType="application/json",
+                ContentEncoding="gzip",
+                Metadata=self.metadata,
+            )
+        else:
+            if self._buf:
+                self._upload_part(bytes(self._buf))
+            _get_s3().complete_multipart_upload(
+                Bucket=BUCKET, Key=self.key, UploadId=self._upload_id,
+                MultipartUpload={"Parts": self._parts},
+            )
+        self._buf.clear()
+
+    def abort(self) -> None:
+        if self._upload_id is not None:
+            _get_s3().abort_multipart_upload(Bucket=BUCKET, Key=self.key, UploadId=self._upload_id)
 
-    prefix = (
+
+def _raw_prefix(vendor: str, api: str, endpoint: str, schema: str, user_id: str | None) -> str:
+    return (
         f"thirdparty/{vendor}/{api}/{ENV}/"
-        f"zone=raw/endpoint={endpoint}/schema={schema}/dt={dt}/hour={hour}/"
+        f"zone=raw/endpoint={endpoint}/schema={schema}/{_user_segment(user_id)}"
     )
 
-    buf = io.BytesIO()
-    with gzip.GzipFile(fileobj=buf, mode="wb") as gz:
+
+def _write_parts(records, prefix: str, batch_id: str, ingested_at: str, manifest: dict, first_part: int = 1) -> list[dict]:
+    """Stream records into numbered part files under prefix; returns one entry per part."""
+    metadata = {"zone": "raw", "endpoint": manifest["endpoint"], "schema": manifest["schema_version"]}
+    parts: list[dict] = []
+
+    def finish(upload: _PartUpload, count: int) -> None:
+        upload.complete()
+        meta_key = upload.key[: -len(".jsonl.gz")] + ".meta.json"
+        meta = {
+            **manifest,
+            "record_count": count,
+            "bytes_gz": upload.size,
+            "md5": upload.md5.hexdigest(),
+        }
+        _get_s3().put_object(
+            Bucket=BUCKET,
+            Key=meta_key,
+            Body=json.dumps(meta).encode(),
+            ContentType="application/json",
+        )
+        parts.append({"data_key": upload.key, "meta_key": meta_key, "record_count": count})
+
+    upload, gz, count = None, None, 0
+    try:
         for r in records:
-            r.setdefault("_ingested_at", now.isoformat())
-            gz.write(json.dumps(r, separators=(',', ':')).encode() + b"\n")
-    body = buf.getvalue()
-    etag = hashlib.md5(body).hexdigest()
-
-    data_key = f"{prefix}part={batch_id}-00001.jsonl.gz"
-    meta_key = f"{prefix}part={batch_id}-00001.meta.json"
-
-    _get_s3().put_object(
-        Bucket=BUCKET,
-        Key=data_key,
-        Body=body,
-        ContentType="application/json",
-        ContentEncoding="gzip",
-        Metadata={"zone": "raw", "endpoint": endpoint, "schema": schema},
-    )
-    meta = {
-        "batch_id": batch_id,
+            if upload is None:
+                upload = _PartUpload(f"{prefix}part={batch_id}-{first_part + len(parts):05d}.jsonl.gz", metadata)
+                gz = gzip.GzipFile(fileobj=upload, mode="wb")
+                count = 0
+            line = r if "_ingested_at" in r else {**r, "_ingested_at": ingested_at}
+            gz.write(json.dumps(line, separators=(',', ':')).encode() + b"\n")
+            count += 1
+            if upload.size >= RAW_PART_MAX_BYTES:
+                gz.close()
+                finish(upload, count)
+                upload = None
+        if upload is not None:
+            gz.close()
+            finish(upload, count)
+            upload = None
+    except BaseException:
+        if upload is not None:
+            upload.abort()
+        raise
+    return parts
+
+
+def _ingestion_manifest(now: datetime, endpoint: str, schema: str, user_id: str | None) -> dict:
+    return {
+        # the suffix keeps two pulls in the same second from writing the same part keys
+        "batch_id": f"{now.strftime('%Y%m%dT%H%M%SZ')}-{uuid.uuid4().hex[:8]}",
         "endpoint": endpoint,
         "schema_version": schema,
-        "record_count": len(records),
-        "bytes_gz": len(body),
-        "dt": dt,
-        "hour": hour,
-        "md5": etag,
+        "ingested_at": now.isoformat(),
+        "dt": now.strftime("%Y-%m-%d"),
+        "hour": now.strftime("%H"),
+        "user_id": user_id,
     }
-    _get_s3().put_object(
-        Bucket=BUCKET,
-        Key=meta_key,
-        Body=json.dumps(meta).encode(),
-        ContentType="application/json",
-    )
-    return {"data_key": data_key, "meta_key": meta_key}
 
-def _list_ndjson_gz_keys(vendor: str, api: str, endpoint: str, date_str: str) -> list[str]:
-    """List all .jsonl.gz parts for a given day under your raw layout."""
-    prefix = (
-        f"thirdparty/{vendor}/{api}/{ENV}/"
-        f"zone=raw/endpoint={endpoint}/schema=v1/dt={date_str}/"
-    )
+
+def write_jsonl_gz(records, vendor, api, endpoint, schema="v1", user_id=None):
+    """Stream any iterable of records to the raw zone as gzipped NDJSON.
+
+    Partitioned by ingestion time (dt=/hour=). Compression and hashing are
+    incremental, so memory stays bounded by the multipart chunk size. Output
+    rolls over to a new numbered part file (each with its own .meta.json) once
+    RAW_PART_MAX_BYTES of gzip is written. Records are not modified;
+    `_ingested_at` is added to the serialized copy.
+    """
+    now = datetime.now(timezone.utc)
+    manifest = _ingestion_manifest(now, endpoint, schema, user_id)
+    prefix = _raw_prefix(vendor, api, endpoint, schema, user_id) + f"dt={manifest['dt']}/hour={manifest['hour']}/"
+    parts = _write_parts(records, prefix, manifest["batch_id"], manifest["ingested_at"], manifest)
+
+    first = parts[0] if parts else {"data_key": None, "meta_key": None}
+    return {
+        "data_key": first["data_key"],
+        "meta_key": first["meta_key"],
+        "parts": parts,
+        "record_count": sum(p["record_count"] for p in parts),
+    }
+
+
+def write_jsonl_gz_by_day(records, vendor, api, endpoint, day_of, schema="v1", user_id=None):
+    """Stream records to the raw zone partitioned by their own day (day=YYYY-MM-DD/).
+
+    `day_of(record)` returns the record's calendar day (date or ISO string).
+    Reprocessing a day then reads exactly that partition, whenever the data
+    was pulled; ingestion time lives in each part's .meta.json and in the
+    records' `_ingested_at`. Records are grouped as they arrive, so a stream
+    sorted by day keeps one part open at a time (bounded memory); an
+    unsorted one is still written correctly, just in more parts.
+    Returns {"days": {day: parts}, "record_count"}.
+    """
+    now = datetime.now(timezone.utc)
+    manifest = _ingestion_manifest(now, endpoint, schema, user_id)
+    base = _raw_prefix(vendor, api, endpoint, schema, user_id)
+
+    def day_key(r) -> str:
+        day = day_of(r)
+        return day if isinstance(day, str) else day.isoformat()
+
+    days: dict[str, list[dict]] = {}
+    for day, group in groupby(records, key=day_key):
+        parts = days.setdefault(day, [])
+        parts.extend(_write_parts(
+            group, f"{base}day={day}/", manifest["batch_id"], manifest["ingested_at"],
+            {**manifest, "day": day}, first_part=len(parts) + 1,
+        ))
+    return {
+        "days": days,
+        "record_count": sum(p["record_count"] for parts in days.values() for p in parts),
+    }
+
+
+def _list_part_keys(prefix: str, start_after: str | None = None, stop_after: str | None = None) -> list[str]:
+    """List data parts under prefix, optionally within (start_after, stop_after] key order."""
     keys: list[str] = []
-    token: str | None = None
+    kwargs = {"Bucket": BUCKET, "Prefix": prefix}
+    if start_after:
+        kwargs["StartAfter"] = start_after
     while True:
-        if token is None:
-            resp = _get_s3().list_objects_v2(Bucket=BUCKET, Prefix=prefix)
-        else:
-            resp = _get_s3().list_objects_v2(Bucket=BUCKET, Prefix=prefix, ContinuationToken=token)
+        resp = _get_s3().list_objects_v2(**kwargs)
         for obj in resp.get("Contents", []):
             k = obj["Key"]
+            if stop_after is not None and k > stop_after:
+                return keys
             # keep only the data parts
             if k.endswith(".jsonl.gz") and "/part=" in k:
                 keys.append(k)
-        if resp.get("IsTruncated"):
-            token = resp.get("NextContinuationToken")
-        else:
-            break
-    return keys
+        if not resp.get("IsTruncated"):
+            return keys
+        kwargs["ContinuationToken"] = resp.get("NextContinuationToken")
+
+
+def list_day_keys(vendor: str, api: str, endpoint: str, start_day: date, end_day: date, user_id: str | None = None, schema: str = "v1") -> list[str]:
+    """Data parts in the day=/ partitions for [start_day, end_day].
+
+    Day partitions sort lexicographically, so this is one bounded listing
+    regardless of how many ingestion batches touched those days.
+    """
+    base = _raw_prefix(vendor, api, endpoint, schema, user_id)
+    # "day=2024-05-01/..." sorts after "day=2024-05-01" and before "day=2024-05-01~"
+    return _list_part_keys(
+        f"{base}day=",
+        start_after=f"{base}day={start_day.isoformat()}",
+        stop_after=f"{base}day={end_day.isoformat()}~",
+    )
+
+
+def _ingestion_prefixes(vendor: str, api: str, endpoint: str, schema: str, user_id: str | None) -> list[str]:
+    """Prefixes holding a user's dt=/hour= objects, including the pre-tenant ones for LEGACY_USER_ID."""
+    prefixes = [_raw_prefix(vendor, api, endpoint, schema, user_id)]
+    if user_id and user_id == LEGACY_USER_ID:
+        prefixes.append(_raw_prefix(vendor, api, endpoint, schema, None))
+    return prefixes
+
+
+def has_ingestion_parts(vendor: str, api: str, endpoint: str, user_id: str | None = None, schema: str = "v1") -> bool:
+    """Whether the user has any objects in the dt=/hour= (ingestion time) layout."""
+    return any(
+        _get_s3().list_objects_v2(Bucket=BUCKET, Prefix=prefix + "dt=", MaxKeys=1).get("Contents")
+        for prefix in _ingestion_prefixes(vendor, api, endpoint, schema, user_id)
+    )
+
+
+def _list_ndjson_gz_keys(vendor: str, api: str, endpoint: str, date_str: str, user_id: str | None = None) -> list[str]:
+    """List all .jsonl.gz parts ingested on a given day (and user) in the dt=/hour= layout."""
+    return [
+        key
+        for prefix in _ingestion_prefixes(vendor, api, endpoint, "v1", user_id)
+        for key in _list_part_keys(prefix + f"dt={date_str}/")
+    ]
 
 def _load_ndjson_gz_as_polars(keys: list[str]):
     """Fetch & decompress all keys, parse NDJSON lines, return a Polars DF.
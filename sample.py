@@ -1,16 +1,25 @@
 # Get database objects
 from db import SessionLocal
-from models import Metric, SeenEvent, TaskEntry
+from models import Metric, MetricSeries, SeenEvent, TaskEntry
 session = SessionLocal()
 
 
 # Example queries
 [ r.__dict__ for r in session.query(SeenEvent).all() ]
-[ r.__dict__ for r in session.query(Metric).filter(Metric.endpoint=="daily_sleep").all() ]
+[ r.__dict__ for r in session.query(MetricSeries).all() ]
+[ r.__dict__ for r in session.query(Metric).join(MetricSeries).filter(MetricSeries.endpoint=="daily_sleep").all() ]
 [ r.__dict__ for r in session.query(TaskEntry).all() ]
 
 
 # Delete seen events
 # session.query(SeenEvent).delete(); session.commit()
 # session.query(Metric).delete(); session.commit()
-# session.query(TaskEntry).delete(); session.commit()
\ No newline at end of file
+# session.query(MetricSeries).delete(); session.commit()
+# session.query(TaskEntry).delete(); session.commit()
+
+# Rebuild metrics from the raw zone and task_entry (resumable, one process per core)
+#   python -m rebuild --user brucegarro --start 2022-01-01 --end 2025-12-31
+
+# Full history for notebooks: stream it out instead of building __dict__ lists
+#   python -m export metrics -o metrics.parquet && python -m export task_entries -o tasks.parquet
+#   import polars as pl; pl.read_parquet("metrics.parquet")
@@ -0,0 +1,86 @@
+"""Fan scheduled ingestion out per user across the worker pool.
+
+Run one scheduler per shard, e.g. every hour:
+    python -m scheduler --shard 0 --num-shards 2 --interval 3600
+"""
+import os
+import sys
+import time
+import zlib
+import logging
+import argparse
+from typing import Optional
+
+from datetime import date
+
+from db import list_active_users, ensure_metric_partitions, drop_metric_partitions_before
+from queueing import get_queue, QUEUE_BULK
+from jobs import run_user_ingestion
+
+ETL_USER_SHARDS = int(os.getenv("ETL_USER_SHARDS", "1"))
+# Keep this many calendar years of metrics (0 = keep everything)
+METRIC_RETENTION_YEARS = int(os.getenv("METRIC_RETENTION_YEARS", "0"))
+
+
+def shard_of(user_id: str, num_shards: int) -> int:
+    """Stable shard assignment (crc32, unlike hash(), is the same in every process)."""
+    return zlib.crc32(user_id.encode("utf-8")) % max(num_shards, 1)
+
+
+def users_for_shard(user_ids: list[str], shard: Optional[int], num_shards: int) -> list[str]:
+    if shard is None:
+        return list(user_ids)
+    return [u for u in user_ids if shard_of(u, num_shards) == shard]
+
+
+def schedule_ingestion(shard: Optional[int] = None, num_shards: int = ETL_USER_SHARDS) -> dict[str, str]:
+    """Enqueue one run_user_ingestion job per active user in the shard.
+
+    Returns {user_id: job_id}.
+    """
+    logger = logging.getLogger("scheduler")
+    q = get_queue(QUEUE_BULK)
+    enqueued: dict[str, str] = {}
+    for user_id in users_for_shard(list_active_users(), shard, num_shards):
+        job = q.enqueue(run_user_ingestion, user_id, job_timeout=300)
+        enqueued[user_id] = job.id
+    logger.info(f"Scheduled ingestion for {len(enqueued)} users (shard {shard} of {num_shards}).")
+    return enqueued
+
+
+def maintain_partitions(today: Optional[date] = None) -> None:
+    """Keep next year's metric partition in place and apply retention."""
+    today = today or date.today()
+    ensure_metric_partitions([today.year, today.year + 1])
+    if METRIC_RETENTION_YEARS > 0:
+        drop_metric_partitions_before(today.year - METRIC_RETENTION_YEARS + 1)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s %(message)s",
+        stream=sys.stdout,
+    )
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shard", type=int, default=None, help="only schedule users in this shard")
+    parser.add_argument("--num-shards", type=int, default=ETL_USER_SHARDS)
+    parser.add_argument("--interval", type=int, default=0, help="repeat every N seconds (0 = run once)")
+    args = parser.parse_args(argv)
+    if args.shard is None and args.num_shards > 1:
+        # every replica would schedule every user
+        parser.error("--shard is required when --num-shards > 1")
+    if args.shard is not None and not 0 <= args.shard < max(args.num_shards, 1):
+        parser.error(f"--shard must be in 0..{max(args.num_shards, 1) - 1}")
+
+    while True:
+        if args.shard in (None, 0):
+            maintain_partitions()
+        schedule_ingestion(args.shard, args.num_shards)
+        if args.interval <= 0:
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
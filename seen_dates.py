@@ -0,0 +1,74 @@
+"""Which days have already been pulled, per (user, endpoint), as a Redis bitmap.
+
+Bit n of seen:<endpoint>:<user> is day SEEN_EPOCH + n, so a decade is under
+500 bytes and "which days in this range are missing" is one GETRANGE. The
+seen_events table stays the durable record; a bitmap that is missing (Redis
+flushed, first run after deploy) is rebuilt from it on first use.
+"""
+import logging
+from datetime import date, timedelta
+from typing import Iterable
+
+from queueing import get_redis
+
+SEEN_EPOCH = date(2000, 1, 1)
+
+
+def seen_key(user_id: str, endpoint: str) -> str:
+    return f"seen:{endpoint}:{user_id}"
+
+
+def _offset(day: date) -> int:
+    offset = (day - SEEN_EPOCH).days
+    if offset < 0:
+        raise ValueError(f"{day} is before {SEEN_EPOCH}")
+    return offset
+
+
+def _ensure_loaded(user_id: str, endpoint: str, redis_client) -> str:
+    key = seen_key(user_id, endpoint)
+    if redis_client.exists(key):
+        return key
+    from db import list_seen_dates  # lazy import
+    days = list_seen_dates(user_id, endpoint)
+    if days:
+        pipe = redis_client.pipeline(transaction=False)
+        for day in days:
+            pipe.setbit(key, _offset(day), 1)
+        pipe.execute()
+        logging.getLogger("seen_dates").info(f"Loaded {len(days)} seen {endpoint} days for user {user_id}")
+    return key
+
+
+def missing_days(user_id: str, endpoint: str, start_date: date, end_date: date, redis_client=None) -> list[date]:
+    """Days in [start_date, end_date] not yet marked seen, ascending."""
+    r = redis_client or get_redis()
+    key = _ensure_loaded(user_id, endpoint, r)
+    lo, hi = _offset(start_date), _offset(end_date)
+    if hi < lo:
+        return []
+    raw = r.getrange(key, lo // 8, hi // 8)
+    missing = []
+    for offset in range(lo, hi + 1):
+        i = offset // 8 - lo // 8
+        # Redis numbers bits from the most significant bit of each byte
+        if i >= len(raw) or not (raw[i] >> (7 - offset % 8)) & 1:
+            missing.append(SEEN_EPOCH + timedelta(days=offset))
+    return missing
+
+
+def mark_seen(user_id: str, endpoint: str, days: Iterable[date], redis_client=None) -> set[date]:
+    """Record days as pulled (seen_events, then the bitmap). Returns the newly seen days."""
+    from db import create_seen_events_bulk  # lazy import
+    days = set(days)
+    if not days:
+        return set()
+    r = redis_client or get_redis()
+    # load first, or the bits set below would make a partial bitmap look complete
+    key = _ensure_loaded(user_id, endpoint, r)
+    inserted = create_seen_events_bulk(user_id=user_id, endpoint=endpoint, dates=days)
+    pipe = r.pipeline(transaction=False)
+    for day in days:
+        pipe.setbit(key, _offset(day), 1)
+    pipe.execute()
+    return inserted
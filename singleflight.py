@@ -0,0 +1,27 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Collapse concurrent async calls for the same key into one in-flight task.
+
+    Callers that arrive while a call for `key` is running await its result
+    instead of starting their own. The entry is dropped once the task finishes.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def start(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> "asyncio.Future[T]":
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(fn())
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda _f, k=key: self._inflight.pop(k, None))
+        return fut
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        # shield: one caller being cancelled must not cancel the shared work
+        return await asyncio.shield(self.start(key, fn))
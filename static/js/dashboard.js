@@ -1,8 +1,16 @@
 
 
 document.addEventListener("DOMContentLoaded", function() {
-  fetch("/health")
-    .then(response => response.json())
+  // The user is the session cookie's (see auth.session); every request below sends it
+  fetch("/health", { credentials: "same-origin" })
+    .then(response => {
+      if (response.status === 401) {
+        document.getElementById("authStatusSection").textContent =
+          "Not signed in: open your login link to see your dashboard.";
+        throw new Error("not signed in");
+      }
+      return response.json();
+    })
     .then(apiResponse => {
       // Render auth status/buttons
       function renderAuthStatus() {
@@ -55,12 +63,17 @@ document.addEventListener("DOMContentLoaded", function() {
         read: "#FFA500",
         study_engineering_and_ml: "#1E90FF"
       };
-      const wellnessKeys = (Array.isArray(apiResponse.metrics_view) && apiResponse.metrics_view.length > 0 && apiResponse.metrics_view[0].wellness)
-        ? Object.keys(apiResponse.metrics_view[0].wellness)
-        : [];
-      const productivityKeys = (Array.isArray(apiResponse.metrics_view) && apiResponse.metrics_view.length > 0)
-        ? [...new Set(apiResponse.metrics_view.flatMap(d => d && d.productivity ? Object.keys(d.productivity) : []))]
-        : [];
+      let wellnessKeys = [];
+      let productivityKeys = [];
+      function computeKeys() {
+        wellnessKeys = (Array.isArray(apiResponse.metrics_view) && apiResponse.metrics_view.length > 0 && apiResponse.metrics_view[0].wellness)
+          ? Object.keys(apiResponse.metrics_view[0].wellness)
+          : [];
+        productivityKeys = (Array.isArray(apiResponse.metrics_view) && apiResponse.metrics_view.length > 0)
+          ? [...new Set(apiResponse.metrics_view.flatMap(d => d && d.productivity ? Object.keys(d.productivity) : []))]
+          : [];
+      }
+      computeKeys();
 
       // Helper to get week number (Friday start)
       function getWeekStartFriday(dateStr) {
@@ -388,5 +401,45 @@ document.addEventListener("DOMContentLoaded", function() {
 
       renderAggregationToggle();
       renderCategories();
-    });
+
+      // Follow the jobs /health just enqueued; refetch once, only if data changed
+      function watchJobs() {
+        if (!window.EventSource) return;
+        const status = document.getElementById("jobStatus");
+        const source = new EventSource("/jobs/events", { withCredentials: true });
+        source.addEventListener("progress", function(e) {
+          const p = JSON.parse(e.data);
+          if (p.active === 0) {
+            status.textContent = "";
+            return;
+          }
+          const totals = {};
+          p.jobs.forEach(job => {
+            Object.entries(job.progress || {}).forEach(([k, v]) => { totals[k] = (totals[k] || 0) + v; });
+          });
+          const details = Object.entries(totals).map(([k, v]) => `${v} ${k.replace(/_/g, " ")}`).join(", ");
+          status.textContent = `Updating: ${p.active} job${p.active === 1 ? "" : "s"} running` + (details ? ` (${details})` : "");
+        });
+        source.addEventListener("done", function(e) {
+          source.close();
+          status.textContent = "";
+          const done = JSON.parse(e.data);
+          if (done.data_version === apiResponse.data_version) return;
+          fetch("/metrics/view", { credentials: "same-origin" })
+            .then(response => response.json())
+            .then(view => {
+              apiResponse.metrics_view = view.metrics_view;
+              apiResponse.data_version = view.data_version;
+              computeKeys();
+              chart.data = buildDatasets();
+              chart.update();
+              renderCategories();
+            });
+        });
+        // the server ends the stream after `done`; don't let EventSource reconnect
+        source.onerror = function() { source.close(); };
+      }
+      watchJobs();
+    })
+    .catch(err => console.warn(`Dashboard not loaded: ${err.message}`));
 });
@@ -0,0 +1,111 @@
+"""Precomputed /health payload per user, so the dashboard's first paint is one HGETALL.
+
+status:<user> is a hash with one JSON field per section:
+    oura, dropbox   {"valid", "auth_url", "expires_at"}   dropped on token writes;
+                    invalid ones expire after STATUS_INVALID_RETRY_SECONDS
+    metrics         {"data_version", "start", "end", "metrics_view"}   rebuilt by /health
+                    once the data version moves past it
+    ingest:<endpoint>   ISO time of the last successful ingest, stamped by the ETL worker
+Writers own separate fields, so the worker and the web never overwrite each
+other's sections. A section is only served while it is still current (token
+not expired, data version and window unchanged); /health rebuilds the rest.
+"""
+import os
+import json
+import time
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Optional
+
+STATUS_SNAPSHOT_TTL_SECONDS = int(os.getenv("STATUS_SNAPSHOT_TTL_SECONDS", str(24 * 60 * 60)))
+STATUS_WINDOW_DAYS = 90
+# An invalid section may come from a transient refresh failure: re-check it soon
+STATUS_INVALID_RETRY_SECONDS = int(os.getenv("STATUS_INVALID_RETRY_SECONDS", "60"))
+AUTH_SECTIONS = ("oura", "dropbox")
+
+
+def status_key(user_id: str) -> str:
+    return f"status:{user_id}"
+
+
+def status_window(today: Optional[date] = None) -> tuple[date, date]:
+    """The /health metrics window: the last STATUS_WINDOW_DAYS days through today."""
+    today = today or date.today()
+    return today - timedelta(days=STATUS_WINDOW_DAYS), today
+
+
+def decode_snapshot(raw: Dict) -> Dict:
+    snapshot: Dict = {"last_ingest": {}}
+    for field, value in (raw or {}).items():
+        field = field.decode() if isinstance(field, bytes) else field
+        value = value.decode() if isinstance(value, bytes) else value
+        if field.startswith("ingest:"):
+            snapshot["last_ingest"][field[len("ingest:"):]] = value
+        else:
+            snapshot[field] = json.loads(value)
+    return snapshot
+
+
+def invalid_auth_section(auth_url: Optional[str]) -> Dict:
+    return {"valid": False, "auth_url": auth_url, "expires_at": int(time.time()) + STATUS_INVALID_RETRY_SECONDS}
+
+
+def auth_current(section: Optional[Dict], now: float) -> bool:
+    if not section:
+        return False
+    expires_at = section.get("expires_at")
+    if not isinstance(expires_at, (int, float)):
+        # only a valid token may lack an expiry (long-lived Dropbox tokens)
+        return bool(section.get("valid"))
+    return now < expires_at
+
+
+def metrics_current(section: Optional[Dict], data_version: int, start: date, end: date) -> bool:
+    return bool(section) and section.get("data_version") == data_version and (
+        section.get("start"), section.get("end")) == (start.isoformat(), end.isoformat())
+
+
+def metrics_section(data_version: int, start: date, end: date, metrics_view) -> Dict:
+    return {"data_version": data_version, "start": start.isoformat(), "end": end.isoformat(), "metrics_view": metrics_view}
+
+
+async def aget_snapshot(user_id: str, redis_client) -> Dict:
+    try:
+        return decode_snapshot(await redis_client.hgetall(status_key(user_id)))
+    except Exception as e:
+        logging.getLogger("status_snapshot").warning(f"Status snapshot unavailable for user {user_id}: {e}")
+        return decode_snapshot({})
+
+
+async def asave_sections(user_id: str, sections: Dict, redis_client) -> None:
+    if not sections:
+        return
+    key = status_key(user_id)
+    try:
+        await redis_client.hset(key, mapping={name: json.dumps(value) for name, value in sections.items()})
+        await redis_client.expire(key, STATUS_SNAPSHOT_TTL_SECONDS)
+    except Exception as e:
+        logging.getLogger("status_snapshot").warning(f"Could not store status snapshot for user {user_id}: {e}")
+
+
+async def adrop_auth_section(provider: str, user_id: str, redis_client) -> None:
+    """A token was written or deleted: the next /health rebuilds that provider's status."""
+    if provider in AUTH_SECTIONS:
+        await redis_client.hdel(status_key(user_id), provider)
+
+
+def refresh_after_ingest(user_id: str, endpoint: str, redis_client=None) -> None:
+    """Worker side (sync): stamp the ingest time.
+
+    The metrics section is left to /health: the ingest bumped the data
+    version, so the next request rebuilds it once instead of every job
+    (an Atracker fan-out runs one job per file) rebuilding the pivot.
+    """
+    if redis_client is None:
+        from queueing import get_redis  # lazy import
+        redis_client = get_redis()
+    key = status_key(user_id)
+    pipe = redis_client.pipeline()
+    pipe.hset(key, mapping={f"ingest:{endpoint}": datetime.now(timezone.utc).isoformat()})
+    pipe.expire(key, STATUS_SNAPSHOT_TTL_SECONDS)
+    pipe.execute()
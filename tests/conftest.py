@@ -0,0 +1,7 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def single_user_sessions(monkeypatch):
+    # Route tests run as the default user; tests that need sessions set a secret themselves
+    monkeypatch.setattr("auth.session.SESSION_SECRET", None)
@@ -0,0 +1,52 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from analytics import day_matrix, lagged_corr
+
+
+def test_day_matrix_fills_missing_days_with_nan():
+    rows = [(5, date(2025, 1, 1), 1.0), (9, date(2025, 1, 3), 2.0)]
+    m, ids = day_matrix(rows, date(2025, 1, 1), date(2025, 1, 3))
+    assert ids == [5, 9]
+    assert m.shape == (3, 2)
+    assert m[0, 0] == 1.0 and m[2, 1] == 2.0
+    assert np.isnan(m[1]).all()
+    empty, ids = day_matrix([], date(2025, 1, 1), date(2025, 1, 3))
+    assert empty.shape == (3, 0) and ids == []
+
+
+def test_lagged_corr_matches_numpy_on_shifted_series():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(60, 1))
+    y = np.vstack([[[0.0]], 2 * x[:-1] + 1])  # y[t+1] = 2 x[t] + 1
+    x[10, 0] = np.nan  # pairwise-complete: just drops that day
+    r, n = lagged_corr(x, y, lag=1, min_periods=10)
+    assert n[0, 0] == 58
+    assert r[0, 0] == pytest.approx(1.0)
+    r0, _ = lagged_corr(x, y, lag=0, min_periods=10)
+    assert abs(r0[0, 0]) < 0.5
+
+
+def test_lagged_corr_requires_min_periods():
+    x = np.array([[1.0], [2.0], [3.0]])
+    r, n = lagged_corr(x, x, lag=0, min_periods=5)
+    assert n[0, 0] == 3 and np.isnan(r[0, 0])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("params", [
+    {"start": "2025-02-01", "end": "2025-01-01"},
+    {"start": "2010-01-01", "end": "2025-01-01"},
+    {"lags": ",".join(str(i) for i in range(20))},
+    {"lags": "0,400"},
+    {"min_periods": "1"},
+    {"start": "2025-01-01", "end": "2025-01-31", "min_periods": "60"},
+])
+async def test_correlations_rejects_unbounded_requests(params):
+    from httpx import AsyncClient, ASGITransport
+    from main import app
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/analytics/correlations", params=params)
+    assert response.status_code == 400
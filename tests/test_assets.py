@@ -0,0 +1,44 @@
+import gzip
+import os
+
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+
+from assets import IMMUTABLE_CACHE, PrecompressedStaticFiles, build
+
+
+def _static(tmp_path):
+    (tmp_path / "css").mkdir()
+    (tmp_path / "css" / "dashboard.css").write_text("body { color: red; }\n" * 50)
+    (tmp_path / "dashboard.html").write_text('<link rel="stylesheet" href="/static/css/dashboard.css">')
+    return tmp_path
+
+
+def test_build_fingerprints_and_rewrites_html(tmp_path):
+    static = _static(tmp_path)
+    manifest = build(str(static))
+    hashed = manifest["css/dashboard.css"]
+    assert hashed.startswith("dist/css/dashboard.") and hashed.endswith(".css")
+    assert os.path.exists(static / (hashed + ".gz"))
+    assert f"/static/{hashed}" in (static / "dist" / "dashboard.html").read_text()
+
+
+def test_serves_gzip_variant_with_immutable_headers(tmp_path):
+    static = _static(tmp_path)
+    hashed = build(str(static))["css/dashboard.css"]
+    app = Starlette(routes=[Mount("/static", PrecompressedStaticFiles(directory=str(static)))])
+    client = TestClient(app)
+
+    r = client.get(f"/static/{hashed}", headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200
+    assert r.headers["content-encoding"] == "gzip"
+    assert r.headers["content-type"].startswith("text/css")
+    assert r.headers["cache-control"] == IMMUTABLE_CACHE
+    assert r.headers["vary"] == "Accept-Encoding"
+    raw = (static / hashed).read_bytes()
+    assert r.content == raw or gzip.decompress(r.content) == raw
+
+    r = client.get("/static/css/dashboard.css", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in r.headers
+    assert r.headers["cache-control"] == "no-cache"
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+from auth.cache import LocalTokenCache, get_token, local_tokens
+
+
+class CountingRedis:
+    def __init__(self, raw):
+        self.raw = raw
+        self.gets = 0
+
+    async def get(self, key):
+        self.gets += 1
+        return self.raw
+
+
+@pytest.fixture(autouse=True)
+def clear_local_tokens():
+    local_tokens.clear()
+    yield
+    local_tokens.clear()
+
+
+def test_local_cache_respects_expires_at():
+    cache = LocalTokenCache(ttl_seconds=300)
+    cache.put("k", {"access_token": "abc", "expires_at": int(time.time()) - 1})
+    assert cache.get("k") is None
+    cache.put("k", {"access_token": "abc", "expires_at": int(time.time()) + 60})
+    assert cache.get("k")["access_token"] == "abc"
+    cache.invalidate("k")
+    assert cache.get("k") is None
+
+
+def test_local_cache_returns_copies():
+    cache = LocalTokenCache(ttl_seconds=300)
+    cache.put("k", {"access_token": "abc"})
+    cache.get("k")["access_token"] = "mutated"
+    assert cache.get("k")["access_token"] == "abc"
+
+
+@pytest.mark.asyncio
+async def test_get_token_hits_redis_once():
+    redis = CountingRedis(b'{"access_token": "abc", "expires_at": 9999999999}')
+    first = await get_token("auth:oura:token:u", redis_client=redis)
+    second = await get_token("auth:oura:token:u", redis_client=redis)
+    assert first == second
+    assert redis.gets == 1
+
+
+@pytest.mark.asyncio
+async def test_get_token_does_not_cache_expired():
+    redis = CountingRedis(b'{"access_token": "abc", "expires_at": 0}')
+    await get_token("auth:oura:token:u", redis_client=redis)
+    await get_token("auth:oura:token:u", redis_client=redis)
+    assert redis.gets == 2
+
+
+@pytest.mark.asyncio
+async def test_refresh_reuses_token_a_peer_rotated(monkeypatch):
+    import json
+    import metrics.oura.ingest as ingest
+
+    stale = {"access_token": "old", "refresh_token": "r1", "expires_at": 0}
+    rotated = {"access_token": "new", "refresh_token": "r2", "expires_at": int(time.time()) + 3600}
+
+    class PeerRedis:
+        def __init__(self):
+            self.reads = 0
+
+        async def get(self, key):
+            # the peer's refresh lands between our first read and the lock
+            self.reads += 1
+            return json.dumps(stale if self.reads == 1 else rotated)
+
+        async def set(self, key, value, ex=None, nx=False):
+            return True
+
+        async def eval(self, *args):
+            return 1
+
+    async def post_refresh(token):
+        raise AssertionError("refreshed with an already-rotated refresh token")
+
+    monkeypatch.setattr(ingest, "_post_refresh", post_refresh)
+    token = await ingest._refresh_access_token("u", PeerRedis())
+    assert token["refresh_token"] == "r2"
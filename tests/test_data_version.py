@@ -0,0 +1,57 @@
+import asyncio
+
+from data_version import DATA_VERSION_CHANNEL, VersionTracker, aget_data_version, bump_data_version, versions
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.published = []
+
+    def incr(self, key):
+        self.values[key] = self.values.get(key, 0) + 1
+        return self.values[key]
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+
+
+class FakeAsyncRedis:
+    def __init__(self, values):
+        self.values = values
+        self.gets = 0
+
+    async def get(self, key):
+        self.gets += 1
+        return self.values.get(key)
+
+
+def test_bump_increments_and_publishes():
+    r = FakeRedis()
+    assert bump_data_version("u", r) == 1
+    assert bump_data_version("u", r) == 2
+    assert r.published == [(DATA_VERSION_CHANNEL, "u 1"), (DATA_VERSION_CHANNEL, "u 2")]
+
+
+def test_tracker_notifies_on_newer_versions_only():
+    tracker = VersionTracker()
+    tracker.live = True
+    seen = []
+    tracker.on_change(seen.append)
+    tracker.update("u", 2)
+    tracker.update("u", 1)
+    assert tracker.get("u") == 2
+    tracker.reset()
+    assert seen == ["u", None]
+    assert tracker.get("u") is None
+
+
+def test_version_lookup_is_local_while_live():
+    r = FakeAsyncRedis({"metrics:version:u": "3"})
+    versions.live = True
+    try:
+        assert asyncio.run(aget_data_version("u", r)) == 3
+        assert asyncio.run(aget_data_version("u", r)) == 3
+        assert r.gets == 1
+    finally:
+        versions.reset()
@@ -0,0 +1,21 @@
+import etl_metrics
+
+
+def _listings(monkeypatch):
+    calls = []
+    monkeypatch.setattr(etl_metrics, "list_day_keys", lambda *a, **k: calls.append(("day", a[3], a[4])) or [])
+    monkeypatch.setattr(etl_metrics, "_list_ndjson_gz_keys", lambda *a, **k: calls.append(("dt", a[3])) or [])
+    return calls
+
+
+def test_interval_payload_reads_record_days(monkeypatch):
+    calls = _listings(monkeypatch)
+    assert etl_metrics.etl_daily_sleep_day("2024-05-01/2024-05-01", "u") == 0
+    assert [c[0] for c in calls] == ["day"]
+
+
+def test_bare_date_payload_reads_the_legacy_ingestion_layout(monkeypatch):
+    # a legacy job for today must load everything pulled today, not just today's records
+    calls = _listings(monkeypatch)
+    assert etl_metrics.etl_daily_sleep_day("2024-05-01", "u") == 0
+    assert calls == [("dt", "2024-05-01")]
@@ -0,0 +1,37 @@
+import io
+from datetime import date
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from export import METRICS_SCHEMA, stream_export
+
+
+def _batches():
+    for day in (1, 2):
+        yield pa.RecordBatch.from_pylist(
+            [{"date": date(2025, 1, day), "endpoint": "daily_sleep", "name": "sleep_score",
+              "category": "wellness", "value": 80.0 + day}],
+            schema=METRICS_SCHEMA,
+        )
+
+
+def test_parquet_stream_yields_per_batch_and_round_trips():
+    chunks = list(stream_export("metrics", "parquet", _batches()))
+    assert len(chunks) >= 2
+    table = pq.read_table(io.BytesIO(b"".join(chunks)))
+    assert table.num_rows == 2
+    assert table.column("value").to_pylist() == [81.0, 82.0]
+
+
+def test_arrow_ipc_stream_round_trips():
+    data = b"".join(stream_export("metrics", "arrow", _batches()))
+    table = pa.ipc.open_stream(data).read_all()
+    assert table.schema == METRICS_SCHEMA
+    assert table.num_rows == 2
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        list(stream_export("metrics", "csv", _batches()))
@@ -1,22 +1,89 @@
-import pytest
-pytestmark = pytest.mark.asyncio
-
+import json
+from collections import defaultdict
 
 import pytest
 import pytest_asyncio
 from httpx import AsyncClient, ASGITransport
-from main import app, get_redis_client
+
+import main
+from main import app, get_redis_client, DEFAULT_USER_ID
+from auth.cache import local_tokens
+from status_snapshot import decode_snapshot, metrics_section, status_key, status_window
+# main imports these lazily; load them up front so the patches below apply
+import metrics.oura.ingest, metrics.view, metrics.atracker.dropbox  # noqa: E401,F401
+
+pytestmark = pytest.mark.asyncio
+
+OURA_KEY = f"auth:oura:token:{DEFAULT_USER_ID}"
+VALID_TOKEN = '{"access_token": "abc", "expires_at": 9999999999}'
+
+
+def _async(value):
+    async def fake(*args, **kwargs):
+        return value
+    return fake
+
 
 class MockRedis:
+    """Enough of the async Redis client for /health: GET/SET, the status hash, locks."""
+
+    def __init__(self):
+        self.values = {}
+        self.hashes = defaultdict(dict)
+
     async def get(self, key):
-        # Custom return values for each test will be set via monkeypatch
-        return None
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    async def exists(self, key):
+        return int(key in self.values)
+
+    async def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    async def hset(self, key, mapping):
+        self.hashes[key].update(mapping)
+
+    async def hdel(self, key, *fields):
+        for field in fields:
+            self.hashes[key].pop(field, None)
+
+    async def expire(self, key, seconds):
+        return True
+
+    async def eval(self, *args):
+        return 0
+
+
+@pytest.fixture
+def redis():
+    return MockRedis()
+
+
+@pytest.fixture
+def enqueued(monkeypatch):
+    jobs = []
+    monkeypatch.setattr("metrics.oura.ingest.pull_data", lambda *args, **kwargs: jobs.append("oura") or "oura_job")
+    monkeypatch.setattr("main.enqueue_atracker_job", lambda enqueued_jobs, user_id: jobs.append("atracker"))
+    return jobs
+
 
 @pytest_asyncio.fixture(autouse=True)
-def override_redis(monkeypatch):
-    app.dependency_overrides[get_redis_client] = lambda: MockRedis()
+def override_redis(monkeypatch, redis):
+    app.dependency_overrides[get_redis_client] = lambda: redis
+    monkeypatch.setattr("metrics.view.aget_metrics_pivot", _async(["metrics_view"]))
+    local_tokens.clear()
+    metrics.view.pivot_cache.clear()
     yield
     app.dependency_overrides = {}
+    local_tokens.clear()
+    metrics.view.pivot_cache.clear()
+
 
 @pytest_asyncio.fixture
 async def async_client():
@@ -25,107 +92,123 @@ async def async_client():
         yield ac
 
 
-@pytest.mark.asyncio
-async def test_health_no_token(async_client):
+async def test_health_no_token(monkeypatch, async_client, enqueued):
+    monkeypatch.setattr("metrics.atracker.dropbox.get_dropbox_token", _async(None))
     response = await async_client.get("/health")
     assert response.status_code == 200
     data = response.json()
-    # Should return Oura auth URL when no token
-    assert "oura_auth_url" in data
+    # Should link to /oura_start when there is no token
+    assert data["oura_auth_valid"] is False
+    assert data["oura_auth_url"].endswith("/oura_start")
     assert data["status"] == "healthy"
+    assert enqueued == ["atracker"]
 
-@pytest.mark.asyncio
-async def test_health_expired_token(monkeypatch, async_client):
-    # Patch get_dropbox_token to avoid real Redis async calls
-    monkeypatch.setattr("metrics.atracker.dropbox.get_dropbox_token", lambda user_id: None)
-    # Patch MockRedis.get to return expired token as bytes via async
-    async def get_bytes(self, key):
-        return b'{"access_token": "abc", "expires_at": 0}'
-    monkeypatch.setattr(MockRedis, "get", get_bytes)
-    # Patch get_data_from_api to return dummy data
-    def mock_get_data_from_api(*args, **kwargs):
-        return []
-    monkeypatch.setattr("metrics.oura.ingest.get_data_from_api", mock_get_data_from_api)
-    monkeypatch.setattr("metrics.view.get_metrics_pivot", lambda *args, **kwargs: ["metrics_view"])
-    monkeypatch.setattr("main.enqueue_atracker_job", lambda enqueued_jobs, user_id: enqueued_jobs.update({"atracker": "mock_job_id"}))
+
+async def test_health_expired_token(monkeypatch, async_client, redis, enqueued):
+    monkeypatch.setattr("metrics.atracker.dropbox.get_dropbox_token", _async(None))
+    # expired and no refresh token: the user has to authorize again
+    redis.values[OURA_KEY] = '{"access_token": "abc", "expires_at": 0}'
     response = await async_client.get("/health")
     assert response.status_code == 200
     data = response.json()
-    # Should return Oura auth URL when token is expired
-    assert "metrics_view" in data
-    assert "oura_auth_url" in data
+    assert data["metrics_view"] == ["metrics_view"]
+    assert data["oura_auth_url"].endswith("/oura_start")
     assert "dropbox_auth_url" in data
     assert "dropbox_auth_valid" in data
     assert data["status"] == "healthy"
 
-@pytest.mark.asyncio
-async def test_health_valid_token(monkeypatch, async_client):
-    # Patch MockRedis.get to return valid token as bytes via async
-    async def get_bytes(self, key):
-        return b'{"access_token": "abc", "expires_at": 9999999999}'
-    monkeypatch.setattr(MockRedis, "get", get_bytes)
-    monkeypatch.setattr("metrics.atracker.dropbox.get_dropbox_token", lambda user_id: "dbx_token")
-    monkeypatch.setattr("metrics.oura.ingest.pull_data", lambda *args, **kwargs: ("api_data", "persisted_data", {}))
-    monkeypatch.setattr("metrics.view.get_metrics_pivot", lambda *args, **kwargs: ["metrics_view"])
-    # Patch get_data_from_api to return dummy data
-    def mock_get_data_from_api(*args, **kwargs):
-        return []
-    monkeypatch.setattr("metrics.oura.ingest.get_data_from_api", mock_get_data_from_api)
-    monkeypatch.setattr("main.enqueue_atracker_job", lambda enqueued_jobs, user_id: enqueued_jobs.update({"atracker": "mock_job_id"}))
+
+async def test_health_valid_token(monkeypatch, async_client, redis, enqueued):
+    redis.values[OURA_KEY] = VALID_TOKEN
+    monkeypatch.setattr("metrics.atracker.dropbox.get_dropbox_token", _async({"access_token": "dbx"}))
     response = await async_client.get("/health")
     assert response.status_code == 200
     data = response.json()
-    assert "metrics_view" in data
-    assert "oura_auth_url" in data
-    assert "oura_auth_valid" in data
-    assert "dropbox_auth_url" in data
-    assert "dropbox_auth_valid" in data
+    assert data["metrics_view"] == ["metrics_view"]
+    assert data["oura_auth_valid"] is True and data["oura_auth_url"] is None
+    assert data["dropbox_auth_valid"] is True
     assert data["status"] == "healthy"
+    # jobs are enqueued (and tracked) before the response, so /jobs/events sees them
+    assert enqueued == ["oura", "atracker"]
+
 
-@pytest.mark.asyncio
-async def test_health_dropbox_auth_required(monkeypatch, async_client):
-    # Patch Redis to return valid Oura token
-    async def get_bytes(self, key):
-        return b'{"access_token": "abc", "expires_at": 9999999999}'
-    monkeypatch.setattr(MockRedis, "get", get_bytes)
-    monkeypatch.setattr("metrics.atracker.dropbox._redis", MockRedis())
-    # Patch Dropbox token to return None (simulate missing Dropbox auth)
-    monkeypatch.setattr("metrics.atracker.dropbox.get_dropbox_token", lambda user_id: None)
-    # Patch DropboxAuthManager.get_authorize_url to return a dummy URL
+async def test_health_dropbox_auth_required(monkeypatch, async_client, redis, enqueued):
+    redis.values[OURA_KEY] = VALID_TOKEN
+    monkeypatch.setattr("main.DROPBOX_REDIRECT_URI", None)
+    monkeypatch.setattr("metrics.atracker.dropbox.get_dropbox_token", _async(None))
     monkeypatch.setattr("metrics.atracker.dropbox.DropboxAuthManager.get_authorize_url", lambda self: "https://dropbox-auth-url")
-    # Patch Oura API and metrics pivot
-    monkeypatch.setattr("metrics.oura.ingest.pull_data", lambda *args, **kwargs: ([], [], {}))
-    monkeypatch.setattr("metrics.view.get_metrics_pivot", lambda *args, **kwargs: ["metrics_view"])
-    def mock_get_data_from_api(*args, **kwargs):
-        return []
-    monkeypatch.setattr("metrics.oura.ingest.get_data_from_api", mock_get_data_from_api)
-    monkeypatch.setattr("main.enqueue_atracker_job", lambda enqueued_jobs, user_id: enqueued_jobs.update({"atracker": "mock_job_id"}))
     response = await async_client.get("/health")
     assert response.status_code == 200
     data = response.json()
-    # Accept dropbox_auth_url or dropbox_auth_valid in response
-    assert "dropbox_auth_url" in data or "dropbox_auth_valid" in data
+    assert data["dropbox_auth_valid"] is False
+    assert data["dropbox_auth_url"] == "https://dropbox-auth-url"
     assert data["status"] == "healthy"
 
-@pytest.mark.asyncio
-async def test_health_dropbox_redirect(monkeypatch, async_client):
-    # Patch Redis to return valid Oura token
-    async def get_bytes(self, key):
-        return b'{"access_token": "abc", "expires_at": 9999999999}'
-    monkeypatch.setattr(MockRedis, "get", get_bytes)
-    monkeypatch.setattr("metrics.atracker.dropbox._redis", MockRedis())
-    # Patch Dropbox token to return None (simulate missing Dropbox auth)
-    monkeypatch.setattr("metrics.atracker.dropbox.get_dropbox_token", lambda user_id: None)
-    # Patch DROPBOX_REDIRECT_URI and DOMAIN env vars
-    monkeypatch.setattr("os.getenv", lambda key: "dummy" if key == "DROPBOX_REDIRECT_URI" else "example.com")
-    # Patch Oura API and metrics pivot
-    monkeypatch.setattr("metrics.oura.ingest.pull_data", lambda *args, **kwargs: ([], [], {}))
-    monkeypatch.setattr("metrics.view.get_metrics_pivot", lambda *args, **kwargs: ["metrics_view"])
-    def mock_get_data_from_api(*args, **kwargs):
-        return []
-    monkeypatch.setattr("metrics.oura.ingest.get_data_from_api", mock_get_data_from_api)
-    monkeypatch.setattr("main.enqueue_atracker_job", lambda enqueued_jobs, user_id: enqueued_jobs.update({"atracker": "mock_job_id"}))
+
+async def test_health_dropbox_redirect(monkeypatch, async_client, redis, enqueued):
+    redis.values[OURA_KEY] = VALID_TOKEN
+    monkeypatch.setattr("main.DROPBOX_REDIRECT_URI", "https://example.com/dropbox_callback")
+    monkeypatch.setattr("main.DOMAIN", "example.com")
+    monkeypatch.setattr("metrics.atracker.dropbox.get_dropbox_token", _async(None))
     response = await async_client.get("/health")
     assert response.status_code == 200
     data = response.json()
-    assert data["status"] == "healthy"
\ No newline at end of file
+    assert data["dropbox_auth_url"] == "https://example.com/dropbox_start"
+    assert data["status"] == "healthy"
+
+
+async def test_health_warm_snapshot_skips_rebuilds(monkeypatch, async_client, redis, enqueued):
+    start, end = status_window()
+    redis.values[f"metrics:version:{DEFAULT_USER_ID}"] = "5"
+    redis.hashes[status_key(DEFAULT_USER_ID)] = {
+        "oura": json.dumps({"valid": True, "auth_url": None, "expires_at": 9999999999}),
+        "dropbox": json.dumps({"valid": True, "auth_url": None, "expires_at": 9999999999}),
+        "metrics": json.dumps(metrics_section(5, start, end, ["from_snapshot"])),
+        "ingest:daily_sleep": "2025-10-01T08:00:00+00:00",
+    }
+
+    async def must_not_run(*args, **kwargs):
+        raise AssertionError("section should have come from the snapshot")
+
+    for name in ("_oura_status", "_dropbox_status", "_metrics_status"):
+        monkeypatch.setattr(main, name, must_not_run)
+    monkeypatch.setattr("metrics.oura.ingest.get_valid_access_token", _async({"access_token": "abc"}))
+    data = (await async_client.get("/health")).json()
+    assert data["metrics_view"] == ["from_snapshot"]
+    assert data["data_version"] == 5
+    assert data["last_ingest"] == {"daily_sleep": "2025-10-01T08:00:00+00:00"}
+    assert enqueued == ["oura", "atracker"]
+
+
+async def test_health_stale_metrics_are_rebuilt_and_written_back(monkeypatch, async_client, redis, enqueued):
+    start, end = status_window()
+    redis.values[OURA_KEY] = VALID_TOKEN
+    redis.values[f"metrics:version:{DEFAULT_USER_ID}"] = "6"
+    redis.hashes[status_key(DEFAULT_USER_ID)] = {
+        "oura": json.dumps({"valid": True, "auth_url": None, "expires_at": 9999999999}),
+        "dropbox": json.dumps({"valid": True, "auth_url": None, "expires_at": 9999999999}),
+        # written before the latest data version bump
+        "metrics": json.dumps(metrics_section(5, start, end, ["stale"])),
+    }
+    data = (await async_client.get("/health")).json()
+    assert data["metrics_view"] == ["metrics_view"]
+    assert data["data_version"] == 6
+    stored = decode_snapshot(redis.hashes[status_key(DEFAULT_USER_ID)])
+    assert stored["metrics"]["data_version"] == 6
+    assert stored["metrics"]["metrics_view"] == ["metrics_view"]
+    assert stored["oura"]["valid"] is True
+
+
+async def test_health_rechecks_an_invalid_section_once_it_expires(monkeypatch, async_client, redis, enqueued):
+    start, end = status_window()
+    redis.values[OURA_KEY] = VALID_TOKEN
+    redis.hashes[status_key(DEFAULT_USER_ID)] = {
+        # left by a refresh that failed a minute ago
+        "oura": json.dumps({"valid": False, "auth_url": "/oura_start", "expires_at": 1}),
+        "dropbox": json.dumps({"valid": True, "auth_url": None, "expires_at": 9999999999}),
+        "metrics": json.dumps(metrics_section(0, start, end, ["metrics_view"])),
+    }
+    data = (await async_client.get("/health")).json()
+    assert data["oura_auth_valid"] is True and data["oura_auth_url"] is None
+    assert decode_snapshot(redis.hashes[status_key(DEFAULT_USER_ID)])["oura"]["valid"] is True
+    assert enqueued == ["oura", "atracker"]
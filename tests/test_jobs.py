@@ -0,0 +1,52 @@
+from datetime import date, timedelta
+
+from jobs import day_range, queue_for, queue_for_range
+from queueing import QUEUE_HIGH, QUEUE_BULK
+
+
+def test_queue_for_today_is_high():
+    assert queue_for("daily_sleep", date.today().isoformat()) == QUEUE_HIGH
+    assert queue_for("atracker", date.today().isoformat()) == QUEUE_HIGH
+
+def test_queue_for_backfill_day_is_bulk():
+    old = (date.today() - timedelta(days=30)).isoformat()
+    assert queue_for("daily_readiness", old) == QUEUE_BULK
+
+def test_queue_for_atracker_file_is_bulk():
+    # date_str carries a file path for per-file jobs
+    assert queue_for("atracker_file", "data/atracker/10-01-2025_baseline.json") == QUEUE_BULK
+
+def test_queue_for_range():
+    today = date.today()
+    assert queue_for_range(today - timedelta(days=90), today) == QUEUE_HIGH
+    assert queue_for_range(today - timedelta(days=400), today - timedelta(days=300)) == QUEUE_BULK
+
+def test_queue_for_day_interval_uses_end_day():
+    today = date.today()
+    assert day_range("2024-05-01/2024-05-31") == (date(2024, 5, 1), date(2024, 5, 31))
+    assert day_range("2024-05-01") == (date(2024, 5, 1), date(2024, 5, 1))
+    assert queue_for("daily_sleep", f"{today - timedelta(days=60)}/{today}") == QUEUE_HIGH
+    assert queue_for("daily_sleep", f"{today - timedelta(days=60)}/{today - timedelta(days=30)}") == QUEUE_BULK
+
+def test_defer_schedules_a_delayed_copy(monkeypatch):
+    import rq
+    import jobs
+
+    class FakeJob:
+        origin, timeout, meta, args, kwargs = QUEUE_BULK, 300, {"endpoint": "daily_sleep"}, ("daily_sleep",), {}
+        func = staticmethod(lambda *a: None)
+
+    scheduled = []
+
+    class FakeQueue:
+        def enqueue_in(self, delay, func, *args, **kwargs):
+            scheduled.append((delay, args, kwargs))
+            return FakeJob()
+
+    monkeypatch.setattr(rq, "get_current_job", lambda: FakeJob())
+    monkeypatch.setattr(jobs, "get_queue", lambda name: FakeQueue())
+    monkeypatch.setattr(jobs, "track_job", lambda user_id, job: None)
+    assert jobs._defer_current_job("u")
+    delay, args, kwargs = scheduled[0]
+    assert delay == timedelta(seconds=jobs.ETL_USER_DEFER_SECONDS)
+    assert args == ("daily_sleep",) and kwargs["meta"] == {"endpoint": "daily_sleep"}
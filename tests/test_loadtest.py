@@ -0,0 +1,34 @@
+import asyncio
+import os
+import sys
+
+from httpx import ASGITransport, AsyncClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+import loadtest  # noqa: E402
+
+
+def test_percentile_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert loadtest.percentile(values, 50) == 50
+    assert loadtest.percentile(values, 99) == 99
+    assert loadtest.percentile([3.0], 95) == 3.0
+    assert loadtest.percentile([], 50) == 0.0
+
+
+async def _app(scope, receive, send):
+    status = 200 if scope["path"] == "/ok" else 500
+    await send({"type": "http.response.start", "status": status, "headers": []})
+    await send({"type": "http.response.body", "body": b"x"})
+
+
+def test_run_load_counts_requests_and_errors_per_path():
+    async def run():
+        async with AsyncClient(transport=ASGITransport(app=_app), base_url="http://t") as client:
+            return await loadtest.run_load(client, ["/ok", "/bad"], concurrency=4, total_requests=40)
+
+    result = asyncio.run(run())
+    assert result["overall"]["requests"] == 40
+    assert result["paths"]["/ok"]["requests"] == 20 and result["paths"]["/ok"]["errors"] == 0
+    assert result["paths"]["/bad"]["errors"] == 20
+    assert result["overall"]["p50_ms"] <= result["overall"]["p99_ms"]
@@ -0,0 +1,64 @@
+import db
+
+
+class FakeConn:
+    def __init__(self, default_has_rows):
+        self.default_has_rows = default_has_rows
+        self.sql = []
+
+    def execute(self, stmt):
+        sql = str(stmt)
+        self.sql.append(sql)
+
+        class Result:
+            rowcount = 3
+
+            def scalar(_self):
+                if "to_regclass" in sql:
+                    return True
+                return self.default_has_rows
+
+        return Result()
+
+
+def test_partition_created_directly_when_default_is_clear():
+    conn = FakeConn(default_has_rows=False)
+    db._create_year_partition(conn, "metric", "date", 2031)
+    assert not any("DETACH" in s for s in conn.sql)
+    assert conn.sql[-1].startswith("CREATE TABLE IF NOT EXISTS metric_y2031 PARTITION OF metric")
+
+
+def test_rows_in_default_are_moved_before_reattaching():
+    conn = FakeConn(default_has_rows=True)
+    db._create_year_partition(conn, "metric", "date", 2031)
+    ddl = [s.split(" (")[0] for s in conn.sql[2:]]
+    assert ddl[0] == "ALTER TABLE metric DETACH PARTITION metric_default"
+    assert ddl[1].startswith("CREATE TABLE IF NOT EXISTS metric_y2031")
+    assert "DELETE FROM metric_default" in conn.sql[4] and "INSERT INTO metric_y2031" in conn.sql[4]
+    assert ddl[3] == "ALTER TABLE metric ATTACH PARTITION metric_default DEFAULT"
+
+
+def test_write_metrics_ensures_partitions_for_the_years_it_writes(monkeypatch):
+    from datetime import date
+    import pytest
+
+    class Stop(Exception):
+        pass
+
+    def ensure(years):
+        ensured.extend(years)
+        raise Stop  # nothing past the DDL matters here
+
+    ensured = []
+    monkeypatch.setattr(db, "resolve_series_ids", lambda user_id, endpoint, names: {n: 1 for n in names})
+    monkeypatch.setattr(db, "ensure_metric_partitions", ensure)
+    rows = [("score", date(2019, 5, 1), 1.0), ("score", date(2024, 1, 1), 2.0), ("score", date(2019, 6, 1), 3.0)]
+    with pytest.raises(Stop):
+        db.write_metrics("u", "daily_sleep", rows)
+    assert ensured == [2019, 2024]
+
+
+def test_partition_bounds_are_utc():
+    conn = FakeConn(default_has_rows=False)
+    db._create_year_partition(conn, "metric_sample", "ts", 2031)
+    assert conn.sql[-1].endswith("FROM ('2031-01-01 00:00:00+00') TO ('2032-01-01 00:00:00+00')")
@@ -0,0 +1,59 @@
+import threading
+import time
+from datetime import date, timedelta
+
+from metrics.oura.planner import iter_range_batches, plan_ranges
+
+
+def test_sparse_days_fetch_only_those_days():
+    today = date(2025, 10, 1)
+    old = today - timedelta(days=89)
+    assert plan_ranges({today, old}) == [(old, old), (today, today)]
+
+
+def test_contiguous_runs_are_merged_and_capped():
+    start = date(2023, 1, 1)
+    days = [start + timedelta(days=i) for i in range(75)] + [date(2023, 6, 1), date(2023, 6, 2)]
+    assert plan_ranges(days, max_days=30) == [
+        (start, start + timedelta(days=29)),
+        (start + timedelta(days=30), start + timedelta(days=59)),
+        (start + timedelta(days=60), start + timedelta(days=74)),
+        (date(2023, 6, 1), date(2023, 6, 2)),
+    ]
+    assert plan_ranges([]) == []
+
+
+def test_iter_range_batches_runs_concurrently_and_keeps_order():
+    ranges = plan_ranges([date(2024, 1, d) for d in (1, 3, 5, 7)])
+    active, peak = 0, 0
+    lock = threading.Lock()
+
+    def fetch(start, end):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.05)
+        with lock:
+            active -= 1
+        return [{"day": start.isoformat()}]
+
+    records = [r for _span, batch in iter_range_batches(fetch, ranges, concurrency=2) for r in batch]
+    assert [r["day"] for r in records] == ["2024-01-01", "2024-01-03", "2024-01-05", "2024-01-07"]
+    assert peak == 2
+
+
+def test_iter_range_batches_bounds_fetches_ahead_of_the_consumer():
+    ranges = plan_ranges([date(2024, 1, d) for d in range(1, 20, 2)])
+    started = []
+
+    def fetch(start, end):
+        started.append(start)
+        return [{"day": start.isoformat()}]
+
+    batches = iter_range_batches(fetch, ranges, concurrency=3)
+    span, batch = next(batches)
+    assert span == ranges[0] and batch == [{"day": "2024-01-01"}]
+    # one handed out, at most three more in flight; the rest wait for the consumer
+    assert len(started) <= 4
+    assert [s for s, _ in batches] == ranges[1:]
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+import ratelimit
+
+
+class ScriptedRedis:
+    """eval() answers with the queued wait times (ms); 0 means granted."""
+
+    def __init__(self, waits):
+        self.waits = list(waits)
+        self.calls = []
+
+    def eval(self, script, numkeys, *keys_and_args):
+        self.calls.append(keys_and_args)
+        return self.waits.pop(0)
+
+
+def test_acquire_waits_until_granted_and_reports_wait(monkeypatch):
+    slept = []
+    monkeypatch.setattr(ratelimit.time, "sleep", slept.append)
+    r = ScriptedRedis([200, 300, 0])
+    assert ratelimit.acquire("oura", "u", redis_client=r) == 0.5
+    assert slept == [0.2, 0.3]
+    keys = r.calls[-1][:3]
+    assert keys == ("ratelimit:oura", "ratelimit:oura:user:u", "ratelimit:stats:oura")
+    # cost, then the accumulated wait so the script can record it
+    assert r.calls[-1][3:5] == (1, 500)
+
+
+def test_acquire_without_user_uses_only_the_global_bucket():
+    r = ScriptedRedis([0])
+    ratelimit.acquire("dropbox", redis_client=r)
+    assert r.calls[0][:2] == ("ratelimit:dropbox", "ratelimit:stats:dropbox")
+
+
+def test_acquire_gives_up_after_max_wait(monkeypatch):
+    monkeypatch.setattr(ratelimit.time, "sleep", lambda s: None)
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_MAX_WAIT_SECONDS", 1)
+    with pytest.raises(ratelimit.RateLimited):
+        ratelimit.acquire("oura", "u", redis_client=ScriptedRedis([600, 600]))
+
+
+def test_acquire_fails_open_without_redis():
+    class Down:
+        def eval(self, *args):
+            raise ConnectionError("redis down")
+
+    assert ratelimit.acquire("oura", "u", redis_client=Down()) == 0
+
+
+def test_aacquire_sleeps_on_the_loop(monkeypatch):
+    class AsyncScripted(ScriptedRedis):
+        async def eval(self, *args):
+            return super().eval(*args)
+
+    slept = []
+
+    async def fake_sleep(seconds):
+        slept.append(seconds)
+
+    monkeypatch.setattr(ratelimit.asyncio, "sleep", fake_sleep)
+    waited = asyncio.run(ratelimit.aacquire("oura", "u", redis_client=AsyncScripted([100, 0])))
+    assert waited == 0.1 and slept == [0.1]
+
+
+def test_penalize_uses_the_rate_of_the_bucket_it_drains():
+    r = ScriptedRedis([1, 1])
+    ratelimit.penalize("oura", "u", 10, redis_client=r)
+    ratelimit.penalize("oura", None, 10, redis_client=r)
+    global_limit, user_limit = ratelimit.LIMITS["oura"]
+    assert r.calls[0] == ("ratelimit:oura:user:u", user_limit.rate, 10)
+    assert r.calls[1] == ("ratelimit:oura", global_limit.rate, 10)
+
+
+def test_dropbox_429_holds_the_user_and_retries(monkeypatch):
+    import dropbox
+    from metrics.atracker import ingest
+
+    async def granted(*args, **kwargs):
+        return 0
+
+    held = []
+    calls = []
+
+    def list_folder(path, recursive=False):
+        calls.append(path)
+        if len(calls) == 1:
+            raise dropbox.exceptions.RateLimitError("req", backoff=7)
+        return "listing"
+
+    monkeypatch.setattr(ingest, "aacquire", granted)
+    monkeypatch.setattr(ingest, "penalize", lambda provider, user_id, seconds: held.append((provider, user_id, seconds)))
+    assert asyncio.run(ingest._dropbox_call("u", list_folder, "/apps", recursive=True)) == "listing"
+    assert held == [("dropbox", "u", 7.0)] and calls == ["/apps", "/apps"]
@@ -0,0 +1,98 @@
+from datetime import date
+
+import pytest
+
+import rebuild
+
+
+def test_shard_range_by_month_and_day():
+    assert rebuild.shard_range(date(2024, 1, 15), date(2024, 3, 10)) == [
+        (date(2024, 1, 15), date(2024, 1, 31)),
+        (date(2024, 2, 1), date(2024, 2, 29)),
+        (date(2024, 3, 1), date(2024, 3, 10)),
+    ]
+    assert len(rebuild.shard_range(date(2024, 1, 1), date(2024, 12, 31), by="day")) == 366
+
+
+def test_plan_is_newest_first_per_source():
+    shards = rebuild.plan(["daily_sleep", "atracker"], date(2024, 1, 1), date(2024, 2, 15))
+    assert shards[0] == ("daily_sleep", date(2024, 2, 1), date(2024, 2, 15))
+    assert shards[1][0] == "atracker"
+    assert len(shards) == 4
+
+
+class FakeRedis:
+    def __init__(self, members):
+        self.members = set(members)
+
+    def smembers(self, key):
+        return {m.encode() for m in self.members}
+
+    def delete(self, key):
+        self.members.clear()
+
+
+def _fake_shard(source, start, end, user_id, checkpoint=None):
+    return 10
+
+
+def test_rebuild_resumes_from_checkpoint(monkeypatch):
+    done = rebuild.shard_id(("atracker", date(2024, 2, 1), date(2024, 2, 29)))
+    monkeypatch.setattr(rebuild, "get_redis", lambda: FakeRedis([done]))
+    monkeypatch.setattr(rebuild, "rebuild_shard", _fake_shard)
+    refreshed = []
+    monkeypatch.setattr(rebuild, "_refresh_rolling", lambda *a: refreshed.append(a))
+
+    stats = rebuild.rebuild("u", date(2024, 1, 1), date(2024, 2, 29), sources=["atracker"], workers=2)
+    assert stats["shards"] == 2 and stats["skipped"] == 1
+    assert stats["rows"] == 10 and stats["failed"] == 0
+    assert refreshed
+
+    stats = rebuild.rebuild("u", date(2024, 1, 1), date(2024, 2, 29), sources=["atracker"], workers=2, restart=True)
+    assert stats["skipped"] == 0 and stats["rows"] == 20
+
+
+def test_rq_rebuild_enqueues_a_final_pass_after_every_shard(monkeypatch):
+    import queueing
+    import jobs
+
+    class FakeJob:
+        def __init__(self, func, kwargs):
+            self.func, self.depends_on = func, kwargs.get("depends_on")
+
+    class FakeQueue:
+        def __init__(self):
+            self.jobs = []
+
+        def enqueue(self, func, *args, **kwargs):
+            self.jobs.append(FakeJob(func, kwargs))
+            return self.jobs[-1]
+
+    q = FakeQueue()
+    monkeypatch.setattr(rebuild, "get_redis", lambda: FakeRedis([]))
+    monkeypatch.setattr(queueing, "get_queue", lambda name: q)
+    monkeypatch.setattr(jobs, "track_job", lambda user_id, job: None)
+
+    stats = rebuild.rebuild("u", date(2024, 1, 1), date(2024, 3, 31), sources=["atracker"], use_rq=True)
+    assert stats["enqueued"] == 3
+    *shards, final = q.jobs
+    assert final.func is rebuild._refresh_rolling
+    assert final.depends_on == shards
+
+
+class ListingS3:
+    def __init__(self, keys):
+        self.keys = sorted(keys)
+
+    def list_objects_v2(self, Bucket, Prefix, StartAfter="", **kwargs):
+        return {"Contents": [{"Key": k} for k in self.keys if k.startswith(Prefix) and k > StartAfter]}
+
+
+def test_oura_shard_fails_instead_of_checkpointing_legacy_only_history(monkeypatch):
+    import s3io
+    prefix = s3io._raw_prefix("oura", "v2", "daily_sleep", "v1", "u")
+    monkeypatch.setattr(s3io, "_s3", ListingS3([f"{prefix}dt=2024-02-01/hour=08/part=1-00001.jsonl.gz"]))
+    with pytest.raises(RuntimeError, match="dt= layout"):
+        rebuild.rebuild_shard("daily_sleep", date(2024, 1, 1), date(2024, 1, 31), "u", checkpoint="ck")
+    # without any raw history the month is simply empty
+    rebuild._require_day_partitions("daily_sleep", date(2024, 1, 1), date(2024, 1, 31), "new-user")
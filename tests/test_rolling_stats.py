@@ -0,0 +1,21 @@
+from datetime import date
+
+import polars as pl
+import pytest
+
+from rolling_stats import compute_rolling_stats
+
+
+def test_windows_are_calendar_days_per_series():
+    df = pl.DataFrame({
+        "series_id": [1, 1, 1, 2],
+        "date": [date(2025, 1, 1), date(2025, 1, 2), date(2025, 1, 9), date(2025, 1, 2)],
+        "value": [1.0, 3.0, 5.0, 10.0],
+    })
+    stats = compute_rolling_stats(df, windows=(7,)).sort("series_id", "date")
+    assert stats["n"].to_list() == [1, 2, 1, 1]
+    assert stats["mean"].to_list() == [1.0, 2.0, 5.0, 10.0]
+    # Jan 9's window (Jan 3..9) no longer sees Jan 2; series 2 is independent
+    assert stats["std"][1] == pytest.approx(2 ** 0.5)
+    assert stats["zscore"][1] == pytest.approx(1 / 2 ** 0.5)
+    assert stats["zscore"][2] is None and stats["zscore"][3] is None
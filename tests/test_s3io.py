@@ -0,0 +1,130 @@
+import gzip
+import json
+import random
+from datetime import date
+
+import s3io
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def list_objects_v2(self, Bucket, Prefix, StartAfter="", **kwargs):
+        keys = sorted(k for k in self.objects if k.startswith(Prefix) and k > StartAfter)
+        return {"Contents": [{"Key": k} for k in keys], "IsTruncated": False}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.uploads[Key] = []
+        return {"UploadId": Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[Key].append(Body)
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        assert [p["PartNumber"] for p in MultipartUpload["Parts"]] == list(range(1, len(self.uploads[Key]) + 1))
+        self.objects[Key] = b"".join(self.uploads.pop(Key))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(Key)
+
+
+def _records(n):
+    rng = random.Random(0)
+    for i in range(n):
+        # incompressible payload so sizes grow predictably
+        yield {"i": i, "blob": "%032x" % rng.getrandbits(128)}
+
+
+def test_small_write_is_one_part_and_leaves_records_untouched(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(s3io, "_s3", s3)
+    records = [{"a": 1}, {"a": 2}]
+    out = s3io.write_jsonl_gz(records, "oura", "v2", "daily_sleep", user_id="u")
+    assert records == [{"a": 1}, {"a": 2}]
+    assert out["record_count"] == 2 and len(out["parts"]) == 1
+    lines = gzip.decompress(s3.objects[out["data_key"]]).splitlines()
+    assert [json.loads(l)["a"] for l in lines] == [1, 2]
+    assert "_ingested_at" in json.loads(lines[0])
+    meta = json.loads(s3.objects[out["meta_key"]])
+    assert meta["record_count"] == 2 and meta["user_id"] == "u"
+
+
+def test_streams_generator_with_multipart_and_rollover(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(s3io, "_s3", s3)
+    monkeypatch.setattr(s3io, "MULTIPART_CHUNK_BYTES", 16 * 1024)
+    monkeypatch.setattr(s3io, "RAW_PART_MAX_BYTES", 64 * 1024)
+    out = s3io.write_jsonl_gz(_records(5000), "oura", "v2", "heartrate")
+    assert len(out["parts"]) > 1
+    assert out["parts"][1]["data_key"].endswith("-00002.jsonl.gz")
+    assert not s3.uploads  # every multipart upload completed
+    seen = []
+    for part in out["parts"]:
+        body = s3.objects[part["data_key"]]
+        assert json.loads(s3.objects[part["meta_key"]])["bytes_gz"] == len(body)
+        seen += [json.loads(l)["i"] for l in gzip.decompress(body).splitlines()]
+    assert seen == list(range(5000))
+    assert out["record_count"] == 5000
+
+
+def test_day_partitions_are_listed_by_record_day(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(s3io, "_s3", s3)
+    records = [{"day": f"2024-05-{d:02d}", "score": d} for d in (1, 2, 2, 3, 10)]
+    out = s3io.write_jsonl_gz_by_day(records, "oura", "v2", "daily_sleep", day_of=lambda r: r["day"], user_id="u")
+    assert sorted(out["days"]) == ["2024-05-01", "2024-05-02", "2024-05-03", "2024-05-10"]
+    assert out["record_count"] == 5
+    meta = json.loads(s3.objects[out["days"]["2024-05-02"][0]["meta_key"]])
+    assert meta["day"] == "2024-05-02" and meta["record_count"] == 2 and meta["ingested_at"]
+    # an ingestion-time object for the same user must not leak into day listings
+    s3io.write_jsonl_gz([{"day": "2024-05-02"}], "oura", "v2", "daily_sleep", user_id="u")
+
+    keys = s3io.list_day_keys("oura", "v2", "daily_sleep", date(2024, 5, 2), date(2024, 5, 3), user_id="u")
+    assert len(keys) == 2 and all("/day=2024-05-0" in k for k in keys)
+    days = {json.loads(l)["day"] for k in keys for l in gzip.decompress(s3.objects[k]).splitlines()}
+    assert days == {"2024-05-02", "2024-05-03"}
+    assert s3io.list_day_keys("oura", "v2", "daily_sleep", date(2024, 5, 4), date(2024, 5, 9), user_id="u") == []
+
+
+def test_day_writes_stream_and_tolerate_unsorted_input(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(s3io, "_s3", s3)
+    consumed = []
+
+    def stream():
+        for day in ("2024-05-01", "2024-05-02", "2024-05-01"):
+            consumed.append(day)
+            yield {"day": day}
+
+    out = s3io.write_jsonl_gz_by_day(stream(), "oura", "v2", "daily_sleep", day_of=lambda r: r["day"], user_id="u")
+    assert consumed == ["2024-05-01", "2024-05-02", "2024-05-01"]
+    # the day seen again later gets a second part rather than overwriting the first
+    assert [p["data_key"][-14:] for p in out["days"]["2024-05-01"]] == ["00001.jsonl.gz", "00002.jsonl.gz"]
+    assert out["record_count"] == 3
+
+
+def test_legacy_user_also_reads_objects_written_before_the_user_segment(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(s3io, "_s3", s3)
+    monkeypatch.setattr(s3io, "LEGACY_USER_ID", "owner")
+    old = s3io.write_jsonl_gz([{"a": 1}], "oura", "v2", "daily_sleep")
+    new = s3io.write_jsonl_gz([{"a": 2}], "oura", "v2", "daily_sleep", user_id="owner")
+    dt = json.loads(s3.objects[new["meta_key"]])["dt"]
+    assert s3io._list_ndjson_gz_keys("oura", "v2", "daily_sleep", dt, user_id="owner") == [new["data_key"], old["data_key"]]
+    assert s3io._list_ndjson_gz_keys("oura", "v2", "daily_sleep", dt, user_id="someone") == []
+
+
+def test_concurrent_pulls_in_the_same_second_do_not_collide(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(s3io, "_s3", s3)
+    records = [{"day": "2024-05-01", "score": 1}]
+    a = s3io.write_jsonl_gz_by_day(records, "oura", "v2", "daily_sleep", day_of=lambda r: r["day"], user_id="u")
+    b = s3io.write_jsonl_gz_by_day(records, "oura", "v2", "daily_sleep", day_of=lambda r: r["day"], user_id="u")
+    assert a["days"]["2024-05-01"][0]["data_key"] != b["days"]["2024-05-01"][0]["data_key"]
+    assert len(s3io.list_day_keys("oura", "v2", "daily_sleep", date(2024, 5, 1), date(2024, 5, 1), user_id="u")) == 2
@@ -0,0 +1,25 @@
+from scheduler import shard_of, users_for_shard
+
+
+def test_shard_of_is_stable_and_in_range():
+    for user_id in ["brucegarro", "alice", "bob"]:
+        assert shard_of(user_id, 4) == shard_of(user_id, 4)
+        assert 0 <= shard_of(user_id, 4) < 4
+
+def test_users_for_shard_partitions_all_users():
+    users = [f"user{i}" for i in range(50)]
+    shards = [users_for_shard(users, shard, 3) for shard in range(3)]
+    assert sorted(u for shard in shards for u in shard) == sorted(users)
+    assert all(shards)
+
+def test_users_for_shard_without_shard_returns_everyone():
+    assert users_for_shard(["a", "b"], None, 3) == ["a", "b"]
+
+
+def test_sharded_scheduler_requires_its_shard():
+    import pytest
+    from scheduler import main
+    with pytest.raises(SystemExit):
+        main(["--num-shards", "2"])
+    with pytest.raises(SystemExit):
+        main(["--shard", "2", "--num-shards", "2"])
@@ -0,0 +1,63 @@
+from datetime import date, timedelta
+
+import db
+import seen_dates
+
+
+class FakeRedis:
+    """Just enough of Redis' bitmap commands (bit 0 is the byte's high bit)."""
+
+    def __init__(self):
+        self.values = {}
+
+    def exists(self, key):
+        return int(key in self.values)
+
+    def setbit(self, key, offset, value):
+        buf = self.values.setdefault(key, bytearray())
+        if len(buf) <= offset // 8:
+            buf.extend(b"\0" * (offset // 8 + 1 - len(buf)))
+        if value:
+            buf[offset // 8] |= 0x80 >> (offset % 8)
+        else:
+            buf[offset // 8] &= ~(0x80 >> (offset % 8)) & 0xFF
+
+    def getrange(self, key, start, end):
+        return bytes(self.values.get(key, b""))[start:end + 1]
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        return []
+
+
+def test_missing_days_loads_from_seen_events_once(monkeypatch):
+    r = FakeRedis()
+    loads = []
+
+    def list_seen_dates(user_id, endpoint):
+        loads.append((user_id, endpoint))
+        return [date(2024, 1, 2), date(2024, 1, 9)]
+
+    monkeypatch.setattr(db, "list_seen_dates", list_seen_dates)
+    missing = seen_dates.missing_days("u", "daily_sleep", date(2024, 1, 1), date(2024, 1, 10), r)
+    assert date(2024, 1, 2) not in missing and date(2024, 1, 9) not in missing
+    assert len(missing) == 8 and missing[0] == date(2024, 1, 1)
+    seen_dates.missing_days("u", "daily_sleep", date(2024, 1, 1), date(2024, 1, 10), r)
+    assert loads == [("u", "daily_sleep")]
+
+
+def test_mark_seen_then_multi_year_window(monkeypatch):
+    r = FakeRedis()
+    monkeypatch.setattr(db, "list_seen_dates", lambda user_id, endpoint: [])
+    monkeypatch.setattr(db, "create_seen_events_bulk", lambda user_id, endpoint, dates: set(dates))
+    start = date(2021, 3, 5)
+    days = {start + timedelta(days=i) for i in range(3 * 365)}
+    assert seen_dates.mark_seen("u", "heartrate", days, r) == days
+    end = start + timedelta(days=3 * 365 + 2)
+    assert seen_dates.missing_days("u", "heartrate", start - timedelta(days=1), end, r) == [
+        start - timedelta(days=1), end - timedelta(days=2), end - timedelta(days=1), end,
+    ]
+    # other endpoints and users are separate bitmaps
+    assert len(seen_dates.missing_days("v", "heartrate", start, start, r)) == 1
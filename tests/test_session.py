@@ -0,0 +1,96 @@
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import auth.session as session
+import main
+
+
+class StateRedis:
+    def __init__(self):
+        self.values = {}
+
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    async def getdel(self, key):
+        return self.values.pop(key, None)
+
+
+@pytest.fixture
+def secret(monkeypatch):
+    monkeypatch.setattr(session, "SESSION_SECRET", "s3cret")
+
+
+def _request(cookie=None, query=b""):
+    headers = [(b"cookie", f"session={cookie}".encode())] if cookie else []
+    return Request({"type": "http", "headers": headers, "query_string": query})
+
+
+def test_session_round_trip_and_tampering(secret):
+    value = session.sign_session("alice.smith")
+    assert session.verify_session(value) == "alice.smith"
+    assert session.verify_session(value.replace("alice", "mallory")) is None
+    # a login link is not a session
+    assert session.verify_session(session.login_token("alice")) is None
+
+
+def test_session_expires(secret):
+    assert session.verify_session(session.sign_session("alice", ttl=-1)) is None
+
+
+def test_no_sessions_without_secret(monkeypatch):
+    monkeypatch.setattr(session, "SESSION_SECRET", None)
+    assert session.verify_session("9999999999.alice.abc") is None
+    assert main.get_user_id(_request(query=b"user_id=alice")) == main.DEFAULT_USER_ID
+
+
+def test_user_comes_from_the_cookie_not_the_query(secret):
+    request = _request(cookie=session.sign_session("alice"), query=b"user_id=bob")
+    assert main.get_user_id(request) == "alice"
+    with pytest.raises(HTTPException) as e:
+        main.get_user_id(_request(query=b"user_id=bob"))
+    assert e.value.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_login_link_works_once(secret):
+    redis = StateRedis()
+    token = session.login_token("alice")
+    assert await session.consume_login_token(token, redis) == "alice"
+    assert await session.consume_login_token(token, redis) is None
+
+
+@pytest.mark.asyncio
+async def test_oauth_state_is_single_use():
+    redis = StateRedis()
+    state = await session.issue_oauth_state("oura", "alice", redis)
+    assert await session.consume_oauth_state("oura", state, redis) == "alice"
+    assert await session.consume_oauth_state("oura", state, redis) is None
+    assert await session.consume_oauth_state("oura", "forged", redis) is None
+
+
+@pytest.mark.asyncio
+async def test_oura_callback_rejects_another_users_state(secret, monkeypatch):
+    from httpx import AsyncClient, ASGITransport
+    redis = StateRedis()
+    state = await session.issue_oauth_state("oura", "victim", redis)
+    main.app.dependency_overrides[main.get_redis_client] = lambda: redis
+    try:
+        async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test") as client:
+            client.cookies.set("session", session.sign_session("attacker", ttl=60))
+            response = await client.get("/oura_callback", params={"code": "c", "state": state})
+    finally:
+        main.app.dependency_overrides = {}
+    assert response.json() == {"message": "Error during callback: invalid state"}
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_stats_need_a_session(secret):
+    from httpx import AsyncClient, ASGITransport
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test") as client:
+        response = await client.get("/ratelimit")
+    assert response.status_code == 401
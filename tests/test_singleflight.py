@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "token"
+
+    results = await asyncio.gather(*[flight.do("user", work) for _ in range(10)])
+    assert results == ["token"] * 10
+    assert calls == 1
+
+
+@pytest.mark.asyncio
+async def test_key_is_released_after_completion():
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    assert await flight.do("user", work) == 1
+    assert await flight.do("user", work) == 2
+
+
+@pytest.mark.asyncio
+async def test_errors_propagate_to_all_waiters():
+    flight = SingleFlight()
+
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("refresh failed")
+
+    results = await asyncio.gather(*[flight.do("user", boom) for _ in range(3)], return_exceptions=True)
+    assert all(isinstance(r, RuntimeError) for r in results)
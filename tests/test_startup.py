@@ -0,0 +1,18 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_main_imports_without_config_or_heavy_deps():
+    # no DATABASE_URL / OURA_* in the environment: importing must not need them
+    env = {k: v for k, v in os.environ.items() if k in ("PATH", "HOME", "PYTHONPATH")}
+    code = (
+        "import json, sys, main; "
+        "print(json.dumps([m for m in ('sqlalchemy', 'rq', 'oura', 'boto3', 'polars', 'numpy', 'pyarrow', 'db') "
+        "if m in sys.modules]))"
+    )
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, check=True, capture_output=True, text=True)
+    assert json.loads(out.stdout.strip().splitlines()[-1]) == []
@@ -0,0 +1,103 @@
+import json
+from datetime import date
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+import main
+import status_snapshot
+from status_snapshot import auth_current, decode_snapshot, metrics_current, metrics_section, status_window
+
+
+def test_decode_snapshot_splits_ingest_fields():
+    raw = {
+        b"oura": b'{"valid": true, "auth_url": null, "expires_at": 100}',
+        "ingest:daily_sleep": "2025-10-01T08:00:00+00:00",
+    }
+    snapshot = decode_snapshot(raw)
+    assert snapshot["oura"]["valid"] is True
+    assert snapshot["last_ingest"] == {"daily_sleep": "2025-10-01T08:00:00+00:00"}
+
+
+def test_sections_go_stale():
+    assert auth_current({"valid": True, "expires_at": 100}, now=50)
+    assert not auth_current({"valid": True, "expires_at": 100}, now=150)
+    assert auth_current({"valid": True, "expires_at": None}, now=150)
+    # a failed check is retried shortly, not kept until the next token write
+    assert auth_current({"valid": False, "expires_at": 100}, now=50)
+    assert not auth_current({"valid": False, "expires_at": 100}, now=150)
+    assert not auth_current({"valid": False, "expires_at": None}, now=150)
+    assert not auth_current(None, now=0)
+    start, end = date(2025, 7, 3), date(2025, 10, 1)
+    section = metrics_section(4, start, end, [])
+    assert metrics_current(section, 4, start, end)
+    assert not metrics_current(section, 5, start, end)
+    assert not metrics_current(section, 4, start, date(2025, 10, 2))
+
+
+class FakeSyncRedis:
+    def __init__(self):
+        self.hashes = {}
+
+    def pipeline(self):
+        return self
+
+    def hset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update(mapping)
+
+    def expire(self, key, seconds):
+        pass
+
+    def execute(self):
+        pass
+
+
+def test_refresh_after_ingest_only_stamps_the_ingest_time():
+    r = FakeSyncRedis()
+    status_snapshot.refresh_after_ingest("u", "daily_sleep", redis_client=r)
+    snapshot = decode_snapshot(r.hashes["status:u"])
+    # the metrics section is rebuilt by /health against the new data version
+    assert "metrics" not in snapshot
+    assert "daily_sleep" in snapshot["last_ingest"]
+
+
+class SnapshotRedis:
+    def __init__(self, fields):
+        self.fields = fields
+
+    async def hgetall(self, key):
+        return self.fields
+
+
+@pytest.mark.asyncio
+async def test_health_served_from_current_snapshot(monkeypatch):
+    start, end = status_window()
+    fields = {
+        "oura": json.dumps({"valid": True, "auth_url": None, "expires_at": 9999999999}),
+        "dropbox": json.dumps({"valid": False, "auth_url": "/dropbox_start", "expires_at": 9999999999}),
+        "metrics": json.dumps(metrics_section(3, start, end, ["metrics_view"])),
+    }
+
+    async def version(user_id, redis_client=None):
+        return 3
+
+    async def must_not_run(*args, **kwargs):
+        raise AssertionError("section should have come from the snapshot")
+
+    async def no_ingestion(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(main, "aget_data_version", version)
+    for name in ("_oura_status", "_dropbox_status", "_metrics_status"):
+        monkeypatch.setattr(main, name, must_not_run)
+    monkeypatch.setattr(main, "_start_ingestion", no_ingestion)
+    main.app.dependency_overrides[main.get_redis_client] = lambda: SnapshotRedis(fields)
+    try:
+        async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test") as client:
+            data = (await client.get("/health")).json()
+    finally:
+        main.app.dependency_overrides = {}
+    assert data["metrics_view"] == ["metrics_view"]
+    assert data["oura_auth_valid"] is True
+    assert data["dropbox_auth_url"] == "/dropbox_start"
+    assert data["data_version"] == 3
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+from metrics.oura.timeseries import heartrate_samples, sleep_samples
+
+
+def test_heartrate_samples():
+    records = [{"bpm": 61, "source": "awake", "timestamp": "2025-10-01T08:00:00+00:00"}]
+    assert list(heartrate_samples(records)) == [
+        ("bpm", datetime.fromisoformat("2025-10-01T08:00:00+00:00"), 61.0),
+    ]
+
+
+def test_sleep_samples_expand_intervals_and_skip_gaps():
+    start = "2025-10-01T01:00:00+00:00"
+    records = [{
+        "day": "2025-10-01",
+        "hrv": {"interval": 300.0, "items": [40, None, 44], "timestamp": start},
+        "heart_rate": None,
+    }]
+    t0 = datetime.fromisoformat(start)
+    assert list(sleep_samples(records)) == [
+        ("hrv", t0, 40.0),
+        ("hrv", t0 + timedelta(seconds=600), 44.0),
+    ]
+
+
+def test_timeseries_job_is_only_enqueued_for_unseen_days(monkeypatch):
+    from datetime import date
+    from metrics.oura import timeseries
+
+    enqueued = []
+
+    class FakeQueue:
+        def enqueue(self, func, *args, **kwargs):
+            enqueued.append(args)
+            return type("Job", (), {"id": "ts"})()
+
+    monkeypatch.setattr(timeseries, "get_queue", lambda name: FakeQueue())
+    monkeypatch.setattr(timeseries, "track_job", lambda user_id, job: None)
+    monkeypatch.setattr(timeseries, "missing_days", lambda *a, **k: [])
+    assert timeseries.enqueue_timeseries("tok", date(2025, 1, 1), date(2025, 1, 31), "u") is None
+    monkeypatch.setattr(timeseries, "missing_days", lambda user_id, endpoint, *a: [date(2025, 1, 5)] * (endpoint == "sleep"))
+    assert timeseries.enqueue_timeseries("tok", date(2025, 1, 1), date(2025, 1, 31), "u") == "ts"
+    assert len(enqueued) == 1
+
+
+def test_settled_days_without_samples_are_marked_seen(monkeypatch):
+    from datetime import date
+    from metrics.oura import timeseries
+
+    today = date.today()
+    old, recent = today - timedelta(days=10), today - timedelta(days=1)
+    seen = {}
+    monkeypatch.setattr(timeseries, "SERIES_ENDPOINTS", ["heartrate"])
+    monkeypatch.setattr(timeseries, "missing_days", lambda *a, **k: [old, recent, today])
+    monkeypatch.setattr(timeseries, "get_paginated_data", lambda *a, **k: [])
+    monkeypatch.setattr(timeseries, "mark_seen", lambda user_id, endpoint, days: seen.setdefault(endpoint, set(days)))
+    timeseries._run_oura_timeseries("tok", old, today, "u")
+    # the ring may not have synced the last days yet; those stay unseen
+    assert seen == {"heartrate": {old}}
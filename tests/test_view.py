@@ -0,0 +1,98 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from db import series_cache
+from metrics import view
+
+
+@pytest.fixture(autouse=True)
+def seeded_series():
+    series_cache.clear()
+    series_cache.add([
+        (1, "u", "daily_sleep", "sleep_score", "wellness"),
+        (2, "u", "atracker", "coding", "productivity"),
+    ])
+    yield
+    series_cache.clear()
+
+
+def test_pivot_groups_by_day_and_category(monkeypatch):
+    rows = [
+        (1, date(2025, 10, 2), 81.0),
+        (1, date(2025, 10, 1), 77.0),
+        (2, date(2025, 10, 1), 2.5),
+    ]
+    monkeypatch.setattr(view, "iter_metrics", lambda *args: iter(rows))
+    pivot = view.get_metrics_pivot("u", date(2025, 10, 1), date(2025, 10, 2))
+    assert [d["date"] for d in pivot] == ["2025-10-01", "2025-10-02"]
+    assert pivot[0]["wellness"] == {"sleep_score": 77.0}
+    assert pivot[0]["productivity"] == {"coding": 2.5}
+    assert pivot[1]["productivity"] == {}
+
+
+def test_pivot_reloads_unknown_series(monkeypatch):
+    def load(user_id):
+        series_cache.add([(3, "u", "daily_readiness", "readiness_score", "wellness")])
+
+    monkeypatch.setattr(view, "iter_metrics", lambda *args: iter([(3, date(2025, 10, 1), 90.0)]))
+    monkeypatch.setattr(view, "load_user_series", load)
+    pivot = view.get_metrics_pivot("u", date(2025, 10, 1), date(2025, 10, 1))
+    assert pivot[0]["wellness"] == {"readiness_score": 90.0}
+
+
+def test_choose_resolution_by_span():
+    start = datetime(2025, 10, 1, tzinfo=timezone.utc)
+    assert view.choose_resolution(start, start + timedelta(hours=12)) == 0
+    assert view.choose_resolution(start, start + timedelta(days=3)) == 300
+    assert view.choose_resolution(start, start + timedelta(days=30)) == 3600
+    assert view.choose_resolution(start, start + timedelta(days=365)) == 86400
+
+
+def test_pivot_cache_evicts_least_recently_used_by_size():
+    row = [{"date": "2025-10-01", "wellness": {"sleep_score": 80.0}}]
+    size = view._approx_size(row)
+    cache = view.PivotCache(max_bytes=2 * size)
+    cache.put(("a", 1), row)
+    cache.put(("b", 1), row)
+    assert cache.get(("a", 1)) is row  # a is now most recently used
+    cache.put(("c", 1), row)
+    assert cache.get(("b", 1)) is None
+    assert cache.get(("a", 1)) is row and cache.size == 2 * size
+    cache.put(("huge", 1), row * 100)  # larger than the whole budget: not cached
+    assert cache.get(("huge", 1)) is None
+
+
+def test_pivot_cache_shares_concurrent_misses_and_drops_on_version_change():
+    cache = view.PivotCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return [{"date": "2025-10-01"}]
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute(("u", "d0", "d1", 3), compute) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1 and all(r is results[0] for r in results)
+    cache.put(("v", "d0", "d1", 1), [])
+    cache.drop_user("u")
+    assert cache.get(("u", "d0", "d1", 3)) is None and cache.get(("v", "d0", "d1", 1)) == []
+    cache.drop_user(None)
+    assert cache.size == 0
+
+
+def test_pivot_cache_does_not_store_a_fill_that_raced_a_version_change():
+    cache = view.PivotCache()
+
+    async def compute():
+        # the data version moves while the pivot is being read
+        cache.drop_user("u")
+        return [{"date": "2025-10-01"}]
+
+    result = asyncio.run(cache.get_or_compute(("u", "d0", "d1", 3), compute))
+    assert result == [{"date": "2025-10-01"}]
+    assert cache.get(("u", "d0", "d1", 3)) is None and cache.size == 0
@@ -0,0 +1,35 @@
+import os
+
+import db
+import workers
+from auth.cache import get_async_redis, reset_async_redis
+
+
+def _in_child(check) -> bool:
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if check() else 1)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status) == 0
+
+
+def test_forked_child_gets_its_own_engine_pool():
+    pool = db.get_engine().pool  # no connection is made
+    assert _in_child(lambda: db.get_engine().pool is not pool)
+    assert db.get_engine().pool is pool
+
+
+def test_reset_async_redis_empties_pool_in_place():
+    client = get_async_redis()
+    client.connection_pool._available_connections.append(object())
+    reset_async_redis()
+    assert get_async_redis() is client
+    assert client.connection_pool._available_connections == []
+
+
+def test_warm_worker_recycles_after_max_jobs(monkeypatch):
+    seen = {}
+    monkeypatch.setattr(workers.SimpleWorker, "work", lambda self, *a, **kw: seen.update(kw))
+    monkeypatch.setattr(workers, "ETL_WORKER_MAX_JOBS", 7)
+    workers.WarmWorker.work(object.__new__(workers.WarmWorker), burst=True)
+    assert seen == {"burst": True, "max_jobs": 7}
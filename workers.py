@@ -0,0 +1,75 @@
+"""RQ worker classes for the ETL pools.
+
+    rq worker-pool -w workers.WarmWorker -n 2 etl-high
+
+`rq worker-pool` imports this module in the pool's parent before it forks the
+worker processes, so the heavy ETL imports happen once and are shared
+copy-on-write. DB engines, the S3 client and async Redis pools are never
+carried across a fork (see the register_at_fork hooks in db, s3io and
+auth.cache).
+
+WarmWorker runs jobs in the worker process itself, so the engine pool and
+S3 client are reused from job to job; it exits after ETL_WORKER_MAX_JOBS and
+the pool starts a fresh one. PreloadedWorker keeps rq's fork-per-job
+isolation but still skips the import cost.
+"""
+import os
+import time
+import logging
+import importlib
+
+from rq import SimpleWorker, Worker
+
+ETL_WORKER_PRELOAD = os.getenv("ETL_WORKER_PRELOAD", "1") == "1"
+# Recycle a warm worker after this many jobs to bound leaks (0 = never)
+ETL_WORKER_MAX_JOBS = int(os.getenv("ETL_WORKER_MAX_JOBS", "500"))
+
+PRELOAD_MODULES = [
+    "polars",
+    "boto3",
+    "sqlalchemy.dialects.postgresql.psycopg2",
+    "db",
+    "s3io",
+    "etl_metrics",
+    "rolling_stats",
+    "metrics.oura.ingest",
+    "metrics.oura.timeseries",
+]
+
+
+def preload() -> None:
+    logger = logging.getLogger("workers")
+    start = time.perf_counter()
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            # a job that needs it will surface the real error
+            logger.warning(f"Preload of {name} failed: {e}")
+    logger.info(f"Preloaded {len(PRELOAD_MODULES)} modules in {time.perf_counter() - start:.2f}s")
+
+
+class PreloadedWorker(Worker):
+    """Fork-per-job worker; the forked job inherits the preloaded modules."""
+
+
+class WarmWorker(SimpleWorker):
+    """Runs jobs in-process, keeping connection pools and clients warm between jobs."""
+
+    def work(self, *args, **kwargs):
+        if ETL_WORKER_MAX_JOBS > 0:
+            kwargs.setdefault("max_jobs", ETL_WORKER_MAX_JOBS)
+        return super().work(*args, **kwargs)
+
+    def perform_job(self, job, queue):
+        try:
+            return super().perform_job(job, queue)
+        finally:
+            # jobs call asyncio.run(); the next one gets a new loop, so the
+            # shared async Redis client must not hand out the old loop's sockets
+            from auth.cache import reset_async_redis
+            reset_async_redis()
+
+
+if ETL_WORKER_PRELOAD:
+    preload()